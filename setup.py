@@ -7,5 +7,9 @@ setup(
     name="LearningApp",
     version="0.1",
     description="My Learning Application!",
-    executables=[Executable("src/main.py", base=base)],
+    executables=[
+        Executable("src/main.py", base=base),
+        # Headless tools for scripts and scheduled jobs
+        Executable("src/cli.py", base=None, target_name="learning-app"),
+    ],
 )
@@ -0,0 +1,208 @@
+import datetime
+import itertools
+import json
+import sqlite3
+import zlib
+import clock
+
+# Responses older than this are moved to the archive by default
+DEFAULT_ARCHIVE_AGE_DAYS = 180
+
+
+def create_archive_tables(conn):
+    """
+    Create the compressed archive of old recall session responses.
+    """
+    try:
+        c = conn.cursor()
+
+        # One row per concept and archive run: the responses of sessions
+        # first_session_id..last_session_id as zlib-compressed JSON
+        # [[session_id, user_response], ...]
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS response_archive (
+                id INTEGER PRIMARY KEY,
+                concept_id INTEGER NOT NULL,
+                first_session_id INTEGER NOT NULL,
+                last_session_id INTEGER NOT NULL,
+                session_count INTEGER NOT NULL,
+                responses BLOB NOT NULL,
+                FOREIGN KEY (concept_id) REFERENCES concepts (id)
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_response_archive_concept ON response_archive (concept_id)")
+
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error creating archive tables: {e}")
+
+
+def _pack(responses):
+    return zlib.compress(json.dumps(responses, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def archive_responses(conn, older_than_days=DEFAULT_ARCHIVE_AGE_DAYS, now=None):
+    """
+    Move the responses of sessions older than older_than_days into the archive.
+
+    The sessions stay in recall_sessions with their timestamp and grade, which
+    is all scheduling reads; only user_response is cleared. Responses are
+    compressed per concept, so similar answers to the same concept share one
+    zlib stream. Run compact_database afterwards to return the freed pages.
+
+    :param conn: the Connection object
+    :param older_than_days: minimum age of archived sessions
+    :param now: reference time (defaults to clock.now())
+    :return: number of archived sessions, or None on error
+    """
+    cutoff = (now or clock.now()) - datetime.timedelta(days=older_than_days)
+    try:
+        read_cur = conn.cursor()
+        read_cur.execute("""
+            SELECT id, concept_id, user_response
+            FROM recall_sessions
+            WHERE timestamp < ? AND user_response IS NOT NULL
+            ORDER BY concept_id, id
+        """, (cutoff.isoformat(),))
+
+        write_cur = conn.cursor()
+        archived = 0
+        group = []
+
+        def write_group():
+            write_cur.execute("""
+                INSERT INTO response_archive (concept_id, first_session_id, last_session_id, session_count, responses)
+                VALUES (?, ?, ?, ?, ?)
+            """, (group[0][1], group[0][0], group[-1][0], len(group),
+                  _pack([[session_id, response] for session_id, _, response in group])))
+            write_cur.executemany("UPDATE recall_sessions SET user_response = NULL WHERE id = ?",
+                                  [(session_id,) for session_id, _, _ in group])
+
+        # Sessions arrive grouped by concept; one archive row per concept
+        for row in read_cur:
+            if group and row[1] != group[0][1]:
+                write_group()
+                archived += len(group)
+                group = []
+            group.append(row)
+        if group:
+            write_group()
+            archived += len(group)
+
+        conn.commit()
+        return archived
+    except sqlite3.Error as e:
+        print(e)
+        conn.rollback()
+        return None
+
+
+def get_recall_history(conn, concept_id):
+    """
+    Get every recall session of a concept, with archived responses read back.
+
+    :param conn: the Connection object
+    :param concept_id:
+    :return: list of (session_id, timestamp, user_response, ai_grade) ordered by time
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT responses FROM response_archive WHERE concept_id = ?", (concept_id,))
+    archived = {}
+    for (blob,) in cur.fetchall():
+        archived.update((session_id, response) for session_id, response in _unpack(blob))
+
+    cur.execute("""
+        SELECT id, timestamp, user_response, ai_grade
+        FROM recall_sessions
+        WHERE concept_id = ?
+        ORDER BY timestamp, id
+    """, (concept_id,))
+    return [(session_id, timestamp, response if response is not None else archived.get(session_id), grade)
+            for session_id, timestamp, response, grade in cur.fetchall()]
+
+
+def get_response(conn, session_id):
+    """
+    Get the response of one recall session, reading the archive if needed.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT concept_id, user_response FROM recall_sessions WHERE id = ?", (session_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    concept_id, response = row
+    if response is not None:
+        return response
+
+    cur.execute("""
+        SELECT responses FROM response_archive
+        WHERE concept_id = ? AND ? BETWEEN first_session_id AND last_session_id
+    """, (concept_id, session_id))
+    for (blob,) in cur.fetchall():
+        for archived_id, archived_response in _unpack(blob):
+            if archived_id == session_id:
+                return archived_response
+    return None
+
+
+def with_archived_responses(conn, rows, response_column=2, batch_size=1000):
+    """
+    Fill in the archived responses of streamed recall session rows, so bulk
+    readers see the same responses as before archiving.
+
+    Rows are taken in batches, and each batch unpacks only the archive rows
+    covering its archived sessions, so memory stays bounded on any history.
+
+    :param conn: the Connection object
+    :param rows: iterable of rows starting with (session_id, concept_id)
+    :param response_column: index of user_response in a row
+    :param batch_size: rows per archive lookup
+    :return: iterator of the rows as tuples, with archived responses read back
+             (None for sessions that never had a response)
+    """
+    rows = iter(rows)
+    cur = conn.cursor()
+    for batch in iter(lambda: [tuple(row) for row in itertools.islice(rows, batch_size)], []):
+        missing = [row for row in batch if row[response_column] is None]
+        archived = {}
+        if missing:
+            concept_ids = sorted({row[1] for row in missing})
+            cur.execute(f"""
+                SELECT responses FROM response_archive
+                WHERE concept_id IN ({','.join('?' * len(concept_ids))})
+                  AND last_session_id >= ? AND first_session_id <= ?
+            """, (*concept_ids, min(row[0] for row in missing), max(row[0] for row in missing)))
+            wanted = {row[0] for row in missing}
+            for (blob,) in cur.fetchall():
+                archived.update((session_id, response) for session_id, response in _unpack(blob)
+                                if session_id in wanted)
+        for row in batch:
+            if row[response_column] is None and row[0] in archived:
+                row = row[:response_column] + (archived[row[0]],) + row[response_column + 1:]
+            yield row
+
+
+def compact_database(conn):
+    """
+    Rebuild the database file to return the pages freed by archiving.
+
+    VACUUM cannot run inside a transaction, so pending changes are committed
+    first. It needs temporary disk space of up to the database's size.
+
+    :return: (bytes before, bytes after)
+    """
+    def size():
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    conn.commit()
+    before = size()
+    conn.execute("VACUUM")
+    # Refresh query planner statistics for the smaller tables
+    conn.execute("PRAGMA optimize")
+    return before, size()
@@ -0,0 +1,211 @@
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import clock
+
+BACKUP_DIR = "data/backups"
+DEFAULT_KEEP = 7
+# Pages copied per backup step; the source is only locked while a step runs
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+
+
+def _backup_stem(db_file):
+    return os.path.splitext(os.path.basename(db_file))[0]
+
+
+def list_backups(db_file, backup_dir=BACKUP_DIR):
+    """
+    Backups of a database, oldest first.
+
+    Only names made by backup_database match, so backups of another
+    database whose name starts with this one's (bio-advanced.db next to
+    bio.db) are left out.
+    """
+    if not os.path.isdir(backup_dir):
+        return []
+    pattern = re.compile(re.escape(_backup_stem(db_file)) + r"-\d{8}-\d{6}-\d{6}\.db(\.gz)?")
+    # Names embed a sortable timestamp
+    return [os.path.join(backup_dir, name) for name in sorted(os.listdir(backup_dir)) if pattern.fullmatch(name)]
+
+
+def backup_database(db_file, backup_dir=BACKUP_DIR, compress=False, pages=PAGES_PER_STEP, sleep=STEP_SLEEP,
+                    progress=None):
+    """
+    Copy a live database with the SQLite online backup API.
+
+    The copy runs in steps of `pages` pages with a pause in between, so other
+    connections, including the app's own, keep reading and writing while it
+    runs; SQLite restarts the copy if the source changes between steps. Uses
+    its own connection, so it can run on any thread.
+
+    :param db_file: database to back up
+    :param backup_dir: directory for the backups
+    :param compress: gzip the finished backup
+    :param pages: pages copied per step
+    :param sleep: seconds to pause between steps
+    :param progress: optional callback(status, remaining, total) as for Connection.backup
+    :return: path of the backup
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{_backup_stem(db_file)}-{clock.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+    path = os.path.join(backup_dir, name)
+    partial = path + ".partial"
+
+    source = sqlite3.connect(db_file)
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=sleep)
+    finally:
+        target.close()
+        source.close()
+
+    if compress:
+        with open(partial, "rb") as raw, gzip.open(partial + ".gz", "wb") as packed:
+            shutil.copyfileobj(raw, packed)
+        os.remove(partial)
+        partial, path = partial + ".gz", path + ".gz"
+    # Only complete backups get a name list_backups matches
+    os.replace(partial, path)
+    return path
+
+
+def rotate_backups(db_file, backup_dir=BACKUP_DIR, keep=DEFAULT_KEEP):
+    """
+    Delete all but the newest `keep` backups of a database.
+
+    :return: list of deleted paths
+    """
+    backups = list_backups(db_file, backup_dir)
+    expired = backups[:-keep] if keep > 0 else backups
+    for path in expired:
+        os.remove(path)
+    return expired
+
+
+def _open_backup(path):
+    """
+    Open a backup read-only; compressed backups are unpacked to a temporary file.
+
+    :return: (connection, temporary path or None)
+    """
+    if not path.endswith(".gz"):
+        return sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True), None
+    fd, unpacked = tempfile.mkstemp(suffix=".db")
+    with os.fdopen(fd, "wb") as raw, gzip.open(path, "rb") as packed:
+        shutil.copyfileobj(packed, raw)
+    return sqlite3.connect(unpacked), unpacked
+
+
+def verify_backup(path):
+    """
+    Check a backup with PRAGMA integrity_check.
+
+    :return: (ok, message)
+    """
+    conn, unpacked = None, None
+    try:
+        conn, unpacked = _open_backup(path)
+        result = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if result == ["ok"]:
+            tables = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+            return True, f"ok ({tables} tables)"
+        return False, "; ".join(result)
+    except (sqlite3.Error, OSError) as e:
+        return False, str(e)
+    finally:
+        if conn:
+            conn.close()
+        if unpacked:
+            os.remove(unpacked)
+
+
+def restore_backup(path, db_file, pages=PAGES_PER_STEP):
+    """
+    Verify a backup and copy it over a database.
+
+    The copy goes through the backup API into the existing file, so it is
+    safe in WAL mode, but other connections to db_file should be closed
+    first: they would see the database change under them.
+
+    :raises ValueError: if the backup fails verification
+    """
+    ok, message = verify_backup(path)
+    if not ok:
+        raise ValueError(f"Backup {path} failed verification: {message}")
+
+    source, unpacked = _open_backup(path)
+    target = sqlite3.connect(db_file)
+    try:
+        source.backup(target, pages=pages)
+    finally:
+        target.close()
+        source.close()
+        if unpacked:
+            os.remove(unpacked)
+
+
+class BackupScheduler:
+    """
+    Back up a database periodically on a background thread, keeping the
+    newest backups.
+    """
+
+    def __init__(self, db_file, backup_dir=BACKUP_DIR, interval_s=24 * 3600, keep=DEFAULT_KEEP, compress=True):
+        self.db_file = db_file
+        self.backup_dir = backup_dir
+        self.interval_s = interval_s
+        self.keep = keep
+        self.compress = compress
+        self.last_backup = None
+        self.last_error = None
+        self.requested = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="backup", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run_now(self):
+        """
+        Request a backup without waiting for the interval.
+        """
+        self.requested.set()
+
+    def seconds_until_due(self):
+        backups = list_backups(self.db_file, self.backup_dir)
+        if not backups:
+            return 0
+        age = time.time() - os.path.getmtime(backups[-1])
+        return max(self.interval_s - age, 0)
+
+    def run(self):
+        while not self.stopping.is_set():
+            # The newest backup's age carries the schedule across restarts
+            self.requested.wait(self.seconds_until_due())
+            if self.stopping.is_set():
+                break
+            self.requested.clear()
+            try:
+                self.last_backup = backup_database(self.db_file, self.backup_dir, compress=self.compress)
+                rotate_backups(self.db_file, self.backup_dir, self.keep)
+                self.last_error = None
+            except (sqlite3.Error, OSError) as e:
+                print(f"Backup failed: {e}")
+                self.last_error = e
+                self.stopping.wait(min(self.interval_s, 600))
+
+    def stop(self, wait=True):
+        """
+        Stop the thread; a backup in progress finishes first when waiting.
+        """
+        self.stopping.set()
+        self.requested.set()
+        if wait and self.thread.is_alive():
+            self.thread.join()
@@ -0,0 +1,545 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+# learning-app: headless command-line access to the learning database.
+# Subcommands import only the modules they use, so e.g. `due` and `export`
+# start without Tk, matplotlib or numpy.
+
+DB_FILE = "data/learning_data.db"
+
+EXPORT_TABLES = {
+    "topics": "SELECT id, name FROM topics ORDER BY id",
+    "concepts": """SELECT c.id, c.topic_id, c.content, b.body, b.compressed
+                    FROM concepts c LEFT JOIN concept_bodies b ON b.concept_id = c.id ORDER BY c.id""",
+    "sessions": "SELECT id, concept_id, timestamp, user_response, ai_grade FROM recall_sessions ORDER BY id",
+    "learning_data": "SELECT concept_id, difficulty, stability FROM learning_data ORDER BY concept_id",
+}
+
+
+def write_rows(rows, columns, fmt, out=None):
+    """
+    Stream rows to `out` as CSV (with a header) or JSON lines.
+
+    :return: number of rows written
+    """
+    out = out or sys.stdout
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row))) + "\n")
+            count += 1
+    return count
+
+
+def read_concepts(source, fmt):
+    """
+    Read (topic, content) pairs from CSV with a topic,content header or from
+    JSON lines with topic and content keys.
+    """
+    if fmt == "csv":
+        for record in csv.DictReader(source):
+            yield record["topic"], record["content"]
+    else:
+        for line in source:
+            if line.strip():
+                record = json.loads(line)
+                yield record["topic"], record["content"]
+
+
+def database_path(args):
+    if args.deck:
+        from shards import DeckManager
+        return DeckManager().deck_path(args.deck)
+    return args.db
+
+
+def open_database(args, create=False):
+    from database import create_connection, init_schema
+
+    path = database_path(args)
+    if not create and not os.path.exists(path):
+        raise SystemExit(f"learning-app: no database at {path}")
+    conn = create_connection(path)
+    if conn is None:
+        raise SystemExit(f"learning-app: cannot open {path}")
+    # Add the tables, indexes and triggers newer than the database
+    init_schema(conn)
+    return conn
+
+
+def cmd_due(args):
+    from knowledge_base import iter_due_concepts, DUE_RETRIEVABILITY
+
+    conn = open_database(args)
+    threshold = DUE_RETRIEVABILITY if args.threshold is None else args.threshold
+    rows = iter_due_concepts(conn, threshold=threshold, include_new=args.include_new, limit=args.limit)
+    write_rows(rows, ["concept_id", "topic_id", "topic", "content", "retrievability"], args.format)
+    conn.close()
+
+
+def cmd_mastery(args):
+    from database import get_all_topics_with_mastery
+
+    conn = open_database(args)
+    write_rows(get_all_topics_with_mastery(conn), ["topic_id", "topic", "mastery"], args.format)
+    conn.close()
+
+
+def cmd_import(args):
+    from itertools import groupby
+    from database import add_topic, add_concepts
+
+    conn = open_database(args, create=True)
+    source = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    topic_ids = dict(conn.execute("SELECT name, id FROM topics"))
+    imported = 0
+    try:
+        # Consecutive records of the same topic are loaded in one transaction
+        for topic, records in groupby(read_concepts(source, args.format), key=lambda record: record[0]):
+            if topic not in topic_ids:
+                topic_ids[topic] = add_topic(conn, topic)
+            concept_ids = None
+            if topic_ids[topic] is not None:
+                concept_ids = add_concepts(conn, topic_ids[topic], [content for _, content in records])
+            if concept_ids is None:
+                raise SystemExit(f"learning-app: import failed at topic {topic!r}")
+            imported += len(concept_ids)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        conn.close()
+    print(f"Imported {imported} concepts", file=sys.stderr)
+
+
+def cmd_export(args):
+    conn = open_database(args)
+    cur = conn.execute(EXPORT_TABLES[args.table])
+    rows, columns = cur, [column[0] for column in cur.description]
+    if args.table == "concepts":
+        # Full texts, also of long concepts stored out of line
+        from concept_bodies import full_content
+        rows = ((concept_id, topic_id, full_content(*content)) for concept_id, topic_id, *content in cur)
+        columns = columns[:3]
+    elif args.table == "sessions":
+        # Including the responses moved to the archive
+        from archive import with_archived_responses
+        rows = with_archived_responses(conn, cur, response_column=3)
+    write_rows(rows, columns, args.format)
+    conn.close()
+
+
+def cmd_replay(args):
+    from review import replay_reviews
+
+    conn = open_database(args)
+    rebuilt = replay_reviews(conn)
+    if rebuilt is None:
+        raise SystemExit("learning-app: replay failed")
+    print(f"Rebuilt the FSRS state of {rebuilt} concepts", file=sys.stderr)
+    if args.history:
+        from mastery_history import backfill_mastery_history
+        days = backfill_mastery_history(conn)
+        print(f"Rebuilt {days} days of mastery history", file=sys.stderr)
+    conn.close()
+
+
+def cmd_regrade(args):
+    from grading_pipeline import regrade_history
+    from review import replay_reviews
+
+    conn = open_database(args)
+    changed = set()
+    regraded = regrade_history(conn, max_workers=args.workers, changed=changed)
+    print(f"Re-graded {regraded} sessions", file=sys.stderr)
+    # Only concepts whose grades changed need their FSRS state rebuilt
+    rebuilt = replay_reviews(conn, changed)
+    if rebuilt is None:
+        raise SystemExit("learning-app: replay failed")
+    print(f"Rebuilt the FSRS state of {rebuilt} concepts", file=sys.stderr)
+    conn.close()
+
+
+def cmd_dedupe(args):
+    from dedupe import dedupe_report, rebuild_index, DEFAULT_THRESHOLD
+    from concept_bodies import full_content
+
+    conn = open_database(args)
+    if args.rebuild:
+        indexed = rebuild_index(conn)
+        print(f"Indexed {indexed} concepts", file=sys.stderr)
+    threshold = DEFAULT_THRESHOLD if args.threshold is None else args.threshold
+    clusters = dedupe_report(conn, threshold=threshold)
+
+    def rows():
+        # One row per concept, numbered by cluster
+        for number, cluster in enumerate(clusters, 1):
+            for concept_id in cluster:
+                topic, *content = conn.execute("""
+                    SELECT t.name, c.content, b.body, b.compressed
+                    FROM concepts c
+                    JOIN topics t ON t.id = c.topic_id
+                    LEFT JOIN concept_bodies b ON b.concept_id = c.id
+                    WHERE c.id = ?
+                """, (concept_id,)).fetchone()
+                yield number, concept_id, topic, full_content(*content)
+
+    write_rows(rows(), ["cluster", "concept_id", "topic", "content"], args.format)
+    print(f"Found {len(clusters)} clusters of near-duplicates", file=sys.stderr)
+    conn.close()
+
+
+def lookup_id(conn, table, name, label):
+    row = conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        raise SystemExit(f"learning-app: no {label} named {name!r}")
+    return row[0]
+
+
+def cmd_areas(args):
+    from knowledge_base import add_knowledge_area, assign_topic_to_area
+
+    conn = open_database(args)
+    if args.action == "list":
+        rows = conn.execute("""
+            SELECT a.id, a.name, p.name, (SELECT COUNT(*) FROM topic_areas ta WHERE ta.area_id = a.id)
+            FROM knowledge_areas a
+            LEFT JOIN knowledge_area_closure cl ON cl.descendant_id = a.id AND cl.depth = 1
+            LEFT JOIN knowledge_areas p ON p.id = cl.ancestor_id
+            ORDER BY a.id
+        """)
+        write_rows(rows, ["area_id", "name", "parent", "topics"], args.format)
+    elif args.action == "add":
+        parent_id = lookup_id(conn, "knowledge_areas", args.parent, "area") if args.parent else None
+        area_id = add_knowledge_area(conn, args.name, parent_id)
+        if area_id is None:
+            raise SystemExit(f"learning-app: cannot add area {args.name!r}")
+        print(area_id)
+    else:
+        topic_id = lookup_id(conn, "topics", args.topic, "topic")
+        assign_topic_to_area(conn, topic_id, lookup_id(conn, "knowledge_areas", args.area, "area"))
+    conn.close()
+
+
+def cmd_archive(args):
+    from archive import archive_responses
+
+    conn = open_database(args)
+    archived = archive_responses(conn, older_than_days=args.older_than)
+    if archived is None:
+        raise SystemExit("learning-app: archiving failed")
+    print(f"Archived the responses of {archived} sessions", file=sys.stderr)
+    conn.close()
+
+
+def cmd_compact(args):
+    from archive import compact_database
+
+    conn = open_database(args)
+    before, after = compact_database(conn)
+    print(f"Compacted {before} bytes to {after} bytes", file=sys.stderr)
+    conn.close()
+
+
+def cmd_sync(args):
+    from sync import get_device_id, export_changes, import_changes
+
+    conn = open_database(args)
+    if args.action == "device":
+        print(get_device_id(conn))
+    elif args.action == "export":
+        written = export_changes(conn, args.file, args.peer, since=args.since)
+        print(f"Exported {written} changes", file=sys.stderr)
+    else:
+        summary = import_changes(conn, args.file)
+        print(f"Merged {summary['merged']} changes, replayed {summary['replayed']} concepts", file=sys.stderr)
+    conn.close()
+
+
+def cmd_backup(args):
+    from backup import backup_database, rotate_backups
+
+    path = database_path(args)
+    if not os.path.exists(path):
+        raise SystemExit(f"learning-app: no database at {path}")
+    backup = backup_database(path, args.dir, compress=args.compress)
+    expired = rotate_backups(path, args.dir, keep=args.keep)
+    print(backup)
+    print(f"Removed {len(expired)} old backups", file=sys.stderr)
+
+
+def cmd_verify(args):
+    from backup import verify_backup
+
+    ok, message = verify_backup(args.backup)
+    print(f"{args.backup}: {message}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def cmd_restore(args):
+    from backup import restore_backup
+
+    try:
+        restore_backup(args.backup, database_path(args))
+    except ValueError as e:
+        raise SystemExit(f"learning-app: {e}")
+    print(f"Restored {args.backup}", file=sys.stderr)
+
+
+def cmd_bench(args):
+    from database import get_next_concept_to_review, compute_topic_mastery, get_all_topics
+    from knowledge_base import iter_due_concepts
+
+    conn = open_database(args)
+    topic_ids = [topic_id for topic_id, _ in get_all_topics(conn)]
+    operations = {
+        "next_concept": lambda: get_next_concept_to_review(conn),
+        "due_list": lambda: sum(1 for _ in iter_due_concepts(conn)),
+        "topic_mastery": lambda: [compute_topic_mastery(conn, topic_id) for topic_id in topic_ids],
+    }
+    if not args.skip_forecast:
+        from forecast import forecast_reviews
+        operations["forecast"] = lambda: forecast_reviews(conn, horizon_days=30)
+
+    rows = []
+    for name, operation in operations.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        rows.append((name, args.repeat, timings[0] * 1000, timings[len(timings) // 2] * 1000, timings[-1] * 1000))
+    write_rows(rows, ["operation", "repeat", "min_ms", "median_ms", "max_ms"], args.format)
+    conn.close()
+
+
+def cmd_plans(args):
+    from query_plans import check_query_plans, format_plan_report
+
+    conn = open_database(args)
+    checks = check_query_plans(conn)
+    conn.close()
+    print(format_plan_report(checks))
+    if any(check.problems for check in checks):
+        raise SystemExit(1)
+
+
+def parse_mix(text):
+    """
+    Parse an operation mix such as "next_card=6,submit=3,mastery=1".
+    """
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        try:
+            mix[name.strip()] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid mix entry {part!r}, expected name=weight")
+    return mix
+
+
+def cmd_loadtest(args):
+    import shutil
+    import tempfile
+    from loadtest import generate_database, run_load_test
+
+    workdir = tempfile.mkdtemp(prefix="learning-app-loadtest-")
+    try:
+        template = os.path.join(workdir, "template.db")
+        concepts = generate_database(template, topics=args.topics, concepts_per_topic=args.concepts_per_topic)
+        print(f"Generated {concepts} concepts in {workdir}", file=sys.stderr)
+
+        rows = []
+        for journal_mode in args.journal_mode:
+            for workers in args.workers:
+                # Every setting starts from the same deck
+                db_file = os.path.join(workdir, f"run-{journal_mode}-{workers}.db")
+                shutil.copyfile(template, db_file)
+                try:
+                    report = run_load_test(db_file, workers=workers, mode=args.mode, duration=args.duration,
+                                           mix=args.mix, journal_mode=journal_mode,
+                                           busy_timeout_ms=args.busy_timeout, synchronous=args.synchronous)
+                except ValueError as e:
+                    raise SystemExit(f"learning-app: {e}")
+                for name, stats in report["operations"].items():
+                    timings = [stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], stats["max_ms"],
+                               report["lock_wait_p95_ms"], report["lock_wait_max_ms"]]
+                    p50, p95, p99, slowest, wait_p95, wait_max = [None if value is None else round(value, 3)
+                                                                  for value in timings]
+                    rows.append((report["journal_mode"], workers, args.mode, name, stats["count"],
+                                 round(stats["per_second"], 1), p50, p95, p99, slowest,
+                                 stats["locked_errors"], stats["other_errors"], wait_p95, wait_max))
+        write_rows(rows, ["journal_mode", "workers", "mode", "operation", "count", "per_second", "p50_ms",
+                          "p95_ms", "p99_ms", "max_ms", "locked_errors", "other_errors",
+                          "lock_wait_p95_ms", "lock_wait_max_ms"], args.format)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def cmd_memory(args):
+    from memory_budget import (DEFAULT_BUDGETS, OPERATIONS, load_budgets, profile_memory, over_budget,
+                               format_memory_report)
+
+    unknown = set(args.operations or []) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"learning-app: unknown operations: {', '.join(sorted(unknown))}")
+    budgets = load_budgets(args.budgets) if args.budgets else DEFAULT_BUDGETS
+    results = profile_memory(args.sizes, args.operations, budgets)
+    if args.format == "text":
+        print(format_memory_report(results))
+    else:
+        write_rows([(*result, "over" if over_budget(result) else "ok") for result in results],
+                   ["operation", "concepts", "peak_bytes", "retained_bytes", "peak_budget", "retained_budget",
+                    "status"], args.format)
+    if any(over_budget(result) for result in results):
+        raise SystemExit(1)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="learning-app", description="Headless learning database tools")
+    location = parser.add_mutually_exclusive_group()
+    location.add_argument("--db", default=DB_FILE, help=f"database file (default {DB_FILE})")
+    location.add_argument("--deck", help="per-learner or per-subject deck name")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_format(subparser, default="json"):
+        subparser.add_argument("--format", choices=["json", "csv"], default=default)
+
+    due = subparsers.add_parser("due", help="list concepts due for review")
+    due.add_argument("--threshold", type=float, help="due at or below this retrievability (default 0.9)")
+    due.add_argument("--include-new", action="store_true", help="also list never-reviewed concepts")
+    due.add_argument("--limit", type=int)
+    add_format(due)
+    due.set_defaults(func=cmd_due)
+
+    mastery = subparsers.add_parser("mastery", help="report topic mastery")
+    add_format(mastery)
+    mastery.set_defaults(func=cmd_mastery)
+
+    import_ = subparsers.add_parser("import", help="import concepts (topic, content records)")
+    import_.add_argument("file", help="input file, or - for stdin")
+    add_format(import_, default="csv")
+    import_.set_defaults(func=cmd_import)
+
+    export = subparsers.add_parser("export", help="export a table")
+    export.add_argument("table", choices=sorted(EXPORT_TABLES))
+    add_format(export)
+    export.set_defaults(func=cmd_export)
+
+    replay = subparsers.add_parser("replay", help="rebuild FSRS state from the review log")
+    replay.add_argument("--history", action="store_true", help="also rebuild the daily mastery history")
+    replay.set_defaults(func=cmd_replay)
+
+    regrade = subparsers.add_parser("regrade", help="re-grade stored responses with the current grader "
+                                                    "and rebuild the FSRS state they change")
+    regrade.add_argument("--workers", type=int, help="grading processes (default one per CPU)")
+    regrade.set_defaults(func=cmd_regrade)
+
+    dedupe = subparsers.add_parser("dedupe", help="report clusters of near-duplicate concepts")
+    dedupe.add_argument("--threshold", type=float, help="minimum similarity (default 0.8)")
+    dedupe.add_argument("--rebuild", action="store_true", help="rebuild the near-duplicate index first")
+    add_format(dedupe)
+    dedupe.set_defaults(func=cmd_dedupe)
+
+    areas = subparsers.add_parser("areas", help="organize topics into a tree of knowledge areas")
+    area_actions = areas.add_subparsers(dest="action", required=True)
+    add_format(area_actions.add_parser("list", help="list the knowledge areas"))
+    area_add = area_actions.add_parser("add", help="add a knowledge area")
+    area_add.add_argument("name")
+    area_add.add_argument("--parent", help="name of the parent area (default: a root area)")
+    area_assign = area_actions.add_parser("assign", help="place a topic in a knowledge area")
+    area_assign.add_argument("topic", help="topic name")
+    area_assign.add_argument("area", help="area name")
+    areas.set_defaults(func=cmd_areas)
+
+    archive = subparsers.add_parser("archive", help="compress and archive old responses")
+    archive.add_argument("--older-than", type=int, default=180, metavar="DAYS",
+                         help="archive sessions older than this many days (default 180)")
+    archive.set_defaults(func=cmd_archive)
+
+    compact = subparsers.add_parser("compact", help="VACUUM the database to return freed space")
+    compact.set_defaults(func=cmd_compact)
+
+    sync = subparsers.add_parser("sync", help="exchange changes with another device")
+    sync_actions = sync.add_subparsers(dest="action", required=True)
+    sync_actions.add_parser("device", help="print this database's device id")
+    sync_export = sync_actions.add_parser("export", help="write the changes a peer has not received")
+    sync_export.add_argument("peer", help="device id of the receiving peer")
+    sync_export.add_argument("file")
+    sync_export.add_argument("--since", type=int, help="resend every change after this sequence number")
+    sync_import = sync_actions.add_parser("import", help="merge a peer's change file")
+    sync_import.add_argument("file")
+    sync.set_defaults(func=cmd_sync)
+
+    backup = subparsers.add_parser("backup", help="back up the database while it is in use")
+    backup.add_argument("--dir", default="data/backups", help="backup directory (default data/backups)")
+    backup.add_argument("--compress", action="store_true", help="gzip the backup")
+    backup.add_argument("--keep", type=int, default=7, help="number of backups to keep (default 7)")
+    backup.set_defaults(func=cmd_backup)
+
+    verify = subparsers.add_parser("verify", help="check a backup's integrity")
+    verify.add_argument("backup")
+    verify.set_defaults(func=cmd_verify)
+
+    restore = subparsers.add_parser("restore", help="verify a backup and restore it over the database")
+    restore.add_argument("backup")
+    restore.set_defaults(func=cmd_restore)
+
+    bench = subparsers.add_parser("bench", help="time scheduling and reporting queries")
+    bench.add_argument("--repeat", type=int, default=5)
+    bench.add_argument("--skip-forecast", action="store_true", help="skip the numpy forecast")
+    add_format(bench)
+    bench.set_defaults(func=cmd_bench)
+
+    loadtest = subparsers.add_parser("loadtest", help="measure contention between concurrent readers and writers "
+                                                      "on a generated deck")
+    loadtest.add_argument("--workers", type=int, nargs="+", default=[4], help="worker counts to compare")
+    loadtest.add_argument("--mode", choices=["thread", "process"], default="thread")
+    loadtest.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    loadtest.add_argument("--journal-mode", nargs="+", default=["wal"], choices=["wal", "delete", "truncate", "persist"],
+                          help="journal modes to compare")
+    loadtest.add_argument("--busy-timeout", type=int, default=5000, help="lock wait limit in milliseconds")
+    loadtest.add_argument("--synchronous", choices=["OFF", "NORMAL", "FULL"])
+    loadtest.add_argument("--mix", type=parse_mix, help="operation weights, e.g. next_card=6,submit=3,mastery=1")
+    loadtest.add_argument("--topics", type=int, default=10)
+    loadtest.add_argument("--concepts-per-topic", type=int, default=200)
+    add_format(loadtest)
+    loadtest.set_defaults(func=cmd_loadtest)
+
+    memory = subparsers.add_parser("memory", help="profile peak and retained memory of operations on "
+                                                  "generated decks against budgets")
+    memory.add_argument("--sizes", type=int, nargs="+", help="deck sizes in concepts (default 1000 5000)")
+    memory.add_argument("--operations", nargs="+", help="operations to profile (default all)")
+    memory.add_argument("--budgets", help="JSON file overriding per-operation budgets")
+    memory.add_argument("--format", choices=["text", "json", "csv"], default="text")
+    memory.set_defaults(func=cmd_memory)
+
+    plans = subparsers.add_parser("plans", help="check that hot queries use their indexes")
+    plans.set_defaults(func=cmd_plans)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except BrokenPipeError:
+        # Output piped into e.g. head; not an error
+        sys.stderr.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
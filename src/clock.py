@@ -0,0 +1,63 @@
+import datetime
+from contextlib import contextmanager
+
+class SystemClock:
+    """
+    Clock backed by the system time.
+    """
+    def now(self):
+        return datetime.datetime.now()
+
+class VirtualClock:
+    """
+    Manually driven clock for simulations and tests.
+    """
+    def __init__(self, start=None):
+        self.current = start if start is not None else datetime.datetime.now()
+
+    def now(self):
+        return self.current
+
+    def advance(self, days=0, **kwargs):
+        """
+        Move the clock forward by the given timedelta arguments.
+        """
+        self.current += datetime.timedelta(days=days, **kwargs)
+        return self.current
+
+    def set(self, moment):
+        self.current = moment
+
+
+_clock = SystemClock()
+
+def get_clock():
+    return _clock
+
+def set_clock(clock):
+    """
+    Install the clock used for every time calculation.
+    :param clock: an object with a now() method
+    :return: the previously installed clock
+    """
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
+
+@contextmanager
+def use_clock(clock):
+    """
+    Temporarily install a clock, e.g. `with use_clock(VirtualClock(start)):`.
+    """
+    previous = set_clock(clock)
+    try:
+        yield clock
+    finally:
+        set_clock(previous)
+
+def now():
+    """
+    The current time according to the installed clock.
+    """
+    return _clock.now()
@@ -0,0 +1,111 @@
+import math
+import sqlite3
+import numpy as np
+import clock
+from fsrs import retrievability_sql
+
+DEFAULT_BINS = 20
+METRICS = ("retrievability", "stability")
+
+# Binned value of each reviewed concept: retrievability as in
+# knowledge_base.iter_due_concepts, stability on a log scale
+_METRIC_SQL = {
+    "retrievability": retrievability_sql(
+        """CAST(julianday(?) - julianday(
+               (SELECT MAX(rs.timestamp) FROM recall_sessions rs WHERE rs.concept_id = c.id)
+           ) AS INTEGER)""",
+        "ld.stability"),
+    "stability": "ln(ld.stability)",
+}
+
+
+def _ensure_ln(conn):
+    """
+    Register ln() on SQLite builds without the math functions.
+    """
+    try:
+        conn.execute("SELECT ln(1)")
+    except sqlite3.OperationalError:
+        conn.create_function("ln", 1, math.log, deterministic=True)
+
+
+def _full_range(conn, metric):
+    if metric == "retrievability":
+        return 0.0, 1.0
+    low, high = conn.execute("SELECT MIN(stability), MAX(stability) FROM learning_data "
+                             "WHERE stability > 0").fetchone()
+    if low is None:
+        return 1.0, 10.0
+    return low, high if high > low else low * 10
+
+
+def bin_concepts(conn, metric="retrievability", bins=DEFAULT_BINS, value_range=None, topic_ids=None, now=None):
+    """
+    Count the reviewed concepts of each topic per retrievability or
+    stability bin, grouped in SQL so only topics x bins values reach Python
+    whatever the deck size.
+
+    Stability bins are spaced evenly on a log scale. Concepts outside
+    value_range are left out, so a zoomed-in view can be re-binned at a
+    finer resolution by passing its visible range.
+
+    :param conn: the Connection object
+    :param metric: "retrievability" or "stability" (days)
+    :param bins: number of bins
+    :param value_range: (low, high) to bin; defaults to 0-1 for retrievability
+                        and the smallest to largest stability in the deck
+    :param topic_ids: topics to include (defaults to all)
+    :param now: reference time for retrievability (defaults to the current time)
+    :return: (topics, edges, counts) where topics is the list of (id, name)
+             rows, edges the bins + 1 bin edges in the metric's units and
+             counts an int array of shape (len(topics), bins)
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    if bins <= 0:
+        raise ValueError("bins must be positive")
+    if now is None:
+        now = clock.now()
+    low, high = value_range if value_range is not None else _full_range(conn, metric)
+    if metric == "stability":
+        if low <= 0 or high <= low:
+            raise ValueError("Stability range must be positive and increasing")
+        _ensure_ln(conn)
+        edges = np.geomspace(low, high, bins + 1)
+        low, high = math.log(low), math.log(high)
+    else:
+        if high <= low:
+            raise ValueError("Range must be increasing")
+        edges = np.linspace(low, high, bins + 1)
+
+    cur = conn.cursor()
+    if topic_ids is None:
+        cur.execute("SELECT id, name FROM topics ORDER BY id")
+    else:
+        placeholders = ",".join("?" * len(topic_ids))
+        cur.execute(f"SELECT id, name FROM topics WHERE id IN ({placeholders}) ORDER BY id", list(topic_ids))
+    topics = cur.fetchall()
+    counts = np.zeros((len(topics), bins), dtype=np.int64)
+    if not topics:
+        return topics, edges, counts
+
+    # The top edge belongs to the last bin
+    placeholders = ",".join("?" * len(topics))
+    cur.execute(f"""
+        SELECT topic_id, MIN(CAST((x - ?) / ? AS INTEGER), ?) AS bin, COUNT(*)
+        FROM (
+            SELECT c.topic_id, {_METRIC_SQL[metric]} AS x
+            FROM learning_data ld
+            JOIN concepts c ON c.id = ld.concept_id
+            WHERE ld.stability > 0 AND c.topic_id IN ({placeholders})
+        )
+        WHERE x BETWEEN ? AND ?
+        GROUP BY topic_id, bin
+    """, (low, (high - low) / bins, bins - 1,
+          *([now.isoformat()] if metric == "retrievability" else []),
+          *[topic_id for topic_id, _ in topics], low, high))
+
+    rows = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 3)
+    row_of = np.searchsorted(np.array([topic_id for topic_id, _ in topics], dtype=np.int64), rows[:, 0])
+    counts[row_of, rows[:, 1]] = rows[:, 2]
+    return topics, edges, counts
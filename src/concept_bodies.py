@@ -0,0 +1,195 @@
+import hashlib
+import sqlite3
+import zlib
+from collections import OrderedDict
+from query_plans import hot_query
+
+# Concepts longer than this keep only a preview in concepts.content; the full
+# text lives in concept_bodies
+INLINE_CONTENT_CHARS = 280
+PREVIEW_CHARS = 200
+# Bodies of at least this many bytes are stored zlib-compressed
+COMPRESS_MIN_BYTES = 1024
+BODY_CACHE_SIZE = 128
+
+
+def create_concept_body_tables(conn):
+    """
+    Create the table holding the full text of long concepts.
+    """
+    try:
+        c = conn.cursor()
+
+        # body is TEXT, or zlib-compressed UTF-8 when compressed = 1. digest
+        # tells apart long concepts of a topic that share their preview
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS concept_bodies (
+                concept_id INTEGER PRIMARY KEY,
+                body BLOB NOT NULL,
+                compressed INTEGER NOT NULL DEFAULT 0,
+                digest TEXT,
+                FOREIGN KEY (concept_id) REFERENCES concepts (id)
+            )
+        """)
+
+        # Tables created before digests existed; fill_body_digests fills them in
+        columns = [row[1] for row in c.execute("PRAGMA table_info(concept_bodies)")]
+        if "digest" not in columns:
+            c.execute("ALTER TABLE concept_bodies ADD COLUMN digest TEXT")
+
+        # Deleting a concept deletes its body
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_concept_bodies_concepts_delete
+            AFTER DELETE ON concepts
+            BEGIN
+                DELETE FROM concept_bodies WHERE concept_id = OLD.id;
+            END
+        """)
+
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error creating concept body tables: {e}")
+
+
+def preview(content):
+    """
+    The text stored inline in concepts.content.
+    """
+    if len(content) <= INLINE_CONTENT_CHARS:
+        return content
+    return content[:PREVIEW_CHARS].rstrip() + "…"
+
+
+def encode_body(content):
+    """
+    :return: (body, compressed) as stored in concept_bodies
+    """
+    data = content.encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return zlib.compress(data), 1
+    return content, 0
+
+
+def body_digest(content):
+    """
+    Hex SHA-256 of a concept's full text.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def decode_body(body, compressed):
+    if compressed:
+        return zlib.decompress(body).decode("utf-8")
+    return body
+
+
+def full_content(inline, body, compressed):
+    """
+    A concept's text from its concepts.content and its concept_bodies row,
+    as selected by a LEFT JOIN (body is None for short concepts).
+    """
+    return inline if body is None else decode_body(body, compressed)
+
+
+def store_concept_body(conn, concept_id, content):
+    """
+    Store the body of a concept whose concepts.content is preview(content),
+    or remove it if the concept is short enough to be stored inline.
+    Does not commit.
+    """
+    if len(content) <= INLINE_CONTENT_CHARS:
+        conn.execute("DELETE FROM concept_bodies WHERE concept_id = ?", (concept_id,))
+        return
+    body, compressed = encode_body(content)
+    conn.execute("""
+        INSERT INTO concept_bodies (concept_id, body, compressed, digest) VALUES (?, ?, ?, ?)
+        ON CONFLICT (concept_id) DO UPDATE SET body = excluded.body, compressed = excluded.compressed,
+                                               digest = excluded.digest
+    """, (concept_id, body, compressed, body_digest(content)))
+
+
+_BODY_SQL = hot_query("concept_body", """
+        SELECT c.content, b.body, b.compressed
+        FROM concepts c
+        LEFT JOIN concept_bodies b ON b.concept_id = c.id
+        WHERE c.id = ?
+    """)
+
+
+def get_concept_body(conn, concept_id):
+    """
+    Full text of a concept, or None if it does not exist.
+    """
+    cur = conn.cursor()
+    cur.execute(_BODY_SQL, (concept_id,))
+    row = cur.fetchone()
+    return full_content(*row) if row else None
+
+
+def move_long_content(conn, batch_size=500):
+    """
+    Move the text of long concepts stored inline into concept_bodies, e.g.
+    for databases created before concept bodies were split out.
+
+    :return: number of moved concepts
+    """
+    read_cur = conn.cursor()
+    read_cur.execute("SELECT id, content FROM concepts WHERE length(content) > ?", (INLINE_CONTENT_CHARS,))
+    rows = read_cur.fetchall()
+    for start in range(0, len(rows), batch_size):
+        for concept_id, content in rows[start:start + batch_size]:
+            # Preview first, so the change log keys the old text without a digest
+            conn.execute("UPDATE concepts SET content = ? WHERE id = ?", (preview(content), concept_id))
+            store_concept_body(conn, concept_id, content)
+        conn.commit()
+    return len(rows)
+
+
+def fill_body_digests(conn):
+    """
+    Digest the bodies stored before digests existed.
+
+    :return: number of digested bodies
+    """
+    rows = conn.execute("SELECT concept_id, body, compressed FROM concept_bodies WHERE digest IS NULL").fetchall()
+    for concept_id, body, compressed in rows:
+        conn.execute("UPDATE concept_bodies SET digest = ? WHERE concept_id = ?",
+                     (body_digest(decode_body(body, compressed)), concept_id))
+    conn.commit()
+    return len(rows)
+
+
+class ConceptBodyCache:
+    """
+    LRU cache of full concept texts for one connection, so the text of a
+    card is read and decompressed once while it is shown and graded.
+    """
+
+    def __init__(self, conn, maxsize=BODY_CACHE_SIZE):
+        self.conn = conn
+        self.maxsize = maxsize
+        self.bodies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, concept_id):
+        if concept_id in self.bodies:
+            self.hits += 1
+            self.bodies.move_to_end(concept_id)
+            return self.bodies[concept_id]
+        self.misses += 1
+        content = get_concept_body(self.conn, concept_id)
+        if content is not None:
+            self.bodies[concept_id] = content
+            if len(self.bodies) > self.maxsize:
+                self.bodies.popitem(last=False)
+        return content
+
+    def invalidate(self, concept_id=None):
+        """
+        Drop one concept, or every concept, e.g. after a sync import.
+        """
+        if concept_id is None:
+            self.bodies.clear()
+        else:
+            self.bodies.pop(concept_id, None)
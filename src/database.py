@@ -1,5 +1,10 @@
 import sqlite3
 import os
+import threading
+
+# Stored in PRAGMA user_version once init_schema has run the one-off data
+# migrations. 1: long concept texts moved to concept_bodies, bodies digested
+SCHEMA_VERSION = 1
 
 def create_connection(db_file):
     """ create a database connection to the SQLite database
@@ -10,7 +15,8 @@ def create_connection(db_file):
     conn = None
     try:
         # ensure the directory exists
-        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        if os.path.dirname(db_file):
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
         conn = sqlite3.connect(db_file)
         return conn
     except sqlite3.Error as e:
@@ -32,8 +38,21 @@ def create_table(conn, create_table_sql):
 
 from knowledge_base import create_knowledge_tables
 
-def main():
-    database = "data/learning_data.db"
+def init_schema(conn):
+    """
+    Create every table, index and trigger of the learning database on a
+    connection, e.g. to a file, to :memory: or to a test database. Existing
+    objects are kept, so this also upgrades older databases.
+
+    :param conn: Connection object
+    """
+    # dedupe and mastery_history import numpy; keep it off the import path
+    # of read-only callers such as the command-line tool
+    from dedupe import create_dedupe_tables
+    from mastery_history import create_mastery_history_tables
+    from archive import create_archive_tables
+    from sync import create_sync_tables
+    from concept_bodies import create_concept_body_tables, move_long_content, fill_body_digests
 
     sql_create_topics_table = """ CREATE TABLE IF NOT EXISTS topics (
                                         id integer PRIMARY KEY,
@@ -64,30 +83,100 @@ def main():
                                             FOREIGN KEY (concept_id) REFERENCES concepts (id)
                                         );"""
 
-    # create a database connection
-    conn = create_connection(database)
+    sql_create_concepts_index = """CREATE INDEX IF NOT EXISTS idx_concepts_topic
+                                    ON concepts (topic_id);"""
 
-    # create tables
-    if conn is not None:
-        # create topics table
-        create_table(conn, sql_create_topics_table)
+    sql_create_recall_sessions_index = """CREATE INDEX IF NOT EXISTS idx_recall_sessions_concept_timestamp
+                                            ON recall_sessions (concept_id, timestamp);"""
+
+    # create topics table
+    create_table(conn, sql_create_topics_table)
+
+    # create concepts table
+    create_table(conn, sql_create_concepts_table)
+    create_table(conn, sql_create_concepts_index)
+
+    # create recall_sessions table
+    create_table(conn, sql_create_recall_sessions_table)
+
+    # index the last-review lookups used by scheduling and forecasting
+    create_table(conn, sql_create_recall_sessions_index)
+
+    # create learning_data table
+    create_table(conn, sql_create_learning_data_table)
 
-        # create concepts table
-        create_table(conn, sql_create_concepts_table)
+    # create the out-of-line store for long concept texts
+    create_concept_body_tables(conn)
 
-        # create recall_sessions table
-        create_table(conn, sql_create_recall_sessions_table)
+    # create knowledge base tables
+    create_knowledge_tables(conn)
 
-        # create learning_data table
-        create_table(conn, sql_create_learning_data_table)
+    # create near-duplicate index tables
+    create_dedupe_tables(conn)
 
-        # create knowledge base tables
-        create_knowledge_tables(conn)
+    # create the topic mastery cache and its invalidation triggers
+    create_mastery_cache_tables(conn)
 
+    # create the daily mastery history tables
+    create_mastery_history_tables(conn)
+
+    # create the compressed archive of old responses
+    create_archive_tables(conn)
+
+    # create the change log for syncing between devices
+    create_sync_tables(conn)
+
+    # after the change log, so moved bodies and the digests of bodies stored
+    # before digests existed are synced. They scan whole tables, so they only
+    # run on databases older than SCHEMA_VERSION.
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        fill_body_digests(conn)
+        move_long_content(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+def main(database="data/learning_data.db"):
+    # create a database connection
+    conn = create_connection(database)
+
+    # create tables
+    if conn is not None:
+        init_schema(conn)
         conn.close()
     else:
         print("Error! cannot create the database connection.")
 
+# In-memory database with the full schema that clone_schema copies, built
+# once per process: (pid, connection)
+_schema_template = None
+_schema_template_lock = threading.Lock()
+
+def clone_schema(target=":memory:"):
+    """
+    Open a new empty database with the full schema, copied with the backup
+    API from a template built by init_schema once per process. Copying takes
+    about a millisecond, so tests and benchmarks can afford one database
+    each, in memory or in their own file, also from parallel workers.
+
+    :param target: path of the new database, or ":memory:"
+    :return: Connection object
+    """
+    global _schema_template
+    from sync import reset_device_id
+
+    with _schema_template_lock:
+        # A connection must not be used across fork; forked workers build their own
+        if _schema_template is None or _schema_template[0] != os.getpid():
+            template = sqlite3.connect(":memory:", check_same_thread=False)
+            init_schema(template)
+            _schema_template = (os.getpid(), template)
+        conn = create_connection(target)
+        _schema_template[1].backup(conn)
+
+    # Each clone is a device of its own for syncing
+    reset_device_id(conn)
+    return conn
+
 def add_topic(conn, topic_name):
     """
     Add a new topic to the topics table
@@ -121,7 +210,8 @@ def get_all_topics(conn):
 
 def add_concept(conn, topic_id, content):
     """
-    Add a new concept to the concepts table
+    Add a new concept to the concepts table; long texts are stored in
+    concept_bodies with a preview inline
     :param conn:
     :param topic_id:
     :param content:
@@ -129,17 +219,60 @@ def add_concept(conn, topic_id, content):
     """
     sql = ''' INSERT INTO concepts(topic_id, content)
               VALUES(?,?) '''
+    from dedupe import index_concept
+    from concept_bodies import preview, store_concept_body
+
     try:
         cur = conn.cursor()
-        cur.execute(sql, (topic_id, content))
+        inline = preview(content)
+        cur.execute(sql, (topic_id, inline))
+        concept_id = cur.lastrowid
+        if inline != content:
+            store_concept_body(conn, concept_id, content)
+        index_concept(conn, concept_id, content, commit=False)
         conn.commit()
-        return cur.lastrowid
+        return concept_id
     except sqlite3.Error as e:
         print(e)
+        conn.rollback()
+        return None
+
+def add_concepts(conn, topic_id, contents):
+    """
+    Bulk-load concepts into a topic in a single transaction
+    :param conn:
+    :param topic_id:
+    :param contents: iterable of concept contents
+    :return: list of concept ids, or None on error
+    """
+    sql = ''' INSERT INTO concepts(topic_id, content)
+              VALUES(?,?) '''
+    from dedupe import index_concepts
+    from concept_bodies import preview, store_concept_body
+
+    try:
+        cur = conn.cursor()
+        concepts = []
+        for content in contents:
+            inline = preview(content)
+            cur.execute(sql, (topic_id, inline))
+            if inline != content:
+                store_concept_body(conn, cur.lastrowid, content)
+            concepts.append((cur.lastrowid, content))
+        index_concepts(conn, concepts, commit=False)
+        conn.commit()
+        return [concept_id for concept_id, _ in concepts]
+    except sqlite3.Error as e:
+        print(e)
+        conn.rollback()
         return None
 
 import datetime
+import clock
 from fsrs import FSRS, default_params
+from query_plans import hot_query
+
+_TOPIC_CONCEPTS_SQL = hot_query("concepts_for_topic", "SELECT * FROM concepts WHERE topic_id=?")
 
 def get_concepts_for_topic(conn, topic_id):
     """
@@ -149,7 +282,7 @@ def get_concepts_for_topic(conn, topic_id):
     :return:
     """
     cur = conn.cursor()
-    cur.execute("SELECT * FROM concepts WHERE topic_id=?", (topic_id,))
+    cur.execute(_TOPIC_CONCEPTS_SQL, (topic_id,))
 
     rows = cur.fetchall()
 
@@ -203,13 +336,32 @@ def record_recall_session(conn, concept_id, user_response, ai_grade):
               VALUES(?,?,?,?) '''
     try:
         cur = conn.cursor()
-        timestamp = datetime.datetime.now().isoformat()
+        timestamp = clock.now().isoformat()
         cur.execute(sql, (concept_id, timestamp, user_response, ai_grade))
         conn.commit()
     except sqlite3.Error as e:
         print(e)
 
-def get_next_concept_to_review(conn):
+# Walks concepts in id order and stops at the first new one
+_NEW_CONCEPTS_SQL = hot_query("next_concept.new", """
+        SELECT c.id, c.topic_id, c.content
+        FROM concepts c
+        LEFT JOIN learning_data ld ON c.id = ld.concept_id
+        WHERE ld.concept_id IS NULL
+        ORDER BY c.id
+    """, allow_scans={"c"})
+
+# A full pass over learning_data; each last-review lookup must be a seek
+_REVIEWED_CONCEPTS_SQL = hot_query("next_concept.reviewed", """
+        SELECT
+            ld.concept_id,
+            ld.difficulty,
+            ld.stability,
+            (SELECT MAX(rs.timestamp) FROM recall_sessions rs WHERE rs.concept_id = ld.concept_id) as last_review
+        FROM learning_data ld
+    """, allow_scans={"ld"})
+
+def get_next_concept_to_review(conn, exclude=()):
     """
     Get the next concept to review using the FSRS algorithm.
 
@@ -218,97 +370,190 @@ def get_next_concept_to_review(conn):
     retrievability score.
 
     :param conn: the Connection object
-    :return: The concept to review (id, topic_id, content) or None
+    :param exclude: ids of concepts to skip, e.g. reviews still being graded
+    :return: The concept to review (id, topic_id, content) or None; content
+             is the inline preview for long concepts (see concept_bodies)
     """
     cur = conn.cursor()
+    exclude = set(exclude)
 
     # 1. Check for new concepts
-    cur.execute("""
-        SELECT c.id, c.topic_id, c.content
-        FROM concepts c
-        LEFT JOIN learning_data ld ON c.id = ld.concept_id
-        WHERE ld.concept_id IS NULL
-        ORDER BY c.id
-        LIMIT 1
-    """)
-    new_concept = cur.fetchone()
-    if new_concept:
-        return new_concept
+    cur.execute(_NEW_CONCEPTS_SQL)
+    for new_concept in cur:
+        if new_concept[0] not in exclude:
+            return new_concept
 
     # 2. If no new concepts, find the one with the lowest retrievability
     fsrs = FSRS(default_params)
 
-    cur.execute("""
-        SELECT
-            ld.concept_id,
-            ld.difficulty,
-            ld.stability,
-            (SELECT MAX(rs.timestamp) FROM recall_sessions rs WHERE rs.concept_id = ld.concept_id) as last_review
-        FROM learning_data ld
-    """)
+    cur.execute(_REVIEWED_CONCEPTS_SQL)
 
-    concepts_to_review = []
-    for concept_id, difficulty, stability, last_review_str in cur.fetchall():
-        if last_review_str:
+    # Keep only the running minimum, so memory does not grow with the deck
+    min_retrievability = None
+    min_retrievability_concept_id = None
+    for concept_id, difficulty, stability, last_review_str in cur:
+        if last_review_str and concept_id not in exclude:
             last_review_date = datetime.datetime.fromisoformat(last_review_str)
-            days_since_review = (datetime.datetime.now() - last_review_date).days
+            days_since_review = (clock.now() - last_review_date).days
 
             retrievability = fsrs.retrievability(days_since_review, stability)
-            concepts_to_review.append((retrievability, concept_id))
+            if min_retrievability is None or retrievability < min_retrievability:
+                min_retrievability = retrievability
+                min_retrievability_concept_id = concept_id
 
-    if not concepts_to_review:
+    if min_retrievability_concept_id is None:
         return None
 
-    # Find the concept with the minimum retrievability
-    min_retrievability_concept_id = min(concepts_to_review, key=lambda x: x[0])[1]
-
     # Get the full concept details
     cur.execute("SELECT id, topic_id, content FROM concepts WHERE id = ?", (min_retrievability_concept_id,))
     return cur.fetchone()
 
 
+# Writes that change a topic's mastery: (table, event, concept id expressions).
+# Each gets a trigger that drops the cached mastery of the affected topics.
+_MASTERY_CACHE_INVALIDATIONS = [
+    ("learning_data", "INSERT", ["NEW.concept_id"]),
+    ("learning_data", "UPDATE", ["OLD.concept_id", "NEW.concept_id"]),
+    ("learning_data", "DELETE", ["OLD.concept_id"]),
+    ("recall_sessions", "INSERT", ["NEW.concept_id"]),
+    ("recall_sessions", "UPDATE OF concept_id, timestamp", ["OLD.concept_id", "NEW.concept_id"]),
+    ("recall_sessions", "DELETE", ["OLD.concept_id"]),
+]
+
+def create_mastery_cache_tables(conn):
+    """
+    Create the persisted topic mastery cache and the triggers that invalidate it.
+    """
+    # Caches keyed by calendar day went stale within the day; they are only
+    # a cache, so drop them rather than migrate
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(topic_mastery_cache)")]
+    if "day" in columns:
+        create_table(conn, "DROP TABLE topic_mastery_cache")
+
+    create_table(conn, """CREATE TABLE IF NOT EXISTS topic_mastery_cache (
+                              topic_id integer PRIMARY KEY,
+                              expires text NOT NULL,
+                              mastery real NOT NULL,
+                              FOREIGN KEY (topic_id) REFERENCES topics (id)
+                          );""")
+
+    for table, event, concept_ids in _MASTERY_CACHE_INVALIDATIONS:
+        name = f"trg_mastery_cache_{table}_{event.split()[0].lower()}"
+        create_table(conn, f"""CREATE TRIGGER IF NOT EXISTS {name}
+                               AFTER {event} ON {table}
+                               BEGIN
+                                   DELETE FROM topic_mastery_cache
+                                   WHERE topic_id IN (SELECT topic_id FROM concepts WHERE id IN ({", ".join(concept_ids)}));
+                               END;""")
+
+    # Moving or deleting a concept changes the topics it belongs to
+    create_table(conn, """CREATE TRIGGER IF NOT EXISTS trg_mastery_cache_concepts_update
+                          AFTER UPDATE OF topic_id ON concepts
+                          BEGIN
+                              DELETE FROM topic_mastery_cache WHERE topic_id IN (OLD.topic_id, NEW.topic_id);
+                          END;""")
+    create_table(conn, """CREATE TRIGGER IF NOT EXISTS trg_mastery_cache_concepts_delete
+                          AFTER DELETE ON concepts
+                          BEGIN
+                              DELETE FROM topic_mastery_cache WHERE topic_id = OLD.topic_id;
+                          END;""")
+    conn.commit()
+
+_MASTERY_CACHE_SQL = hot_query("topic_mastery.cache",
+                               "SELECT mastery FROM topic_mastery_cache WHERE topic_id = ? AND expires > ?")
+
+# Expiry of the cached mastery of topics without reviewed concepts; only a
+# write to the topic can change it
+_NEVER_EXPIRES = "9999-12-31T00:00:00"
+
+def _store_topic_masteries(conn, rows):
+    """
+    Cache (topic_id, expires, mastery) rows. The cache write is committed
+    unless the caller has a transaction open, which it then becomes part of.
+    """
+    owns_transaction = not conn.in_transaction
+    conn.executemany("INSERT OR REPLACE INTO topic_mastery_cache (topic_id, expires, mastery) VALUES (?, ?, ?)",
+                     rows)
+    if owns_transaction:
+        conn.commit()
+
 def get_topic_mastery(conn, topic_id):
     """
-    Calculate the mastery of a topic as the average retrievability of its concepts.
-    Concepts that have not been reviewed are excluded from the calculation.
+    Get the mastery of a topic, served from topic_mastery_cache when possible.
+
+    Retrievability decays with the whole days elapsed since each concept's
+    last review, so a cached value expires at the first moment one of those
+    day counts goes up. Before that, triggers on learning_data,
+    recall_sessions and concepts drop the cached value of exactly the topics
+    a write touches.
     """
-    fsrs = FSRS(default_params)
+    now = clock.now()
     cur = conn.cursor()
+    cur.execute(_MASTERY_CACHE_SQL, (topic_id, now.isoformat()))
+    cached = cur.fetchone()
+    if cached:
+        return cached[0]
+
+    mastery, expires = _compute_topic_mastery(conn, topic_id, now)
+    _store_topic_masteries(conn, [(topic_id, expires, mastery)])
+    return mastery
 
-    cur.execute("""
+_TOPIC_REVIEWED_CONCEPTS_SQL = hot_query("topic_mastery.concepts", """
         SELECT
             c.id,
             ld.stability
         FROM concepts c
         JOIN learning_data ld ON c.id = ld.concept_id
         WHERE c.topic_id = ?
-    """, (topic_id,))
+    """)
+_LAST_REVIEW_SQL = hot_query("topic_mastery.last_review", """
+            SELECT MAX(timestamp)
+            FROM recall_sessions
+            WHERE concept_id = ?
+        """)
+
+def compute_topic_mastery(conn, topic_id):
+    """
+    Calculate the mastery of a topic as the average retrievability of its concepts.
+    Concepts that have not been reviewed are excluded from the calculation.
+    """
+    return _compute_topic_mastery(conn, topic_id, clock.now())[0]
+
+def _compute_topic_mastery(conn, topic_id, now):
+    """
+    :return: (mastery, expires) where expires is the ISO timestamp at which
+             the days since a review next go up, changing the mastery
+    """
+    fsrs = FSRS(default_params)
+    cur = conn.cursor()
+
+    cur.execute(_TOPIC_REVIEWED_CONCEPTS_SQL, (topic_id,))
 
     rows = cur.fetchall()
 
     total_retrievability = 0
     reviewed_concepts_count = 0
+    expires = None
 
     for concept_id, stability in rows:
         # Find the last review timestamp for this concept
-        cur.execute("""
-            SELECT MAX(timestamp)
-            FROM recall_sessions
-            WHERE concept_id = ?
-        """, (concept_id,))
+        cur.execute(_LAST_REVIEW_SQL, (concept_id,))
         last_review_str = cur.fetchone()[0]
 
         if last_review_str:
             last_review_date = datetime.datetime.fromisoformat(last_review_str)
-            days_since_review = (datetime.datetime.now() - last_review_date).days
+            days_since_review = (now - last_review_date).days
             retrievability = fsrs.retrievability(days_since_review, stability)
             total_retrievability += retrievability
             reviewed_concepts_count += 1
 
+            next_day = last_review_date + datetime.timedelta(days=days_since_review + 1)
+            expires = next_day if expires is None else min(expires, next_day)
+
     if reviewed_concepts_count == 0:
-        return 0.0
+        return 0.0, _NEVER_EXPIRES
 
-    return total_retrievability / reviewed_concepts_count
+    return total_retrievability / reviewed_concepts_count, expires.isoformat()
 
 
 def get_all_topics_with_mastery(conn):
@@ -316,12 +561,25 @@ def get_all_topics_with_mastery(conn):
     Get all topics with their calculated mastery score.
     """
     topics = get_all_topics(conn)
+    now = clock.now()
+
+    cur = conn.cursor()
+    cur.execute("SELECT topic_id, mastery FROM topic_mastery_cache WHERE expires > ?", (now.isoformat(),))
+    cached = dict(cur.fetchall())
+
     topics_with_mastery = []
+    computed = []
     for topic in topics:
         topic_id, topic_name = topic
-        mastery = get_topic_mastery(conn, topic_id)
+        mastery = cached.get(topic_id)
+        if mastery is None:
+            mastery, expires = _compute_topic_mastery(conn, topic_id, now)
+            computed.append((topic_id, expires, mastery))
         topics_with_mastery.append((topic_id, topic_name, mastery))
 
+    if computed:
+        _store_topic_masteries(conn, computed)
+
     return topics_with_mastery
 
 
@@ -0,0 +1,253 @@
+import re
+import sqlite3
+import zlib
+import numpy as np
+
+# MinHash signature of NUM_PERM values, split into BANDS bands of ROWS values.
+# Two concepts with Jaccard similarity j share at least one band bucket with
+# probability 1 - (1 - j ** ROWS) ** BANDS, about 0.5 at j = 0.5 and over
+# 0.99 at j = 0.8.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+DEFAULT_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+# Fixed seed: stored signatures must stay comparable across runs
+_rng = np.random.default_rng(20240101)
+_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+
+
+def create_dedupe_tables(conn):
+    """
+    Create the MinHash signature and LSH bucket tables. When they are first
+    added to a database that already has concepts, those are indexed.
+    """
+    try:
+        c = conn.cursor()
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'concept_minhash'")
+        upgrading = c.fetchone() is None
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS concept_minhash (
+                concept_id INTEGER PRIMARY KEY,
+                signature BLOB NOT NULL,
+                FOREIGN KEY (concept_id) REFERENCES concepts (id)
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS concept_lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                concept_id INTEGER NOT NULL,
+                PRIMARY KEY (band, bucket, concept_id)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+        if upgrading and c.execute("SELECT 1 FROM concepts LIMIT 1").fetchone():
+            rebuild_index(conn)
+    except sqlite3.Error as e:
+        print(f"Error creating dedupe tables: {e}")
+
+
+def shingles(content):
+    """
+    Hashed character shingles of the normalized content.
+    """
+    text = " ".join(re.sub(r'[^\w\s]', '', content.lower()).split())
+    if len(text) <= SHINGLE_SIZE:
+        grams = {text}
+    else:
+        grams = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(g.encode()) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash(content):
+    """
+    MinHash signature of a concept's content as a uint64 array of NUM_PERM values.
+    """
+    hashed = shingles(content)
+    return ((_A[:, None] * hashed[None, :] + _B[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+def band_buckets(signature):
+    """
+    The LSH bucket of each band of a signature.
+    """
+    return [zlib.crc32(signature[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+
+def similarity(signature_a, signature_b):
+    """
+    Jaccard similarity estimated from two MinHash signatures.
+    """
+    return float(np.mean(signature_a == signature_b))
+
+
+def _signature_from_blob(blob):
+    return np.frombuffer(blob, dtype=np.uint64)
+
+
+def index_concepts(conn, concepts, commit=True):
+    """
+    Add concepts to the near-duplicate index, replacing the entries of
+    concepts indexed before, e.g. under an earlier text.
+
+    :param conn: Connection object
+    :param concepts: iterable of (concept_id, content)
+    :param commit: commit the transaction (False lets callers batch writes)
+    """
+    signatures = []
+    buckets = []
+    # A concept listed twice is indexed under its last text
+    for concept_id, content in dict(concepts).items():
+        signature = minhash(content)
+        signatures.append((concept_id, signature.tobytes()))
+        buckets.extend((band, bucket, concept_id) for band, bucket in enumerate(band_buckets(signature)))
+
+    cur = conn.cursor()
+    # Buckets are keyed by band first, so the stale ones are found from the
+    # previous signature rather than by scanning for the concept id
+    stale = []
+    for start in range(0, len(signatures), 500):
+        ids = [concept_id for concept_id, _ in signatures[start:start + 500]]
+        cur.execute(f"SELECT concept_id, signature FROM concept_minhash WHERE concept_id IN ({','.join('?' * len(ids))})",
+                    ids)
+        for concept_id, previous in cur.fetchall():
+            previous = _signature_from_blob(previous)
+            stale.extend((band, bucket, concept_id) for band, bucket in enumerate(band_buckets(previous)))
+    cur.executemany("DELETE FROM concept_lsh_buckets WHERE band = ? AND bucket = ? AND concept_id = ?", stale)
+    cur.executemany("INSERT OR REPLACE INTO concept_minhash (concept_id, signature) VALUES (?, ?)", signatures)
+    cur.executemany("INSERT OR IGNORE INTO concept_lsh_buckets (band, bucket, concept_id) VALUES (?, ?, ?)", buckets)
+    if commit:
+        conn.commit()
+
+
+def index_concept(conn, concept_id, content, commit=True):
+    """
+    Add a single concept to the near-duplicate index.
+    """
+    index_concepts(conn, [(concept_id, content)], commit=commit)
+
+
+def rebuild_index(conn, batch_size=5000):
+    """
+    Rebuild the near-duplicate index from the concepts table, e.g. for
+    databases created before the index existed.
+
+    :return: number of indexed concepts
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM concept_minhash")
+    cur.execute("DELETE FROM concept_lsh_buckets")
+
+    from concept_bodies import full_content
+
+    read_cur = conn.cursor()
+    read_cur.execute("""
+        SELECT c.id, c.content, b.body, b.compressed
+        FROM concepts c
+        LEFT JOIN concept_bodies b ON b.concept_id = c.id
+        ORDER BY c.id
+    """)
+    indexed = 0
+    for rows in iter(lambda: read_cur.fetchmany(batch_size), []):
+        rows = [(concept_id, full_content(*content)) for concept_id, *content in rows]
+        index_concepts(conn, rows, commit=False)
+        indexed += len(rows)
+    conn.commit()
+    return indexed
+
+
+def find_near_duplicates(conn, content=None, concept_id=None, threshold=DEFAULT_THRESHOLD):
+    """
+    Find concepts whose content is a near-duplicate of the given content or concept.
+
+    Only concepts sharing an LSH bucket are compared, so the cost depends on
+    the number of candidates, not on the size of the deck.
+
+    :param conn: Connection object
+    :param content: text to look up
+    :param concept_id: alternatively, an indexed concept to look up
+    :param threshold: minimum estimated Jaccard similarity
+    :return: list of (concept_id, similarity), most similar first
+    """
+    cur = conn.cursor()
+    if content is not None:
+        signature = minhash(content)
+    else:
+        cur.execute("SELECT signature FROM concept_minhash WHERE concept_id = ?", (concept_id,))
+        row = cur.fetchone()
+        if row is None:
+            return []
+        signature = _signature_from_blob(row[0])
+
+    candidates = set()
+    for band, bucket in enumerate(band_buckets(signature)):
+        cur.execute("SELECT concept_id FROM concept_lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket))
+        candidates.update(row[0] for row in cur)
+    candidates.discard(concept_id)
+
+    matches = []
+    for candidate in candidates:
+        cur.execute("SELECT signature FROM concept_minhash WHERE concept_id = ?", (candidate,))
+        score = similarity(signature, _signature_from_blob(cur.fetchone()[0]))
+        if score >= threshold:
+            matches.append((candidate, score))
+
+    return sorted(matches, key=lambda match: (-match[1], match[0]))
+
+
+def dedupe_report(conn, threshold=DEFAULT_THRESHOLD):
+    """
+    Group the whole deck into clusters of near-duplicate concepts.
+
+    Each shared LSH bucket links its members to the bucket's first member if
+    their signatures are similar enough, and linked concepts are merged with
+    union-find. The work is linear in the total bucket size rather than
+    quadratic in the number of concepts.
+
+    :param conn: Connection object
+    :param threshold: minimum estimated Jaccard similarity
+    :return: list of clusters, each a sorted list of concept ids
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT group_concat(concept_id)
+        FROM concept_lsh_buckets
+        GROUP BY band, bucket
+        HAVING COUNT(*) > 1
+    """)
+    buckets = [[int(member) for member in row[0].split(",")] for row in cur]
+    if not buckets:
+        return []
+
+    candidates = {member for bucket in buckets for member in bucket}
+    signatures = {}
+    cur.execute("SELECT concept_id, signature FROM concept_minhash")
+    for concept_id, blob in cur:
+        if concept_id in candidates:
+            signatures[concept_id] = _signature_from_blob(blob)
+
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for bucket in buckets:
+        representative = bucket[0]
+        for member in bucket[1:]:
+            root_a, root_b = find(representative), find(member)
+            if root_a != root_b and similarity(signatures[representative], signatures[member]) >= threshold:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters = {}
+    for concept_id in parent:
+        clusters.setdefault(find(concept_id), []).append(concept_id)
+
+    return sorted(sorted(cluster) for cluster in clusters.values() if len(cluster) > 1)
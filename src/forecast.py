@@ -0,0 +1,144 @@
+import numpy as np
+import clock
+from fsrs import FSRS, default_params
+
+DEFAULT_REQUEST_RETENTION = 0.9
+
+# FSRS grade assumed for simulated future reviews (3: Good)
+SIMULATED_GRADE = 3
+
+
+def vector_new_difficulty(w, d, g):
+    """
+    Vectorized FSRS.new_difficulty over numpy arrays.
+    """
+    d0_3 = w[4]
+    return np.clip(w[7] * d0_3 + (1 - w[7]) * (d - w[6] * (g - 3)), 1, 10)
+
+
+def vector_new_stability(w, d, s, r, g):
+    """
+    Vectorized FSRS.new_stability over numpy arrays.
+
+    :param w: FSRS parameters
+    :param d: difficulty array
+    :param s: stability array
+    :param r: retrievability array at the time of the review
+    :param g: grade (scalar or array of 1-4)
+    :return: array of new stabilities
+    """
+    g = np.broadcast_to(np.asarray(g), np.shape(s))
+    # Both branches are evaluated for every element, so silence overflow
+    # warnings coming from the branch np.where discards
+    with np.errstate(over='ignore', invalid='ignore'):
+        return _vector_new_stability(w, d, s, r, g)
+
+
+def _vector_new_stability(w, d, s, r, g):
+    forgotten = w[11] * d ** -w[12] * ((s + 1) ** w[13] - 1) * np.exp(w[14] * (1 - r))
+    hard_penalty = np.where(g == 2, w[15], 1.0)
+    easy_bonus = np.where(g == 4, w[16], 1.0)
+    recalled = s * (1 + np.exp(w[8]) *
+                        (11 - d) *
+                        s ** -w[9] *
+                        (np.exp((1 - r) * w[10]) - 1) *
+                        hard_penalty *
+                        easy_bonus)
+    return np.where(g == 1, forgotten, recalled)
+
+
+def load_review_state(conn, now=None):
+    """
+    Load the scheduling state of every reviewed concept as numpy arrays.
+
+    :param conn: the Connection object
+    :param now: reference time (defaults to the current time)
+    :return: (topic_ids, difficulty, stability, elapsed_days) arrays
+    """
+    if now is None:
+        now = clock.now()
+
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT
+            c.topic_id,
+            ld.difficulty,
+            ld.stability,
+            julianday(?) - julianday(lr.last_review)
+        FROM learning_data ld
+        JOIN concepts c ON c.id = ld.concept_id
+        LEFT JOIN (
+            SELECT concept_id, MAX(timestamp) AS last_review
+            FROM recall_sessions
+            GROUP BY concept_id
+        ) lr ON lr.concept_id = ld.concept_id
+    """, (now.isoformat(),))
+
+    rows = np.array(cur.fetchall(), dtype=float).reshape(-1, 4)
+    topic_ids = rows[:, 0].astype(np.int64)
+    # Concepts without a recorded review are treated as reviewed just now
+    elapsed = np.nan_to_num(rows[:, 3], nan=0.0)
+    return topic_ids, rows[:, 1], rows[:, 2], elapsed
+
+
+def forecast_reviews(conn, horizon_days=30, simulate=True,
+                     request_retention=DEFAULT_REQUEST_RETENTION, now=None, params=None):
+    """
+    Forecast how many reviews fall due on each day of the horizon, per topic.
+
+    A concept falls due once its retrievability drops to request_retention.
+    Overdue concepts are counted on day 0. With simulate=True, every forecast
+    review is assumed to be answered 'Good' on its due day and the concept is
+    rescheduled with the new FSRS stability, so repeat reviews inside the
+    horizon are counted too.
+
+    :param conn: the Connection object
+    :param horizon_days: number of days to forecast (e.g. 30, 90 or 365)
+    :param simulate: whether to include simulated follow-up reviews
+    :param request_retention: retrievability at which a concept is due
+    :param now: reference time (defaults to the current time)
+    :param params: FSRS parameters (defaults to default_params)
+    :return: (topics, counts) where topics is the list of (id, name) rows and
+             counts is an int array of shape (len(topics), horizon_days)
+    """
+    w = params if params is not None else default_params
+    fsrs = FSRS(w)
+
+    cur = conn.cursor()
+    cur.execute("SELECT id, name FROM topics ORDER BY id")
+    topics = cur.fetchall()
+    counts = np.zeros((len(topics), horizon_days), dtype=np.int64)
+    if not topics or horizon_days <= 0:
+        return topics, counts
+
+    topic_ids, difficulty, stability, elapsed = load_review_state(conn, now)
+
+    # Map topic ids onto row indices, dropping concepts of unknown topics
+    known_ids = np.array([t[0] for t in topics], dtype=np.int64)
+    rows = np.searchsorted(known_ids, topic_ids)
+    rows = np.minimum(rows, len(known_ids) - 1)
+    known = known_ids[rows] == topic_ids
+    rows, difficulty, stability, elapsed = rows[known], difficulty[known], stability[known], elapsed[known]
+
+    last_review_day = -elapsed
+    due_day = np.floor(np.maximum(fsrs.next_interval(stability, request_retention) - elapsed, 0))
+
+    while due_day.size:
+        in_horizon = due_day < horizon_days
+        rows, difficulty, stability = rows[in_horizon], difficulty[in_horizon], stability[in_horizon]
+        last_review_day, due_day = last_review_day[in_horizon], due_day[in_horizon]
+
+        flat = rows * horizon_days + due_day.astype(np.int64)
+        counts += np.bincount(flat, minlength=counts.size).reshape(counts.shape)
+        if not simulate:
+            break
+
+        # Review every due concept on its due day and reschedule it
+        r = fsrs.retrievability(due_day - last_review_day, stability)
+        difficulty = vector_new_difficulty(w, difficulty, SIMULATED_GRADE)
+        stability = vector_new_stability(w, difficulty, stability, r, SIMULATED_GRADE)
+        interval = np.maximum(np.floor(fsrs.next_interval(stability, request_retention)), 1)
+        last_review_day = due_day
+        due_day = due_day + interval
+
+    return topics, counts
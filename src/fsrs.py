@@ -12,11 +12,17 @@ class FSRS:
 
     def new_difficulty(self, d, g):
         d0_3 = self.initial_difficulty(3)
-        return self.w[7] * d0_3 + (1 - self.w[7]) * (d - self.w[6] * (g - 3))
+        new_d = self.w[7] * d0_3 + (1 - self.w[7]) * (d - self.w[6] * (g - 3))
+        # FSRS keeps difficulty within [1, 10]
+        return min(max(new_d, 1), 10)
 
     def retrievability(self, t, s):
         return (1 + t / (9 * s)) ** -1
 
+    def next_interval(self, s, request_retention=0.9):
+        # Inverse of retrievability: days until R drops to request_retention
+        return 9 * s * (1 / request_retention - 1)
+
     def new_stability(self, d, s, r, g):
         if g == 1: # Again
             return self.w[11] * d ** -self.w[12] * ((s + 1) ** self.w[13] - 1) * math.exp(self.w[14] * (1 - r))
@@ -30,6 +36,12 @@ class FSRS:
                                hard_penalty *
                                easy_bonus)
 
+def retrievability_sql(t, s):
+    """
+    SQL expression equivalent to FSRS.retrievability for column expressions t and s.
+    """
+    return f"(1.0 / (1 + ({t}) / (9.0 * ({s}))))"
+
 # Default parameters for FSRS-4.5
 # Using FSRS-4.5 as it is a more recent version with better performance
 # https://github.com/open-spaced-repetition/fsrs4anki/wiki/The-Algorithm
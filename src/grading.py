@@ -29,3 +29,31 @@ def rule_based_grade(user_response, correct_answer):
     grade = len(matching_words) / len(correct_words)
 
     return min(grade, 1.0)
+
+
+def to_fsrs_grade(score):
+    """
+    Map a grading score between 0 and 1 onto an FSRS grade.
+
+    :param score: The score returned by a grader.
+    :return: 1 (Again), 2 (Hard), 3 (Good) or 4 (Easy).
+    """
+    if score < 0.4:
+        return 1
+    elif score < 0.6:
+        return 2
+    elif score < 0.9:
+        return 3
+    else:
+        return 4
+
+
+def grade_response(user_response, correct_answer):
+    """
+    The current grader: rule-based grading mapped onto an FSRS grade.
+
+    :param user_response: The user's free recall response.
+    :param correct_answer: The correct answer for the concept.
+    :return: An FSRS grade between 1 and 4.
+    """
+    return to_fsrs_grade(rule_based_grade(user_response, correct_answer))
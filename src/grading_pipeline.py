@@ -0,0 +1,155 @@
+import itertools
+import os
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from grading import grade_response
+from concept_bodies import full_content
+from archive import with_archived_responses
+
+# Grade used when the grader fails, so a review is never lost
+DEFAULT_GRADE = 3
+
+GradedResponse = namedtuple('GradedResponse', ['concept_id', 'user_response', 'grade', 'technique', 'timestamp', 'error'])
+
+
+class GradingPipeline:
+    """
+    Grades submitted responses on a worker pool.
+
+    submit() returns immediately; finished results are collected with drain(),
+    which callers poll from the thread that owns the database connection
+    (the Tk main loop in the App).
+    """
+
+    def __init__(self, grader=grade_response, max_workers=None):
+        self.grader = grader
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="grader")
+        self.results = queue.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, concept_id, user_response, correct_answer, technique=None, timestamp=None):
+        """
+        Queue a response for grading.
+        :return: the Future of the grading job
+        """
+        with self.lock:
+            self.pending[concept_id] = self.pending.get(concept_id, 0) + 1
+        future = self.executor.submit(self.grader, user_response, correct_answer)
+        future.add_done_callback(
+            lambda f: self._on_graded(f, concept_id, user_response, technique, timestamp))
+        return future
+
+    def _on_graded(self, future, concept_id, user_response, technique, timestamp):
+        error = future.exception()
+        grade = DEFAULT_GRADE if error else future.result()
+        self.results.put(GradedResponse(concept_id, user_response, grade, technique, timestamp, error))
+
+    def drain(self):
+        """
+        Collect every graded response that is ready, without blocking.
+        :return: list of GradedResponse
+        """
+        graded = []
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.pending[result.concept_id] -= 1
+                if not self.pending[result.concept_id]:
+                    del self.pending[result.concept_id]
+            graded.append(result)
+        return graded
+
+    def pending_concept_ids(self):
+        """
+        Concepts with a submitted response that has not been drained yet.
+        """
+        with self.lock:
+            return set(self.pending)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def _grade_chunk(grader, rows):
+    """
+    Grade a chunk of (session_id, user_response, correct_answer) rows in a worker process.
+    """
+    return [(grader(user_response, correct_answer), session_id)
+            for session_id, user_response, correct_answer in rows]
+
+
+def regrade_history(conn, grader=grade_response, chunk_size=1000, max_workers=None, changed=None):
+    """
+    Re-grade every stored recall session response with the current grader and
+    update its ai_grade where it differs. Archived responses are read back
+    from the archive.
+
+    Responses are streamed from the database in chunks that are graded in
+    parallel worker processes; at most two chunks per worker are in flight,
+    so memory stays bounded on large histories. The grader must be a
+    module-level function so it can be sent to the workers.
+
+    :param conn: the Connection object
+    :param grader: function (user_response, correct_answer) -> FSRS grade
+    :param chunk_size: number of responses per worker task
+    :param max_workers: number of worker processes (defaults to one per CPU)
+    :param changed: optional set that receives the ids of concepts with a changed grade,
+                    whose FSRS state then needs replaying
+    :return: number of re-graded sessions
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    read_cur = conn.cursor()
+    read_cur.execute("""
+        SELECT rs.id, rs.concept_id, rs.user_response, rs.ai_grade, c.content, b.body, b.compressed
+        FROM recall_sessions rs
+        JOIN concepts c ON c.id = rs.concept_id
+        LEFT JOIN concept_bodies b ON b.concept_id = c.id
+        WHERE rs.user_response IS NOT NULL
+           OR EXISTS (SELECT 1 FROM response_archive ra WHERE ra.concept_id = rs.concept_id)
+        ORDER BY rs.id
+    """)
+    sessions = with_archived_responses(conn, read_cur, batch_size=chunk_size)
+
+    write_cur = conn.cursor()
+    regraded = 0
+
+    # (concept_id, ai_grade) of the sessions in each in-flight chunk
+    previous = {}
+
+    def apply(futures):
+        nonlocal regraded
+        for future in futures:
+            grades = future.result()
+            old = previous.pop(future)
+            updates = [(grade, session_id) for grade, session_id in grades if grade != old[session_id][1]]
+            # Only ai_grade changes, so the scan above is not disturbed
+            write_cur.executemany("UPDATE recall_sessions SET ai_grade = ? WHERE id = ?", updates)
+            if changed is not None:
+                changed.update(old[session_id][0] for _, session_id in updates)
+            regraded += len(grades)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for rows in iter(lambda: list(itertools.islice(sessions, chunk_size)), []):
+            # Sessions that never had a response are not graded
+            rows = [row for row in rows if row[2] is not None]
+            if not rows:
+                continue
+            future = executor.submit(_grade_chunk, grader,
+                                     [(session_id, response, full_content(*content))
+                                      for session_id, _, response, _, *content in rows])
+            previous[future] = {session_id: (concept_id, ai_grade) for session_id, concept_id, _, ai_grade, *_ in rows}
+            in_flight.add(future)
+            if len(in_flight) >= 2 * max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                apply(done)
+        apply(in_flight)
+
+    conn.commit()
+    return regraded
@@ -1,4 +1,12 @@
 import sqlite3
+import clock
+from fsrs import retrievability_sql
+from query_plans import hot_query
+
+# Retrievability at which a concept counts as due
+DUE_RETRIEVABILITY = 0.9
+
+DEFAULT_TECHNIQUES = {"Recall": 1, "Elaboration": 2, "Visualization": 3}
 
 def create_knowledge_tables(conn):
     """
@@ -15,6 +23,34 @@ def create_knowledge_tables(conn):
             )
         """)
 
+        # Closure table of the knowledge area tree: one row per ancestor/descendant
+        # pair, including each area with itself at depth 0
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS knowledge_area_closure (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id),
+                FOREIGN KEY (ancestor_id) REFERENCES knowledge_areas (id),
+                FOREIGN KEY (descendant_id) REFERENCES knowledge_areas (id)
+            ) WITHOUT ROWID
+        """)
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_knowledge_area_closure_descendant
+            ON knowledge_area_closure (descendant_id, depth)
+        """)
+
+        # Table placing topics in the knowledge area tree
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS topic_areas (
+                topic_id INTEGER PRIMARY KEY,
+                area_id INTEGER NOT NULL,
+                FOREIGN KEY (topic_id) REFERENCES topics (id),
+                FOREIGN KEY (area_id) REFERENCES knowledge_areas (id)
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_topic_areas_area ON topic_areas (area_id)")
+
         # Table for different learning techniques
         c.execute("""
             CREATE TABLE IF NOT EXISTS learning_techniques (
@@ -36,15 +72,57 @@ def create_knowledge_tables(conn):
             )
         """)
 
-        # Pre-populate with some default techniques
-        default_techniques = [('Recall',), ('Elaboration',), ('Visualization',)]
-        c.executemany("INSERT OR IGNORE INTO learning_techniques (name) VALUES (?)", default_techniques)
+        # One progress row per concept and technique, the conflict target of
+        # the progress upsert
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_concept_learning_progress_unique'")
+        if not c.fetchone():
+            _merge_duplicate_progress(c)
+            c.execute("DROP INDEX IF EXISTS idx_concept_learning_progress_concept_technique")
+            c.execute("""
+                CREATE UNIQUE INDEX idx_concept_learning_progress_unique
+                ON concept_learning_progress (concept_id, technique_id)
+            """)
+
+        # Pre-populate with the default techniques. Their ids are fixed, so
+        # they are resolved without a query in every deck database.
+        c.executemany("INSERT OR IGNORE INTO learning_techniques (id, name) VALUES (?, ?)",
+                      [(technique_id, name) for name, technique_id in DEFAULT_TECHNIQUES.items()])
 
         conn.commit()
     except sqlite3.Error as e:
         print(f"Error creating knowledge tables: {e}")
 
 
+def _merge_duplicate_progress(cur):
+    """
+    Fold progress rows written before the unique index into one row per
+    concept and technique: counts are added, the latest timestamp is kept.
+    """
+    cur.execute("""
+        UPDATE concept_learning_progress
+        SET applications_count = (SELECT SUM(p.applications_count) FROM concept_learning_progress p
+                                  WHERE p.concept_id = concept_learning_progress.concept_id
+                                    AND p.technique_id = concept_learning_progress.technique_id),
+            last_applied_timestamp = (SELECT MAX(p.last_applied_timestamp) FROM concept_learning_progress p
+                                      WHERE p.concept_id = concept_learning_progress.concept_id
+                                        AND p.technique_id = concept_learning_progress.technique_id)
+        WHERE id IN (SELECT MIN(id) FROM concept_learning_progress
+                     GROUP BY concept_id, technique_id HAVING COUNT(*) > 1)
+    """)
+    cur.execute("""
+        DELETE FROM concept_learning_progress
+        WHERE id NOT IN (SELECT MIN(id) FROM concept_learning_progress GROUP BY concept_id, technique_id)
+    """)
+
+
+_RECALL_GRADES_SQL = hot_query("allocate_technique.grades", """
+        SELECT ai_grade
+        FROM recall_sessions
+        WHERE concept_id = ?
+        ORDER BY timestamp DESC
+    """)
+
+
 def allocate_technique(conn, concept_id):
     """
     Analyzes the learning history of a concept and selects an appropriate technique.
@@ -56,63 +134,262 @@ def allocate_technique(conn, concept_id):
     cur = conn.cursor()
 
     # Get the recall history for this concept
-    cur.execute("""
-        SELECT ai_grade
-        FROM recall_sessions
-        WHERE concept_id = ?
-        ORDER BY timestamp DESC
-    """, (concept_id,))
+    cur.execute(_RECALL_GRADES_SQL, (concept_id,))
 
     grades = cur.fetchall()
 
-    # Simple rule: if failed more than twice (grade <= 2), use "Elaboration"
     # FSRS grades: 1:Again, 2:Hard, 3:Good, 4:Easy. We'll consider < 3 a failure for this logic.
     failure_count = sum(1 for grade in grades if grade[0] < 3)
 
+    return choose_technique(failure_count)
+
+
+def choose_technique(failure_count):
+    """
+    Select a technique from the number of failed recalls of a concept.
+
+    :param failure_count: number of recall sessions graded below 'Good'
+    :return: The name of the technique
+    """
+    # Simple rule: if failed more than twice (grade <= 2), use "Elaboration"
     if failure_count > 2:
         return "Elaboration"
     else:
         return "Recall"
 
 
+_TECHNIQUE_BY_NAME_SQL = hot_query("technique_id_by_name", "SELECT id FROM learning_techniques WHERE name = ?")
+
+
 def get_technique_id_by_name(conn, name):
     """
     Get the ID of a learning technique by its name.
+
+    The default techniques are resolved from DEFAULT_TECHNIQUES; other
+    names are looked up in conn's database, since their ids differ between
+    decks.
     """
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM learning_techniques WHERE name = ?", (name,))
-    result = cur.fetchone()
-    return result[0] if result else None
+    technique_id = DEFAULT_TECHNIQUES.get(name)
+    if technique_id is None:
+        cur = conn.cursor()
+        cur.execute(_TECHNIQUE_BY_NAME_SQL, (name,))
+        result = cur.fetchone()
+        if not result:
+            return None
+        technique_id = result[0]
+    return technique_id
+
+
+_PROGRESS_UPSERT_SQL = hot_query("concept_learning_progress.upsert", """
+        INSERT INTO concept_learning_progress (concept_id, technique_id, applications_count, last_applied_timestamp)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT (concept_id, technique_id) DO UPDATE
+        SET applications_count = applications_count + 1,
+            last_applied_timestamp = excluded.last_applied_timestamp
+    """)
+
+def update_concept_learning_progress(conn, concept_id, technique_id, timestamp=None, commit=True):
+    """
+    Count one application of a technique to a concept.
+    """
+    timestamp = (timestamp or clock.now()).isoformat()
+    conn.execute(_PROGRESS_UPSERT_SQL, (concept_id, technique_id, timestamp))
+    if commit:
+        conn.commit()
 
-def update_concept_learning_progress(conn, concept_id, technique_id):
+
+def update_concept_learning_progress_many(conn, applications, commit=True):
     """
-    Update the progress for a given concept and technique.
+    Count many technique applications with one prepared upsert.
+
+    :param conn: Connection object
+    :param applications: iterable of (concept_id, technique name, timestamp);
+                         unknown techniques are skipped
+    :param commit: commit the transaction
+    :return: number of applications counted
+    """
+    rows = []
+    for concept_id, technique, timestamp in applications:
+        technique_id = get_technique_id_by_name(conn, technique)
+        if technique_id:
+            rows.append((concept_id, technique_id, (timestamp or clock.now()).isoformat()))
+    conn.executemany(_PROGRESS_UPSERT_SQL, rows)
+    if commit:
+        conn.commit()
+    return len(rows)
+
+
+def add_knowledge_area(conn, name, parent_id=None):
+    """
+    Add a knowledge area, optionally below a parent area.
+
+    :param conn: Connection object
+    :param name: The name of the area
+    :param parent_id: The ID of the parent area, or None for a root area
+    :return: area id
+    :raises ValueError: if the parent area does not exist
     """
-    import datetime
     cur = conn.cursor()
+    if parent_id is not None:
+        cur.execute("SELECT 1 FROM knowledge_areas WHERE id = ?", (parent_id,))
+        if cur.fetchone() is None:
+            raise ValueError(f"Unknown knowledge area {parent_id}")
+    try:
+        cur.execute("INSERT INTO knowledge_areas (name) VALUES (?)", (name,))
+        area_id = cur.lastrowid
 
-    timestamp = datetime.datetime.now().isoformat()
+        # The new area descends from itself and from every ancestor of its parent
+        cur.execute("""
+            INSERT INTO knowledge_area_closure (ancestor_id, descendant_id, depth)
+            SELECT ?, ?, 0
+            UNION ALL
+            SELECT ancestor_id, ?, depth + 1
+            FROM knowledge_area_closure
+            WHERE descendant_id = ?
+        """, (area_id, area_id, area_id, parent_id))
 
-    cur.execute("""
-        SELECT id, applications_count FROM concept_learning_progress
-        WHERE concept_id = ? AND technique_id = ?
-    """, (concept_id, technique_id))
+        conn.commit()
+        return area_id
+    except sqlite3.Error as e:
+        print(e)
+        conn.rollback()
+        return None
 
-    result = cur.fetchone()
 
-    if result:
-        # Update existing record
-        progress_id, count = result
+def assign_topic_to_area(conn, topic_id, area_id):
+    """
+    Place a topic in a knowledge area, replacing any previous placement.
+
+    :raises ValueError: if the topic or the area does not exist
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM topics WHERE id = ?", (topic_id,))
+    if cur.fetchone() is None:
+        raise ValueError(f"Unknown topic {topic_id}")
+    cur.execute("SELECT 1 FROM knowledge_areas WHERE id = ?", (area_id,))
+    if cur.fetchone() is None:
+        raise ValueError(f"Unknown knowledge area {area_id}")
+    cur.execute("INSERT OR REPLACE INTO topic_areas (topic_id, area_id) VALUES (?, ?)", (topic_id, area_id))
+    conn.commit()
+
+
+def get_child_areas(conn, parent_id=None):
+    """
+    Get the direct children of an area, or the root areas if parent_id is None.
+
+    :return: list of (id, name)
+    """
+    cur = conn.cursor()
+    if parent_id is None:
         cur.execute("""
-            UPDATE concept_learning_progress
-            SET applications_count = ?, last_applied_timestamp = ?
-            WHERE id = ?
-        """, (count + 1, timestamp, progress_id))
+            SELECT a.id, a.name
+            FROM knowledge_areas a
+            WHERE NOT EXISTS (
+                SELECT 1 FROM knowledge_area_closure cl
+                WHERE cl.descendant_id = a.id AND cl.depth = 1
+            )
+            ORDER BY a.name
+        """)
     else:
-        # Insert new record
         cur.execute("""
-            INSERT INTO concept_learning_progress (concept_id, technique_id, applications_count, last_applied_timestamp)
-            VALUES (?, ?, 1, ?)
-        """, (concept_id, technique_id, timestamp))
+            SELECT a.id, a.name
+            FROM knowledge_area_closure cl
+            JOIN knowledge_areas a ON a.id = cl.descendant_id
+            WHERE cl.ancestor_id = ? AND cl.depth = 1
+            ORDER BY a.name
+        """, (parent_id,))
+    return cur.fetchall()
 
-    conn.commit()
+
+# Retrievability of concept c from learning_data ld and its last review,
+# NULL for concepts that were never reviewed. The last-review lookup is a
+# seek on idx_recall_sessions_concept_timestamp.
+_CONCEPT_RETRIEVABILITY_SQL = retrievability_sql(
+    """CAST(julianday(?) - julianday(
+           (SELECT MAX(rs.timestamp) FROM recall_sessions rs WHERE rs.concept_id = c.id)
+       ) AS INTEGER)""",
+    "ld.stability")
+
+
+def get_area_rollups(conn, parent_id=None):
+    """
+    Roll mastery and due counts up the subtree of each child area of parent_id
+    (or of each root area), with a single query over the closure table.
+
+    Mastery is the average retrievability of the reviewed concepts below the
+    area, as in database.get_topic_mastery.
+
+    :return: list of (area_id, name, concept_count, reviewed_count, mastery, due_count)
+    """
+    children = get_child_areas(conn, parent_id)
+    if not children:
+        return []
+
+    placeholders = ",".join("?" * len(children))
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT ancestor_id, COUNT(*), COUNT(r), COALESCE(AVG(r), 0.0), COALESCE(SUM(r <= ?), 0)
+        FROM (
+            SELECT cl.ancestor_id, {_CONCEPT_RETRIEVABILITY_SQL} AS r
+            FROM knowledge_area_closure cl
+            JOIN topic_areas ta ON ta.area_id = cl.descendant_id
+            JOIN concepts c ON c.topic_id = ta.topic_id
+            LEFT JOIN learning_data ld ON ld.concept_id = c.id
+            WHERE cl.ancestor_id IN ({placeholders})
+        )
+        GROUP BY ancestor_id
+    """, (DUE_RETRIEVABILITY, clock.now().isoformat(), *[area_id for area_id, _ in children]))
+    totals = {row[0]: row[1:] for row in cur.fetchall()}
+
+    return [(area_id, name, *totals.get(area_id, (0, 0, 0.0, 0))) for area_id, name in children]
+
+
+def get_area_topic_rollups(conn, area_id):
+    """
+    Mastery and due counts of the topics placed directly in an area.
+
+    :return: list of (topic_id, name, concept_count, reviewed_count, mastery, due_count)
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT topic_id, name, COUNT(concept_id), COUNT(r), COALESCE(AVG(r), 0.0), COALESCE(SUM(r <= ?), 0)
+        FROM (
+            SELECT t.id AS topic_id, t.name, c.id AS concept_id, {_CONCEPT_RETRIEVABILITY_SQL} AS r
+            FROM topic_areas ta
+            JOIN topics t ON t.id = ta.topic_id
+            LEFT JOIN concepts c ON c.topic_id = t.id
+            LEFT JOIN learning_data ld ON ld.concept_id = c.id
+            WHERE ta.area_id = ?
+        )
+        GROUP BY topic_id
+        ORDER BY name
+    """, (DUE_RETRIEVABILITY, clock.now().isoformat(), area_id))
+    return cur.fetchall()
+
+
+def iter_due_concepts(conn, threshold=DUE_RETRIEVABILITY, include_new=False, limit=None):
+    """
+    Stream the concepts due for review, least retrievable first.
+
+    :param conn: the Connection object
+    :param threshold: retrievability at or below which a concept is due
+    :param include_new: also yield never-reviewed concepts (after the due ones)
+    :param limit: maximum number of concepts
+    :return: iterator of (concept_id, topic_id, topic_name, content, retrievability);
+             retrievability is None for new concepts
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT concept_id, topic_id, topic_name, content, r
+        FROM (
+            SELECT c.id AS concept_id, t.id AS topic_id, t.name AS topic_name, c.content,
+                   {_CONCEPT_RETRIEVABILITY_SQL} AS r
+            FROM concepts c
+            JOIN topics t ON t.id = c.topic_id
+            LEFT JOIN learning_data ld ON ld.concept_id = c.id
+        )
+        WHERE r <= ? OR (? AND r IS NULL)
+        ORDER BY r IS NULL, r, concept_id
+        LIMIT ?
+    """, (clock.now().isoformat(), threshold, include_new, -1 if limit is None else limit))
+    yield from cur
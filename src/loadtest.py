@@ -0,0 +1,187 @@
+import datetime
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import clock
+from database import (clone_schema, add_topic, add_concepts,
+                      get_next_concept_to_review, get_all_topics_with_mastery)
+from knowledge_base import allocate_technique
+from review import record_review
+from ui_monitor import percentile
+
+# Relative weights of the operations each worker runs
+DEFAULT_MIX = {"next_card": 6, "submit": 3, "mastery": 1}
+JOURNAL_MODES = ["wal", "delete", "truncate", "persist"]
+
+
+def generate_database(db_file, topics=10, concepts_per_topic=200, reviews_per_concept=3, new_fraction=0.1, seed=0):
+    """
+    Create a deck with reviewed concepts to run load tests against.
+
+    Reviews are spread over the 90 days before now, so the deck has both due
+    and not yet due concepts; new_fraction of the concepts is left new.
+
+    :return: number of concepts
+    """
+    conn = clone_schema(db_file)
+    rng = random.Random(seed)
+    now = clock.now()
+    try:
+        for topic in range(topics):
+            topic_id = add_topic(conn, f"Load test topic {topic}")
+            concept_ids = add_concepts(conn, topic_id, [f"Load test concept {topic}.{i}: " + "fact " * rng.randint(5, 40)
+                                                        for i in range(concepts_per_topic)])
+            for concept_id in concept_ids:
+                if rng.random() < new_fraction:
+                    continue
+                # Days ago, in order and never in the future
+                days_ago = rng.randint(3 * reviews_per_concept, 90)
+                for _ in range(reviews_per_concept):
+                    days_ago -= rng.randint(1, 3)
+                    timestamp = now - datetime.timedelta(days=days_ago)
+                    record_review(conn, concept_id, "response", rng.randint(1, 4), technique="Recall",
+                                  timestamp=timestamp, commit=False)
+            conn.commit()
+    finally:
+        conn.close()
+    return topics * concepts_per_topic
+
+
+def set_journal_mode(db_file, journal_mode):
+    """
+    Switch a database's journal mode; no other connection may be open.
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        mode = conn.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0]
+    finally:
+        conn.close()
+    return mode
+
+
+def _is_lock_error(e):
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e))
+
+
+def _run_worker(args):
+    """
+    Run random operations on one connection until the deadline.
+
+    Submits take the write lock with BEGIN IMMEDIATE first, so the time spent
+    waiting for it is measured separately as the lock wait.
+
+    :return: dict with latencies (ms) and error counts per operation, and
+             the submit lock waits (ms)
+    """
+    db_file, mix, start_at, deadline, busy_timeout_ms, synchronous, seed = args
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_file, timeout=busy_timeout_ms / 1000)
+    if synchronous:
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+    concept_ids = [row[0] for row in conn.execute("SELECT id FROM concepts")]
+    names, weights = list(mix), list(mix.values())
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    other_errors = {name: 0 for name in names}
+    lock_waits = []
+
+    def next_card():
+        concept = get_next_concept_to_review(conn)
+        if concept:
+            allocate_technique(conn, concept[0])
+
+    def submit():
+        wait_start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        lock_waits.append((time.perf_counter() - wait_start) * 1000)
+        if record_review(conn, rng.choice(concept_ids), "response", rng.randint(1, 4),
+                         technique="Recall", commit=False) is None:
+            # record_review printed the error
+            raise sqlite3.Error("Failed to record review")
+        conn.commit()
+
+    operations = {"next_card": next_card, "submit": submit, "mastery": lambda: get_all_topics_with_mastery(conn)}
+
+    time.sleep(max(start_at - time.time(), 0))
+    try:
+        while time.time() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                operations[name]()
+                latencies[name].append((time.perf_counter() - start) * 1000)
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if _is_lock_error(e):
+                    errors[name] += 1
+                else:
+                    other_errors[name] += 1
+    finally:
+        conn.close()
+    return {"latencies": latencies, "locked": errors, "errors": other_errors, "lock_waits": lock_waits}
+
+
+def run_load_test(db_file, workers=4, mode="thread", duration=5.0, mix=None, journal_mode="wal",
+                  busy_timeout_ms=5000, synchronous=None, seed=0):
+    """
+    Run a mix of next-card, submit and mastery operations from several
+    threads or processes against one database, each with its own connection.
+
+    :param db_file: database to test, e.g. from generate_database
+    :param workers: number of concurrent threads or processes
+    :param mode: "thread" or "process"
+    :param duration: seconds to run
+    :param mix: dict of operation name -> relative weight (defaults to DEFAULT_MIX)
+    :param journal_mode: journal mode set before the run, or None to keep the current one
+    :param busy_timeout_ms: how long a connection waits for a lock before
+                            failing with "database is locked"
+    :param synchronous: optional PRAGMA synchronous value for the workers
+    :param seed: base random seed; worker i uses seed + i
+    :return: dict with the settings, overall throughput and, per operation,
+             count, throughput, p50/p95/p99/max latency and lock errors
+    """
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise ValueError(f"Unknown operations: {', '.join(sorted(unknown))}")
+    if journal_mode:
+        journal_mode = set_journal_mode(db_file, journal_mode)
+
+    # Workers start together, after processes have had time to spin up
+    start_at = time.time() + (0.5 if mode == "process" else 0.05)
+    tasks = [(db_file, mix, start_at, start_at + duration, busy_timeout_ms, synchronous, seed + index)
+             for index in range(workers)]
+    executor_class = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        results = list(executor.map(_run_worker, tasks))
+
+    operations = {}
+    total = 0
+    for name in mix:
+        values = [value for result in results for value in result["latencies"][name]]
+        total += len(values)
+        operations[name] = {
+            "count": len(values),
+            "per_second": len(values) / duration,
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "max_ms": max(values) if values else None,
+            "locked_errors": sum(result["locked"][name] for result in results),
+            "other_errors": sum(result["errors"][name] for result in results),
+        }
+    lock_waits = [value for result in results for value in result["lock_waits"]]
+    return {
+        "workers": workers,
+        "mode": mode,
+        "journal_mode": journal_mode,
+        "busy_timeout_ms": busy_timeout_ms,
+        "synchronous": synchronous,
+        "duration": duration,
+        "per_second": total / duration,
+        "lock_wait_p95_ms": percentile(lock_waits, 95),
+        "lock_wait_max_ms": max(lock_waits) if lock_waits else None,
+        "operations": operations,
+    }
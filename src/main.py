@@ -1,16 +1,62 @@
+import argparse
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox
-from database import (create_connection, add_topic, get_all_topics,
+from database import (create_connection, init_schema, main as create_db, add_topic, get_all_topics,
                     add_concept, get_concepts_for_topic, get_all_topics_with_mastery,
-                    get_next_concept_to_review, record_recall_session,
-                    initialize_learning_data, update_learning_data)
-from knowledge_base import allocate_technique, get_technique_id_by_name, update_concept_learning_progress
-from fsrs import FSRS, default_params
+                    get_next_concept_to_review)
+from knowledge_base import allocate_technique, get_area_rollups, get_area_topic_rollups
+from review import record_review
+from grading_pipeline import GradingPipeline
+from write_behind import ReviewWriteBehind
+from forecast import forecast_reviews
+from dedupe import find_near_duplicates
+from mastery_history import update_mastery_history, get_mastery_history
+from shards import DeckManager
+from backup import BackupScheduler
+from ui_monitor import UIMonitor
+from replica import open_replicated
+from query_plans import assert_query_plans
+from concept_bodies import ConceptBodyCache
+from concept_bins import bin_concepts
+import clock
 import datetime
 from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
 DB_FILE = "data/learning_data.db"
+GRADING_POLL_MS = 100
+
+# Optional write-behind mode: reviews are journaled and flushed to the
+# database in batches on a timer, when a batch fills up, before the review
+# history is read back and when the app closes
+WRITE_BEHIND = os.environ.get("LEARNING_APP_WRITE_BEHIND") == "1"
+WRITE_BEHIND_FLUSH_MS = 5000
+
+# Optional UI telemetry: event-loop lag, handler latencies and stall stacks,
+# written to <db>_ui_metrics.json and summarized in a status bar
+MONITOR = os.environ.get("LEARNING_APP_MONITOR") == "1"
+MONITOR_STATUS_MS = 1000
+MONITORED_HANDLERS = ["get_next_action", "submit_response", "apply_graded_responses", "flush_reviews",
+                      "update_dashboard", "update_forecast", "update_trends", "on_area_open",
+                      "populate_topics_list", "populate_concepts_list", "on_topic_select",
+                      "add_new_topic", "add_new_concept"]
+
+# Optional in-memory replica: reads are served from a copy of the database
+# loaded at startup, writes go to the copy and asynchronously to the file
+REPLICA = os.environ.get("LEARNING_APP_REPLICA") == "1"
+
+# Debug check at startup: fail if a hot query plans a full scan or a
+# temporary sort it was not registered with (see query_plans)
+CHECK_PLANS = os.environ.get("LEARNING_APP_CHECK_PLANS") == "1"
+
+# Online backups on a background thread, rotated to the newest BACKUP_KEEP
+BACKUP_INTERVAL_HOURS = 24
+BACKUP_KEEP = 7
+
+# Dashboard views and the metric their concepts are binned by
+DASHBOARD_VIEWS = {"Topic mastery": None, "Retrievability": "retrievability", "Stability": "stability"}
+DASHBOARD_REBIN_DELAY_MS = 200
 
 class Tooltip:
     def __init__(self, widget, text):
@@ -40,19 +86,47 @@ class Tooltip:
         self.tooltip = None
 
 class App(tk.Tk):
-    def __init__(self):
+    def __init__(self, db_file=DB_FILE):
         super().__init__()
         self.title("Learning App")
         self.geometry("800x600")
-        self.conn = create_connection(DB_FILE)
+        if REPLICA and os.path.exists(db_file):
+            self.conn, mode = open_replicated(db_file)
+            print(f"Serving reads from {mode}")
+        else:
+            self.conn = create_connection(db_file)
         if self.conn is None:
-            messagebox.showerror("Database Error", f"Could not create or connect to the database at {DB_FILE}")
+            messagebox.showerror("Database Error", f"Could not create or connect to the database at {db_file}")
             self.destroy()
             return
+        # Add the tables, indexes and triggers newer than the database
+        init_schema(self.conn)
+        if CHECK_PLANS:
+            print(assert_query_plans(self.conn))
+        # Full texts of long concepts, read when their card is shown
+        self.concept_bodies = ConceptBodyCache(self.conn)
+        self.grading = GradingPipeline()
+        journal_path = os.path.splitext(db_file)[0] + "_reviews.jsonl"
+        self.write_behind = ReviewWriteBehind(self.conn, journal_path) if WRITE_BEHIND else None
+        self.backups = BackupScheduler(db_file, os.path.join(os.path.dirname(db_file) or ".", "backups"),
+                                       interval_s=BACKUP_INTERVAL_HOURS * 3600, keep=BACKUP_KEEP).start()
+        self.monitor = None
+        if MONITOR:
+            self.monitor = UIMonitor(self, os.path.splitext(db_file)[0] + "_ui_metrics.json")
+            # Before create_widgets, so buttons bind the timed handlers
+            self.monitor.instrument(self, MONITORED_HANDLERS)
         self.create_widgets()
+        if self.monitor:
+            self.monitor_bar = ttk.Label(self, anchor="w")
+            self.monitor_bar.pack(side="bottom", fill="x")
+            self.monitor.start()
+            self.after(MONITOR_STATUS_MS, self.update_status_bar)
         self.populate_topics_list()
         self.current_concept = None
         self.current_technique = None
+        self.after(GRADING_POLL_MS, self.poll_grading)
+        if self.write_behind:
+            self.after(WRITE_BEHIND_FLUSH_MS, self.poll_write_behind)
 
     def create_widgets(self):
         self.notebook = ttk.Notebook(self)
@@ -73,6 +147,16 @@ class App(tk.Tk):
         self.notebook.add(self.autonomous_tab, text="Autonomous")
         self.create_autonomous_widgets(self.autonomous_tab)
 
+        # --- Forecast Tab ---
+        self.forecast_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.forecast_tab, text="Forecast")
+        self.create_forecast_widgets(self.forecast_tab)
+
+        # --- Trends Tab ---
+        self.trends_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.trends_tab, text="Trends")
+        self.create_trends_widgets(self.trends_tab)
+
         # --- Status Bar ---
         self.status_bar = tk.Label(self, text="Ready", bd=1, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
@@ -102,10 +186,14 @@ class App(tk.Tk):
         submit_button.pack(pady=5)
 
     def get_next_action(self):
-        next_concept = get_next_concept_to_review(self.conn)
+        pending = self.grading.pending_concept_ids()
+        if self.write_behind:
+            pending |= self.write_behind.pending_concept_ids()
+        next_concept = get_next_concept_to_review(self.conn, exclude=pending)
         if next_concept:
-            self.current_concept = next_concept
-            concept_id, _, concept_content = next_concept
+            concept_id, topic_id, _ = next_concept
+            concept_content = self.concept_bodies.get(concept_id)
+            self.current_concept = (concept_id, topic_id, concept_content)
 
             technique = allocate_technique(self.conn, concept_id)
             self.current_technique = technique
@@ -130,63 +218,46 @@ class App(tk.Tk):
             messagebox.showwarning("Empty Response", "Please enter a response.")
             return
 
-        # For now, we'll use a fixed grade of 'Good' (3)
-        grade = 3
-        concept_id = self.current_concept[0]
-
-        # 1. Record the recall session
-        record_recall_session(self.conn, concept_id, user_response, grade)
-
-        # 2. Update FSRS data
-        fsrs = FSRS(default_params)
-
-        # Check if the concept has existing learning data
-        cur = self.conn.cursor()
-        cur.execute("SELECT difficulty, stability FROM learning_data WHERE concept_id = ?", (concept_id,))
-        result = cur.fetchone()
+        # Grading runs on the worker pool; the review is recorded once
+        # poll_grading picks up the grade
+        concept_id, _, concept_content = self.current_concept
+        self.grading.submit(concept_id, user_response, concept_content,
+                            technique=self.current_technique, timestamp=clock.now())
+        self.status_bar.config(text=f"Grading response for concept {concept_id}...")
 
-        if result:
-            # Update existing FSRS data
-            difficulty, stability = result
-
-            # We need the last review date to calculate retrievability
-            cur.execute("""
-                SELECT MAX(rs.timestamp) FROM recall_sessions rs
-                WHERE rs.concept_id = ? AND rs.id != (SELECT MAX(id) FROM recall_sessions WHERE concept_id = ?)
-            """, (concept_id, concept_id))
-            last_review_str = cur.fetchone()[0]
+        # Get the next action for the user
+        self.get_next_action()
 
-            if last_review_str:
-                last_review_date = datetime.datetime.fromisoformat(last_review_str)
-                days_since_review = (datetime.datetime.now() - last_review_date).days
+    def poll_grading(self):
+        self.apply_graded_responses()
+        self.after(GRADING_POLL_MS, self.poll_grading)
+
+    def apply_graded_responses(self):
+        for graded in self.grading.drain():
+            if graded.error:
+                print(f"Grading failed for concept {graded.concept_id}: {graded.error}")
+            if self.write_behind:
+                result = self.write_behind.submit(graded.concept_id, graded.user_response, graded.grade,
+                                                  technique=graded.technique, timestamp=graded.timestamp)
+                self.write_behind.flush_if_full()
             else:
-                # This is the first review after being a new card
-                days_since_review = 0
-
-
-            retrievability = fsrs.retrievability(days_since_review, stability) if last_review_str else 1.0
-
-            new_difficulty = fsrs.new_difficulty(difficulty, grade)
-            new_stability = fsrs.new_stability(new_difficulty, stability, retrievability, grade)
-
-            update_learning_data(self.conn, concept_id, new_difficulty, new_stability)
-            self.status_bar.config(text=f"Updated concept {concept_id}. New D: {new_difficulty:.2f}, S: {new_stability:.2f}")
-
-        else:
-            # Initialize FSRS data for a new concept
-            stability = fsrs.initial_stability(grade)
-            difficulty = fsrs.initial_difficulty(grade)
-            initialize_learning_data(self.conn, concept_id, difficulty, stability)
-            self.status_bar.config(text=f"Initialized concept {concept_id}. D: {difficulty:.2f}, S: {stability:.2f}")
-
-        # 3. Update concept learning progress
-        technique_id = get_technique_id_by_name(self.conn, self.current_technique)
-        if technique_id:
-            update_concept_learning_progress(self.conn, concept_id, technique_id)
-
-        # 4. Get the next action for the user
-        messagebox.showinfo("Success", "Response recorded successfully!")
-        self.get_next_action()
+                result = record_review(self.conn, graded.concept_id, graded.user_response, graded.grade,
+                                       technique=graded.technique, timestamp=graded.timestamp)
+            if result is None:
+                self.status_bar.config(text=f"Error: Failed to record review for concept {graded.concept_id}")
+                continue
+            difficulty, stability, is_new = result
+            action = "Initialized" if is_new else "Updated"
+            self.status_bar.config(text=f"{action} concept {graded.concept_id} (grade {graded.grade}). "
+                                        f"D: {difficulty:.2f}, S: {stability:.2f}")
+
+    def flush_reviews(self):
+        if self.write_behind:
+            self.write_behind.flush()
+
+    def poll_write_behind(self):
+        self.flush_reviews()
+        self.after(WRITE_BEHIND_FLUSH_MS, self.poll_write_behind)
 
     def create_management_widgets(self, parent_frame):
         # Main frames
@@ -235,23 +306,152 @@ class App(tk.Tk):
     def create_dashboard_widgets(self, parent_frame):
         self.fig = Figure(figsize=(5, 4), dpi=100)
         self.ax = self.fig.add_subplot(111)
+        self.dashboard_mesh = None
+        self.dashboard_colorbar = None
+        self.dashboard_rebin_job = None
 
         self.canvas = FigureCanvasTkAgg(self.fig, master=parent_frame)
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
-
-        refresh_button = ttk.Button(parent_frame, text="Refresh", command=self.update_dashboard)
-        refresh_button.pack(side=tk.BOTTOM, pady=5)
+        # Zooming a concept view re-bins the visible range
+        self.dashboard_toolbar = NavigationToolbar2Tk(self.canvas, parent_frame, pack_toolbar=False)
+        self.dashboard_toolbar.pack(side=tk.BOTTOM, fill=tk.X)
+
+        controls_frame = ttk.Frame(parent_frame)
+        controls_frame.pack(side=tk.BOTTOM, pady=5)
+
+        ttk.Label(controls_frame, text="View:").pack(side="left", padx=5)
+        self.dashboard_view = ttk.Combobox(controls_frame, values=tuple(DASHBOARD_VIEWS), width=16, state="readonly")
+        self.dashboard_view.set("Topic mastery")
+        self.dashboard_view.pack(side="left", padx=5)
+        self.dashboard_view.bind("<<ComboboxSelected>>", lambda event: self.update_dashboard())
+        Tooltip(self.dashboard_view, "Topic averages, or how the concepts of each topic are spread")
+
+        refresh_button = ttk.Button(controls_frame, text="Refresh", command=self.update_dashboard)
+        refresh_button.pack(side="left", padx=5)
         Tooltip(refresh_button, "Refresh the mastery dashboard")
 
+        # Knowledge area drill-down: children are only queried when a node is opened
+        self.areas_tree = ttk.Treeview(parent_frame, columns=("mastery", "due", "concepts"), height=6)
+        self.areas_tree.heading("#0", text="Knowledge Area / Topic")
+        self.areas_tree.heading("mastery", text="Mastery")
+        self.areas_tree.heading("due", text="Due")
+        self.areas_tree.heading("concepts", text="Concepts")
+        for column in ("mastery", "due", "concepts"):
+            self.areas_tree.column(column, width=80, anchor=tk.E)
+        self.areas_tree.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
+        self.areas_tree.bind("<<TreeviewOpen>>", self.on_area_open)
+
         self.notebook.bind("<<Ttk::NotebookTabChanged>>", self.on_tab_changed)
 
+    def create_forecast_widgets(self, parent_frame):
+        controls_frame = ttk.Frame(parent_frame)
+        controls_frame.pack(side=tk.BOTTOM, pady=5)
+
+        ttk.Label(controls_frame, text="Horizon (days):").pack(side="left", padx=5)
+        self.forecast_horizon = ttk.Combobox(controls_frame, values=("30", "90", "365"), width=5, state="readonly")
+        self.forecast_horizon.set("30")
+        self.forecast_horizon.pack(side="left", padx=5)
+        self.forecast_horizon.bind("<<ComboboxSelected>>", lambda event: self.update_forecast())
+        Tooltip(self.forecast_horizon, "Number of days to forecast")
+
+        refresh_button = ttk.Button(controls_frame, text="Refresh", command=self.update_forecast)
+        refresh_button.pack(side="left", padx=5)
+        Tooltip(refresh_button, "Refresh the review workload forecast")
+
+        self.forecast_fig = Figure(figsize=(5, 4), dpi=100)
+        self.forecast_ax = self.forecast_fig.add_subplot(111)
+
+        self.forecast_canvas = FigureCanvasTkAgg(self.forecast_fig, master=parent_frame)
+        self.forecast_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+    def create_trends_widgets(self, parent_frame):
+        self.trends_fig = Figure(figsize=(5, 4), dpi=100)
+        self.trends_ax = self.trends_fig.add_subplot(111)
+
+        self.trends_canvas = FigureCanvasTkAgg(self.trends_fig, master=parent_frame)
+        self.trends_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+        refresh_button = ttk.Button(parent_frame, text="Refresh", command=self.update_trends)
+        refresh_button.pack(side=tk.BOTTOM, pady=5)
+        Tooltip(refresh_button, "Refresh the mastery trends")
+
     def on_tab_changed(self, event):
         selected_tab = self.notebook.index(self.notebook.select())
         if selected_tab == 1:  # Dashboard tab
             self.update_dashboard()
+        elif selected_tab == 3:  # Forecast tab
+            self.update_forecast()
+        elif selected_tab == 4:  # Trends tab
+            self.update_trends()
+
+    def update_trends(self):
+        self.flush_reviews()
+        # Only the days since the last update are computed
+        update_mastery_history(self.conn)
+
+        self.trends_ax.clear()
+        history = get_mastery_history(self.conn)
+        if not history:
+            self.trends_ax.set_title("No mastery history yet")
+            self.trends_canvas.draw()
+            return
+
+        topic_names = {topic_id: name for topic_id, name in get_all_topics(self.conn)}
+        series = {}
+        for topic_id, day, mastery, _ in history:
+            days, values = series.setdefault(topic_id, ([], []))
+            days.append(datetime.date.fromisoformat(day))
+            values.append(mastery)
+
+        for topic_id, (days, values) in series.items():
+            self.trends_ax.plot(days, values, label=topic_names.get(topic_id, f"Topic {topic_id}"))
+        self.trends_ax.set_title("Mastery Trends")
+        self.trends_ax.set_ylabel("Mastery Score")
+        self.trends_ax.set_ylim(0, 1)
+        self.trends_ax.legend(loc="lower left", fontsize="small")
+        self.trends_fig.autofmt_xdate()
+        self.trends_fig.tight_layout()
+
+        self.trends_canvas.draw()
+
+    def update_forecast(self):
+        self.flush_reviews()
+        self.forecast_ax.clear()
+
+        horizon = int(self.forecast_horizon.get())
+        topics, counts = forecast_reviews(self.conn, horizon)
+
+        if not topics or not counts.any():
+            self.forecast_ax.set_title("No reviews to forecast")
+            self.forecast_canvas.draw()
+            return
+
+        # One stacked band per topic keeps the artist count independent of the horizon
+        days = range(horizon)
+        self.forecast_ax.stackplot(days, counts, labels=[t[1] for t in topics])
+        self.forecast_ax.set_title(f"Review Forecast ({counts.sum()} reviews in {horizon} days)")
+        self.forecast_ax.set_xlabel("Days from today")
+        self.forecast_ax.set_ylabel("Reviews due")
+        self.forecast_ax.set_xlim(0, horizon - 1)
+        self.forecast_ax.legend(loc="upper right", fontsize="small")
+        self.forecast_fig.tight_layout()
+
+        self.forecast_canvas.draw()
 
     def update_dashboard(self):
-        self.ax.clear()
+        self.flush_reviews()
+        self.update_areas_tree()
+        # Start from a fresh figure so a heatmap's colorbar does not linger
+        self.fig.clear()
+        self.ax = self.fig.add_subplot(111)
+        self.dashboard_mesh = None
+        self.dashboard_colorbar = None
+
+        metric = DASHBOARD_VIEWS.get(self.dashboard_view.get())
+        if metric:
+            self.draw_concept_bins(metric)
+            self.dashboard_toolbar.update()
+            return
 
         topics_with_mastery = get_all_topics_with_mastery(self.conn)
 
@@ -271,6 +471,85 @@ class App(tk.Tk):
 
         self.canvas.draw()
 
+    def draw_concept_bins(self, metric, value_range=None):
+        """
+        Draw the concepts of every topic binned by metric as a heatmap with
+        one row per topic. The bins come from SQL, so the plot is a single
+        mesh whatever the number of concepts.
+        """
+        topics, edges, counts = bin_concepts(self.conn, metric, value_range=value_range)
+        if not topics:
+            self.ax.set_title("No topics to display")
+            self.canvas.draw()
+            return
+
+        if self.dashboard_mesh is not None:
+            self.dashboard_mesh.remove()
+        self.dashboard_mesh = self.ax.pcolormesh(edges, range(len(topics) + 1), counts, cmap="viridis")
+        if self.dashboard_colorbar is None:
+            self.dashboard_colorbar = self.fig.colorbar(self.dashboard_mesh, ax=self.ax, label="Concepts")
+        else:
+            self.dashboard_colorbar.update_normal(self.dashboard_mesh)
+
+        if value_range is None:
+            if metric == "stability":
+                self.ax.set_xscale("log")
+            self.ax.set_xlim(edges[0], edges[-1])
+            self.ax.set_ylim(0, len(topics))
+            self.ax.set_yticks([row + 0.5 for row in range(len(topics))], [name for _, name in topics])
+            self.ax.set_xlabel("Stability (days)" if metric == "stability" else "Retrievability")
+            self.ax.set_title(f"Concepts by {metric} ({counts.sum()} reviewed)")
+            self.ax.callbacks.connect("xlim_changed", self.on_dashboard_zoom)
+            self.fig.tight_layout()
+        self.canvas.draw_idle()
+
+    def on_dashboard_zoom(self, ax):
+        if self.dashboard_mesh is None:
+            return
+        # Zooming and panning change the limits many times; re-bin once they settle
+        if self.dashboard_rebin_job is not None:
+            self.after_cancel(self.dashboard_rebin_job)
+        self.dashboard_rebin_job = self.after(DASHBOARD_REBIN_DELAY_MS, self.rebin_dashboard)
+
+    def rebin_dashboard(self):
+        self.dashboard_rebin_job = None
+        metric = DASHBOARD_VIEWS.get(self.dashboard_view.get())
+        if not metric or self.dashboard_mesh is None:
+            return
+        low, high = sorted(self.ax.get_xlim())
+        if metric == "stability":
+            low = max(low, 1e-3)
+        elif low >= 1 or high <= 0:
+            return
+        if high > low:
+            self.draw_concept_bins(metric, (low, high))
+
+    def update_areas_tree(self):
+        self.areas_tree.delete(*self.areas_tree.get_children())
+        self.insert_area_rows("", get_area_rollups(self.conn))
+
+    def insert_area_rows(self, parent, rollups):
+        for area_id, name, concept_count, _, mastery, due_count in rollups:
+            item = self.areas_tree.insert(parent, tk.END, iid=f"area-{area_id}", text=name,
+                                          values=(f"{mastery:.2f}", due_count, concept_count))
+            # Placeholder child so the area can be expanded
+            self.areas_tree.insert(item, tk.END, iid=f"placeholder-{area_id}", text="...")
+
+    def on_area_open(self, event):
+        item = self.areas_tree.focus()
+        if not item.startswith("area-"):
+            return
+        area_id = int(item.split("-", 1)[1])
+        placeholder = f"placeholder-{area_id}"
+        if not self.areas_tree.exists(placeholder):
+            return
+        self.areas_tree.delete(placeholder)
+
+        self.insert_area_rows(item, get_area_rollups(self.conn, area_id))
+        for topic_id, name, concept_count, _, mastery, due_count in get_area_topic_rollups(self.conn, area_id):
+            self.areas_tree.insert(item, tk.END, iid=f"topic-{topic_id}", text=name,
+                                   values=(f"{mastery:.2f}", due_count, concept_count))
+
     def populate_topics_list(self):
         self.topics_listbox.delete(0, tk.END)
         self.topics_data = get_all_topics(self.conn)
@@ -310,13 +589,18 @@ class App(tk.Tk):
     def add_new_concept(self):
         concept_content = self.concept_entry.get()
         if concept_content and hasattr(self, 'selected_topic'):
+            duplicates = find_near_duplicates(self.conn, content=concept_content)
             if add_concept(self.conn, self.selected_topic[0], concept_content) is None:
                 messagebox.showerror("Database Error", "Failed to add the new concept.")
                 self.status_bar.config(text="Error: Failed to add new concept.")
             else:
                 self.concept_entry.delete(0, tk.END)
                 self.populate_concepts_list()
-                self.status_bar.config(text="Concept added successfully.")
+                if duplicates:
+                    self.status_bar.config(text=f"Concept added. It looks like a near-duplicate of "
+                                                f"{len(duplicates)} existing concept(s).")
+                else:
+                    self.status_bar.config(text="Concept added successfully.")
 
     def show_topic_selection(self):
         self.concept_management_frame.pack_forget()
@@ -324,13 +608,35 @@ class App(tk.Tk):
         if hasattr(self, 'selected_topic'):
             del self.selected_topic
 
+    def update_status_bar(self):
+        self.monitor_bar.config(text=self.monitor.status_text())
+        self.after(MONITOR_STATUS_MS, self.update_status_bar)
+
     def on_closing(self):
+        if self.monitor:
+            self.monitor.stop()
+        # Wait for outstanding grades so no submitted review is lost
+        self.grading.shutdown(wait=True)
+        # Let a running backup finish rather than leave a partial file
+        self.backups.stop(wait=True)
         if self.conn:
+            self.apply_graded_responses()
+            if self.write_behind:
+                self.write_behind.close()
             self.conn.close()
         self.destroy()
 
 
 if __name__ == "__main__":
-    app = App()
+    parser = argparse.ArgumentParser(description="Learning App")
+    parser.add_argument("--deck", help="open a per-learner or per-subject deck database instead of the default one")
+    args = parser.parse_args()
+
+    if args.deck:
+        db_file = DeckManager().deck_path(args.deck)
+        create_db(db_file)
+    else:
+        db_file = DB_FILE
+    app = App(db_file)
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
     app.mainloop()
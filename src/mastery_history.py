@@ -0,0 +1,234 @@
+import datetime
+import sqlite3
+import numpy as np
+import clock
+from fsrs import FSRS, default_params
+from review import next_state, as_fsrs_grade
+
+
+def create_mastery_history_tables(conn):
+    """
+    Create the daily mastery history table and the replay state it is built from.
+    """
+    try:
+        c = conn.cursor()
+
+        # One mastery snapshot per topic and day
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS topic_mastery_history (
+                topic_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                mastery REAL NOT NULL,
+                reviewed_count INTEGER NOT NULL,
+                PRIMARY KEY (topic_id, day)
+            ) WITHOUT ROWID
+        """)
+
+        # FSRS state of every reviewed concept at the end of the last computed day
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS mastery_history_state (
+                concept_id INTEGER PRIMARY KEY,
+                topic_id INTEGER NOT NULL,
+                difficulty REAL NOT NULL,
+                stability REAL NOT NULL,
+                last_review TEXT NOT NULL
+            )
+        """)
+
+        # The last day included in the history, and the last review read
+        # into it: reviews added later but dated before last_day call for a
+        # rebuild
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS mastery_history_cursor (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_day TEXT NOT NULL,
+                last_session_id INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = [row[1] for row in c.execute("PRAGMA table_info(mastery_history_cursor)")]
+        if "last_session_id" not in columns:
+            c.execute("ALTER TABLE mastery_history_cursor ADD COLUMN last_session_id INTEGER NOT NULL DEFAULT 0")
+
+        # Range scans of one day of reviews
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recall_sessions_timestamp ON recall_sessions (timestamp)")
+
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error creating mastery history tables: {e}")
+
+
+def update_mastery_history(conn, until=None):
+    """
+    Extend the daily mastery history up to and including `until`.
+
+    Each day is computed once, from the stored state of the previous day plus
+    that day's reviews replayed through FSRS, so a daily run only reads one
+    day of recall_sessions. On a database without history this streams the
+    whole review log once (see backfill_mastery_history).
+
+    A topic's mastery on a day is the average retrievability of its reviewed
+    concepts at the end of that day, as get_topic_mastery would report it.
+
+    Reviews recorded since the last update but dated inside the computed
+    history, e.g. merged from another device, invalidate it; the history is
+    then rebuilt with backfill_mastery_history.
+
+    :param conn: the Connection object
+    :param until: last day to compute (defaults to yesterday, the last complete day)
+    :return: number of days added
+    """
+    if until is None:
+        until = clock.now().date() - datetime.timedelta(days=1)
+
+    cur = conn.cursor()
+    cur.execute("SELECT last_day, last_session_id FROM mastery_history_cursor WHERE id = 1")
+    row = cur.fetchone()
+    if row:
+        first_day = datetime.date.fromisoformat(row[0]) + datetime.timedelta(days=1)
+        cur.execute("SELECT MIN(timestamp) FROM recall_sessions WHERE id > ?", (row[1],))
+        earliest_new = cur.fetchone()[0]
+        if earliest_new is not None and earliest_new < first_day.isoformat():
+            return backfill_mastery_history(conn, until)
+    else:
+        cur.execute("SELECT MIN(timestamp) FROM recall_sessions")
+        first_review = cur.fetchone()[0]
+        if first_review is None:
+            return 0
+        first_day = datetime.datetime.fromisoformat(first_review).date()
+
+    if first_day > until:
+        return 0
+
+    fsrs = FSRS(default_params)
+    range_start = datetime.datetime.combine(first_day, datetime.time())
+    range_end = datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time())
+
+    # Per-concept state as numpy arrays; concepts first seen in this run get
+    # appended, so size the arrays for every concept that may appear
+    cur.execute("SELECT concept_id, topic_id, difficulty, stability, last_review FROM mastery_history_state")
+    state = cur.fetchall()
+    cur.execute("SELECT COUNT(DISTINCT concept_id) FROM recall_sessions WHERE timestamp >= ? AND timestamp < ?",
+                (range_start.isoformat(), range_end.isoformat()))
+    capacity = len(state) + cur.fetchone()[0]
+
+    index = {}
+    concept_ids = np.zeros(capacity, dtype=np.int64)
+    topic_ids = np.zeros(capacity, dtype=np.int64)
+    difficulty = np.zeros(capacity)
+    stability = np.ones(capacity)
+    last_review = [None] * capacity
+    last_review_day = np.zeros(capacity)
+    for i, (concept_id, topic_id, d, s, last) in enumerate(state):
+        index[concept_id] = i
+        concept_ids[i], topic_ids[i], difficulty[i], stability[i] = concept_id, topic_id, d, s
+        last_review[i] = datetime.datetime.fromisoformat(last)
+        last_review_day[i] = _day_number(last_review[i])
+    changed = set()
+
+    read_cur = conn.cursor()
+    read_cur.execute("""
+        SELECT rs.concept_id, c.topic_id, rs.timestamp, rs.ai_grade
+        FROM recall_sessions rs
+        JOIN concepts c ON c.id = rs.concept_id
+        WHERE rs.timestamp >= ? AND rs.timestamp < ?
+        ORDER BY rs.timestamp, rs.id
+    """, (range_start.isoformat(), range_end.isoformat()))
+    pending = read_cur.fetchone()
+
+    write_cur = conn.cursor()
+    day = first_day
+    days_added = 0
+    while day <= until:
+        day_end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+
+        # Replay the day's reviews
+        while pending and pending[2] < day_end.isoformat():
+            concept_id, topic_id, timestamp_str, ai_grade = pending
+            timestamp = datetime.datetime.fromisoformat(timestamp_str)
+            i = index.get(concept_id)
+            if i is None:
+                i = index[concept_id] = len(index)
+                previous = None
+            else:
+                previous = (difficulty[i], stability[i], last_review[i])
+            difficulty[i], stability[i] = next_state(fsrs, previous, as_fsrs_grade(ai_grade), timestamp)
+            concept_ids[i], topic_ids[i] = concept_id, topic_id
+            last_review[i] = timestamp
+            last_review_day[i] = _day_number(timestamp)
+            changed.add(i)
+            pending = read_cur.fetchone()
+
+        # Snapshot every topic at the end of the day
+        n = len(index)
+        if n:
+            elapsed = np.floor(_day_number(day_end) - last_review_day[:n])
+            retrievability = fsrs.retrievability(elapsed, stability[:n])
+            topics, inverse = np.unique(topic_ids[:n], return_inverse=True)
+            totals = np.bincount(inverse, weights=retrievability)
+            counts = np.bincount(inverse)
+            write_cur.executemany("""
+                INSERT OR REPLACE INTO topic_mastery_history (topic_id, day, mastery, reviewed_count)
+                VALUES (?, ?, ?, ?)
+            """, [(int(t), day.isoformat(), float(total / count), int(count))
+                  for t, total, count in zip(topics, totals, counts)])
+
+        days_added += 1
+        day += datetime.timedelta(days=1)
+
+    write_cur.executemany("""
+        INSERT OR REPLACE INTO mastery_history_state (concept_id, topic_id, difficulty, stability, last_review)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(int(concept_ids[i]), int(topic_ids[i]), float(difficulty[i]), float(stability[i]),
+           last_review[i].isoformat()) for i in changed])
+    write_cur.execute("""
+        INSERT OR REPLACE INTO mastery_history_cursor (id, last_day, last_session_id)
+        VALUES (1, ?, (SELECT COALESCE(MAX(id), 0) FROM recall_sessions))
+    """, (until.isoformat(),))
+    conn.commit()
+    return days_added
+
+
+def _day_number(moment):
+    """
+    Fractional days since the proleptic Gregorian epoch.
+    """
+    return moment.toordinal() + (moment - datetime.datetime.combine(moment.date(), datetime.time())).total_seconds() / 86400
+
+
+def backfill_mastery_history(conn, until=None):
+    """
+    Rebuild the whole mastery history from the review log in one streaming pass.
+
+    Also needed after reviews older than the last computed day are added,
+    e.g. by merging another device's history.
+
+    :return: number of days computed
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM topic_mastery_history")
+    cur.execute("DELETE FROM mastery_history_state")
+    cur.execute("DELETE FROM mastery_history_cursor")
+    conn.commit()
+    return update_mastery_history(conn, until)
+
+
+def get_mastery_history(conn, topic_id=None, since=None):
+    """
+    Get daily mastery snapshots.
+
+    :param conn: the Connection object
+    :param topic_id: restrict to one topic
+    :param since: first day (datetime.date) to include
+    :return: list of (topic_id, day, mastery, reviewed_count) ordered by topic and day
+    """
+    sql = "SELECT topic_id, day, mastery, reviewed_count FROM topic_mastery_history WHERE 1 = 1"
+    params = []
+    if topic_id is not None:
+        sql += " AND topic_id = ?"
+        params.append(topic_id)
+    if since is not None:
+        sql += " AND day >= ?"
+        params.append(since.isoformat())
+    cur = conn.cursor()
+    cur.execute(sql + " ORDER BY topic_id, day", params)
+    return cur.fetchall()
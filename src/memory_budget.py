@@ -0,0 +1,174 @@
+import gc
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+from collections import namedtuple
+from database import (create_connection, get_all_topics_with_mastery, get_concepts_for_topic,
+                      get_next_concept_to_review, compute_topic_mastery)
+from knowledge_base import allocate_technique, iter_due_concepts
+from review import record_review
+from loadtest import generate_database
+
+# Deck sizes (concepts) profiled by default
+DEFAULT_SIZES = [1000, 5000]
+
+# Peak Python memory an operation may allocate on a deck of n concepts is
+# peak_base + peak_per_concept * n bytes; retained is what it may keep after
+# its result is dropped. Memory allocated by SQLite itself is not traced.
+MemoryBudget = namedtuple("MemoryBudget", ["peak_base", "peak_per_concept", "retained"])
+MemoryResult = namedtuple("MemoryResult", ["operation", "concepts", "peak", "retained", "peak_budget",
+                                           "retained_budget"])
+
+DEFAULT_BUDGETS = {
+    "topics_with_mastery": MemoryBudget(64 * 1024, 64, 16 * 1024),
+    "concepts_for_topic": MemoryBudget(32 * 1024, 64, 16 * 1024),
+    "next_concept": MemoryBudget(64 * 1024, 0, 16 * 1024),
+    "due_concepts": MemoryBudget(32 * 1024, 0, 16 * 1024),
+    "topic_mastery": MemoryBudget(32 * 1024, 16, 16 * 1024),
+    "allocate_technique": MemoryBudget(16 * 1024, 0, 16 * 1024),
+    "record_review": MemoryBudget(32 * 1024, 0, 16 * 1024),
+    "forecast": MemoryBudget(128 * 1024, 512, 16 * 1024),
+}
+
+
+def _first_topic(conn):
+    return conn.execute("SELECT MIN(id) FROM topics").fetchone()[0]
+
+
+def _last_concept(conn):
+    return conn.execute("SELECT MAX(id) FROM concepts").fetchone()[0]
+
+
+def _forecast(conn):
+    from forecast import forecast_reviews
+    return forecast_reviews(conn, horizon_days=30)
+
+
+def _topics_with_mastery(conn):
+    # Measure the computation, not the cache hit
+    conn.execute("DELETE FROM topic_mastery_cache")
+    return get_all_topics_with_mastery(conn)
+
+
+OPERATIONS = {
+    "topics_with_mastery": _topics_with_mastery,
+    "concepts_for_topic": lambda conn: get_concepts_for_topic(conn, _first_topic(conn)),
+    "next_concept": get_next_concept_to_review,
+    "due_concepts": lambda conn: sum(1 for _ in iter_due_concepts(conn)),
+    "topic_mastery": lambda conn: compute_topic_mastery(conn, _first_topic(conn)),
+    "allocate_technique": lambda conn: allocate_technique(conn, _last_concept(conn)),
+    "record_review": lambda conn: record_review(conn, _last_concept(conn), "response", 3, technique="Recall"),
+    "forecast": _forecast,
+}
+
+
+class MemoryBudgetError(AssertionError):
+    """
+    An operation allocated or retained more memory than its budget.
+    """
+
+
+def load_budgets(path):
+    """
+    Budgets from a JSON file of {operation: {"peak_base": ..., "peak_per_concept": ...,
+    "retained": ...}}, on top of DEFAULT_BUDGETS; missing fields keep their default.
+    """
+    with open(path, encoding="utf-8") as source:
+        overrides = json.load(source)
+    budgets = dict(DEFAULT_BUDGETS)
+    for name, fields in overrides.items():
+        budgets[name] = budgets.get(name, MemoryBudget(0, 0, 0))._replace(**fields)
+    return budgets
+
+
+def measure(operation, conn):
+    """
+    Peak and retained Python memory of one call, after a warm-up call so
+    lazy imports and caches are not counted.
+
+    :return: (peak bytes, retained bytes)
+    """
+    operation(conn)
+    gc.collect()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = operation(conn)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        del result
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        if started:
+            tracemalloc.stop()
+    return peak, max(retained, 0)
+
+
+def profile_memory(sizes=None, operations=None, budgets=None, topics=10):
+    """
+    Measure operations on generated decks of increasing size.
+
+    :param sizes: deck sizes in concepts (defaults to DEFAULT_SIZES)
+    :param operations: names from OPERATIONS to run (defaults to all)
+    :param budgets: dict of name -> MemoryBudget (defaults to DEFAULT_BUDGETS)
+    :param topics: topics the concepts of each deck are spread over
+    :return: list of MemoryResult
+    """
+    budgets = budgets or DEFAULT_BUDGETS
+    names = operations or list(OPERATIONS)
+    results = []
+    workdir = tempfile.mkdtemp(prefix="learning-app-memory-")
+    try:
+        for size in sizes or DEFAULT_SIZES:
+            db_file = os.path.join(workdir, f"deck-{size}.db")
+            # Every concept reviewed, so scheduling passes cover the whole deck
+            generate_database(db_file, topics=topics, concepts_per_topic=max(size // topics, 1),
+                              reviews_per_concept=2, new_fraction=0)
+            conn = create_connection(db_file)
+            try:
+                concepts = conn.execute("SELECT COUNT(*) FROM concepts").fetchone()[0]
+                for name in names:
+                    peak, retained = measure(OPERATIONS[name], conn)
+                    budget = budgets.get(name)
+                    results.append(MemoryResult(name, concepts, peak, retained,
+                                                budget.peak_base + budget.peak_per_concept * concepts if budget else None,
+                                                budget.retained if budget else None))
+            finally:
+                conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def over_budget(result):
+    return ((result.peak_budget is not None and result.peak > result.peak_budget) or
+            (result.retained_budget is not None and result.retained > result.retained_budget))
+
+
+def format_memory_report(results):
+    lines = []
+    for result in results:
+        status = "OVER" if over_budget(result) else "ok"
+        budget = f"{result.peak_budget / 1024:.0f}" if result.peak_budget is not None else "-"
+        lines.append(f"[{status:4}] {result.operation:20} {result.concepts:7} concepts  "
+                     f"peak {result.peak / 1024:8.1f} KB (budget {budget} KB)  retained {result.retained / 1024:6.1f} KB")
+    failed = sum(1 for result in results if over_budget(result))
+    lines.append(f"{len(results)} measurements, {failed} over budget")
+    return "\n".join(lines)
+
+
+def check_memory_budgets(results):
+    """
+    Raise MemoryBudgetError with the report if any measurement is over budget.
+
+    :return: the report
+    """
+    report = format_memory_report(results)
+    if any(over_budget(result) for result in results):
+        raise MemoryBudgetError(report)
+    return report
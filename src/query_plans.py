@@ -0,0 +1,141 @@
+import importlib
+import re
+from collections import namedtuple
+
+# Hot statements, registered by the modules that run them (see hot_query)
+HOT_QUERIES = {}
+# Modules whose import registers hot statements
+HOT_QUERY_MODULES = ["database", "knowledge_base", "review", "concept_bodies"]
+
+HotQuery = namedtuple("HotQuery", ["name", "sql", "allow_scans", "allow_temp_sort"])
+PlanStep = namedtuple("PlanStep", ["kind", "table", "detail"])
+PlanCheck = namedtuple("PlanCheck", ["query", "steps", "problems"])
+
+
+class QueryPlanError(AssertionError):
+    """
+    A registered hot query no longer runs with the plan it was registered for.
+    """
+
+
+def hot_query(name, sql, allow_scans=(), allow_temp_sort=False):
+    """
+    Register a statement whose plan check_query_plans should guard.
+
+    :param name: unique name shown in reports
+    :param sql: the statement, exactly as executed
+    :param allow_scans: tables or aliases the statement is meant to scan,
+                        e.g. the driving table of a full pass
+    :param allow_temp_sort: whether a temporary B-tree for ORDER BY, GROUP BY
+                            or DISTINCT is expected
+    :return: sql, so modules can define their statement constants with it
+    """
+    HOT_QUERIES[name] = HotQuery(name, sql, frozenset(allow_scans), allow_temp_sort)
+    return sql
+
+
+_SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)')
+# A SEARCH constrains a key, "(concept_id=?)"; without one it is a min/max
+# walk of an index that reads until it meets a matching row
+_SEARCH = re.compile(r'^SEARCH (?:TABLE )?(\S+) .*\(.+\)')
+_UNCONSTRAINED_SEARCH = re.compile(r'^SEARCH (?:TABLE )?(\S+)')
+
+
+def classify(detail):
+    """
+    Classify one EXPLAIN QUERY PLAN step.
+
+    :return: PlanStep with kind "seek" (SEARCH on a key of an index or rowid),
+             "scan" (full table or index scan, including unconstrained index
+             walks for MIN/MAX), "temp sort" (temporary
+             B-tree) or "other" (subquery and compound markers)
+    """
+    if "USE TEMP B-TREE" in detail:
+        return PlanStep("temp sort", None, detail)
+    match = _SEARCH.match(detail)
+    if match:
+        return PlanStep("seek", match.group(1), detail)
+    match = _SCAN.match(detail) or _UNCONSTRAINED_SEARCH.match(detail)
+    if match:
+        return PlanStep("scan", match.group(1), detail)
+    return PlanStep("other", None, detail)
+
+
+def explain(conn, sql):
+    """
+    The classified EXPLAIN QUERY PLAN of a statement, with NULL for every parameter.
+    """
+    cur = conn.cursor()
+    # sqlite3 caches prepared statements by text, and a cached EXPLAIN keeps
+    # the plan it was prepared with; tag it with the schema version so index
+    # changes are seen
+    schema_version = cur.execute("PRAGMA schema_version").fetchone()[0]
+    # EXPLAIN does not check the schema cookie either; a real read reloads a
+    # schema changed by another connection
+    cur.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+    cur.execute(f"EXPLAIN QUERY PLAN {sql} -- schema {schema_version}", (None,) * sql.count("?"))
+    return [classify(row[3]) for row in cur.fetchall()]
+
+
+def load_hot_queries():
+    """
+    Import the modules that register hot queries and return the registry.
+    """
+    for module in HOT_QUERY_MODULES:
+        importlib.import_module(module)
+    return HOT_QUERIES
+
+
+def check_query_plans(conn, names=None):
+    """
+    Explain every registered hot query against a database's current schema.
+
+    :param conn: Connection to a database with the full schema
+    :param names: restrict to these queries
+    :return: list of PlanCheck; problems lists unexpected scans and sorts
+    """
+    checks = []
+    for name, query in sorted(load_hot_queries().items()):
+        if names is not None and name not in names:
+            continue
+        steps = explain(conn, query.sql)
+        problems = []
+        for step in steps:
+            if step.kind == "scan" and step.table not in query.allow_scans:
+                problems.append(f"full scan of {step.table}: {step.detail}")
+            elif step.kind == "temp sort" and not query.allow_temp_sort:
+                problems.append(f"temporary sort: {step.detail}")
+        checks.append(PlanCheck(query, steps, problems))
+    return checks
+
+
+def format_plan_report(checks):
+    """
+    Readable report of check_query_plans results.
+    """
+    lines = []
+    for check in checks:
+        status = "FAIL" if check.problems else "ok"
+        kinds = ", ".join(sorted({step.kind for step in check.steps if step.kind != "other"})) or "-"
+        lines.append(f"[{status:4}] {check.query.name} ({kinds})")
+        for step in check.steps:
+            lines.append(f"         {step.kind:9} {step.detail}")
+        for problem in check.problems:
+            lines.append(f"       ! {problem}")
+    failed = sum(1 for check in checks if check.problems)
+    lines.append(f"{len(checks)} hot queries checked, {failed} with unexpected plans")
+    return "\n".join(lines)
+
+
+def assert_query_plans(conn):
+    """
+    Check the hot queries and raise QueryPlanError with the report if any
+    of them scans or sorts where it should not.
+
+    :return: the report
+    """
+    checks = check_query_plans(conn)
+    report = format_plan_report(checks)
+    if any(check.problems for check in checks):
+        raise QueryPlanError(report)
+    return report
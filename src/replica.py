@@ -0,0 +1,195 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+# Databases larger than this are not copied into memory
+DEFAULT_MAX_REPLICA_BYTES = 512 * 1024 * 1024
+
+# Statements that change the database and must reach the disk copy too.
+# PRAGMAs and VACUUM/ANALYZE only affect the connection they run on.
+_WRITE_STATEMENT = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+_WITH_WRITE = re.compile(r'^\s*WITH\b.*\b(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE | re.DOTALL)
+
+
+def is_write(sql):
+    return bool(_WRITE_STATEMENT.match(sql) or _WITH_WRITE.match(sql))
+
+
+class ReplicaCursor:
+    """
+    Cursor on the in-memory replica that records the writes it executes.
+    """
+
+    def __init__(self, replica, cursor):
+        self._replica = replica
+        self._cursor = cursor
+
+    def execute(self, sql, parameters=()):
+        self._cursor.execute(sql, parameters)
+        if is_write(sql):
+            self._replica.pending.append((sql, parameters, False))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        # Materialize generators so the same rows can be replayed on disk
+        seq_of_parameters = list(seq_of_parameters)
+        self._cursor.executemany(sql, seq_of_parameters)
+        if is_write(sql):
+            self._replica.pending.append((sql, seq_of_parameters, True))
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        # fetchone, fetchall, lastrowid, rowcount, description, close, ...
+        return getattr(self._cursor, name)
+
+
+class ReplicatedConnection:
+    """
+    Connection-like wrapper serving every read from an in-memory copy of a
+    database, with writes applied to the copy and then to the file.
+
+    The copy is loaded with the backup API at startup. Writes executed on the
+    copy are recorded and replayed on the file in one transaction per
+    commit(), either right away or on a writer thread (async_writes). The
+    copy assigns row ids, and the file receives the same statements in the
+    same order, so both stay identical as long as nothing else writes the
+    file while the replica is open.
+    """
+
+    def __init__(self, db_file, async_writes=True):
+        self.db_file = db_file
+        self.async_writes = async_writes
+        self.pending = []
+        self.disk_error = None
+
+        disk = sqlite3.connect(db_file)
+        self.memory = sqlite3.connect(":memory:")
+        try:
+            disk.backup(self.memory)
+        finally:
+            disk.close()
+
+        self.writes = queue.Queue()
+        self.writer = None
+        if async_writes:
+            self.writer = threading.Thread(target=self._write_loop, name="replica-writer", daemon=True)
+            self.writer.start()
+        else:
+            self.disk = sqlite3.connect(db_file)
+
+    # --- sqlite3.Connection interface used by the app ---
+
+    def cursor(self):
+        return ReplicaCursor(self, self.memory.cursor())
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        self.memory.commit()
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        if self.async_writes:
+            self.writes.put(batch)
+        else:
+            self._write_batch(self.disk, batch)
+
+    def rollback(self):
+        self.memory.rollback()
+        self.pending = []
+
+    def close(self):
+        """
+        Write outstanding transactions to disk, then close both copies.
+        """
+        self.commit()
+        if self.async_writes:
+            self.writes.put(None)
+            self.writer.join()
+        else:
+            self.disk.close()
+        self.memory.close()
+
+    def __getattr__(self, name):
+        return getattr(self.memory, name)
+
+    # --- Disk writes ---
+
+    def _write_batch(self, disk, batch):
+        try:
+            for sql, parameters, many in batch:
+                if many:
+                    disk.executemany(sql, parameters)
+                else:
+                    disk.execute(sql, parameters)
+            disk.commit()
+        except sqlite3.Error as e:
+            disk.rollback()
+            # The file no longer mirrors the replica; keep serving reads from
+            # memory and report the problem instead of failing the UI
+            self.disk_error = e
+            print(f"Replica write-through to {self.db_file} failed: {e}")
+
+    def _write_loop(self):
+        disk = sqlite3.connect(self.db_file)
+        try:
+            while True:
+                batch = self.writes.get()
+                try:
+                    if batch is None:
+                        break
+                    self._write_batch(disk, batch)
+                finally:
+                    self.writes.task_done()
+        finally:
+            disk.close()
+
+    def flush(self):
+        """
+        Wait until every committed transaction has reached the file.
+        """
+        if self.async_writes:
+            self.writes.join()
+
+    # --- Reporting ---
+
+    def memory_bytes(self):
+        """
+        Size of the in-memory copy in bytes.
+        """
+        page_count = self.memory.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self.memory.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+
+def _physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def open_replicated(db_file, max_bytes=DEFAULT_MAX_REPLICA_BYTES, async_writes=True):
+    """
+    Open a database through an in-memory replica, or directly if it is too
+    large to copy: over max_bytes or over a quarter of physical memory.
+
+    :return: (connection, description of the mode for logging)
+    """
+    size = sum(os.path.getsize(path) for path in (db_file, db_file + "-wal") if os.path.exists(path))
+    physical = _physical_memory()
+    limit = min(max_bytes, physical // 4) if physical else max_bytes
+    if size > limit:
+        return sqlite3.connect(db_file), f"disk reads ({size // 2 ** 20} MB exceeds the {limit // 2 ** 20} MB replica limit)"
+
+    conn = ReplicatedConnection(db_file, async_writes=async_writes)
+    return conn, f"in-memory replica ({conn.memory_bytes() / 2 ** 20:.1f} MB of RAM)"
@@ -0,0 +1,190 @@
+import datetime
+import sqlite3
+import clock
+from fsrs import FSRS, default_params
+from knowledge_base import get_technique_id_by_name, update_concept_learning_progress
+from query_plans import hot_query
+
+# Grade assumed for stored sessions without a usable grade
+DEFAULT_GRADE = 3
+
+# Rebuilt states written per executemany by replay_reviews
+REPLAY_BATCH_SIZE = 1000
+
+def as_fsrs_grade(ai_grade):
+    """
+    Coerce a stored ai_grade into an FSRS grade between 1 and 4.
+    """
+    if ai_grade is None:
+        return DEFAULT_GRADE
+    return min(max(int(round(ai_grade)), 1), 4)
+
+def next_state(fsrs, previous, grade, timestamp):
+    """
+    The FSRS state of a concept after a review.
+
+    :param fsrs: FSRS instance
+    :param previous: (difficulty, stability, last_review) before the review,
+                     or None for a new concept (last_review may be None)
+    :param grade: FSRS grade between 1 and 4
+    :param timestamp: datetime of the review
+    :return: (difficulty, stability)
+    """
+    if previous is None:
+        # Initialize FSRS data for a new concept
+        return fsrs.initial_difficulty(grade), fsrs.initial_stability(grade)
+
+    difficulty, stability, last_review_date = previous
+    if last_review_date:
+        days_since_review = (timestamp - last_review_date).days
+        retrievability = fsrs.retrievability(days_since_review, stability)
+    else:
+        # This is the first review after being a new card
+        retrievability = 1.0
+
+    new_difficulty = fsrs.new_difficulty(difficulty, grade)
+    new_stability = fsrs.new_stability(new_difficulty, stability, retrievability, grade)
+    return new_difficulty, new_stability
+
+_STATE_SQL = hot_query("schedule_review.state",
+                       "SELECT difficulty, stability FROM learning_data WHERE concept_id = ?")
+_LAST_REVIEW_SQL = hot_query("schedule_review.last_review",
+                             "SELECT MAX(timestamp) FROM recall_sessions WHERE concept_id = ?")
+
+def schedule_review(conn, concept_id, grade, timestamp, fsrs=None, previous=None):
+    """
+    Compute the FSRS state of a concept after a review, without writing it.
+
+    :param conn: the Connection object
+    :param concept_id:
+    :param grade: FSRS grade between 1 and 4
+    :param timestamp: datetime of the review
+    :param fsrs: FSRS instance (defaults to default_params)
+    :param previous: (difficulty, stability, last_review) to use instead of
+                     the stored state, e.g. for reviews not yet written
+    :return: (difficulty, stability, is_new)
+    """
+    fsrs = fsrs or FSRS(default_params)
+
+    if not previous:
+        cur = conn.cursor()
+        cur.execute(_STATE_SQL, (concept_id,))
+        result = cur.fetchone()
+
+        if not result:
+            return (*next_state(fsrs, None, grade, timestamp), True)
+
+        # We need the last review date to calculate retrievability
+        cur.execute(_LAST_REVIEW_SQL, (concept_id,))
+        last_review_str = cur.fetchone()[0]
+        last_review_date = datetime.datetime.fromisoformat(last_review_str) if last_review_str else None
+        previous = (*result, last_review_date)
+
+    return (*next_state(fsrs, previous, grade, timestamp), False)
+
+def record_review(conn, concept_id, user_response, grade, technique=None, timestamp=None, commit=True):
+    """
+    Record a graded review: the recall session, the FSRS update and the
+    technique progress, written in a single transaction.
+
+    :param conn: the Connection object
+    :param concept_id:
+    :param user_response: the learner's free recall response
+    :param grade: FSRS grade between 1 and 4
+    :param technique: name of the technique the review was allocated
+    :param timestamp: datetime of the review (defaults to clock.now())
+    :param commit: commit the transaction (False lets callers batch reviews)
+    :return: (difficulty, stability, is_new) or None on error
+    """
+    timestamp = timestamp or clock.now()
+    try:
+        difficulty, stability, is_new = schedule_review(conn, concept_id, grade, timestamp)
+
+        cur = conn.cursor()
+        cur.execute(''' INSERT INTO recall_sessions(concept_id, timestamp, user_response, ai_grade)
+                        VALUES(?,?,?,?) ''', (concept_id, timestamp.isoformat(), user_response, grade))
+        if is_new:
+            cur.execute(''' INSERT INTO learning_data(concept_id, difficulty, stability)
+                            VALUES(?,?,?) ''', (concept_id, difficulty, stability))
+        else:
+            cur.execute(''' UPDATE learning_data
+                            SET difficulty = ?,
+                                stability = ?
+                            WHERE concept_id = ?''', (difficulty, stability, concept_id))
+
+        if technique:
+            technique_id = get_technique_id_by_name(conn, technique)
+            if technique_id:
+                update_concept_learning_progress(conn, concept_id, technique_id, timestamp=timestamp, commit=False)
+
+        if commit:
+            conn.commit()
+        return difficulty, stability, is_new
+    except sqlite3.Error as e:
+        print(e)
+        if commit:
+            conn.rollback()
+        return None
+
+def replay_reviews(conn, concept_ids=None, commit=True):
+    """
+    Rebuild the FSRS state in learning_data by replaying the review log.
+
+    Needed when recall_sessions changes behind the scheduler's back, e.g.
+    after regrading or merging reviews from another device.
+
+    :param conn: the Connection object
+    :param concept_ids: concepts to rebuild (defaults to every reviewed concept)
+    :param commit: commit the transaction
+    :return: number of rebuilt concepts, or None on error
+    """
+    fsrs = FSRS(default_params)
+    sql = "SELECT concept_id, timestamp, ai_grade FROM recall_sessions"
+    params = []
+    if concept_ids is not None:
+        concept_ids = list(concept_ids)
+        if not concept_ids:
+            return 0
+        sql += f" WHERE concept_id IN ({','.join('?' * len(concept_ids))})"
+        params = concept_ids
+
+    try:
+        # Sessions arrive grouped by concept, so only one concept's replay and
+        # at most REPLAY_BATCH_SIZE finished states are held at a time
+        cur = conn.cursor()
+        write_cur = conn.cursor()
+        cur.execute(sql + " ORDER BY concept_id, timestamp, id", params)
+        states = []
+        rebuilt = 0
+
+        def write_states(states):
+            write_cur.executemany('''INSERT INTO learning_data(concept_id, difficulty, stability)
+                                     VALUES(?,?,?)
+                                     ON CONFLICT(concept_id) DO UPDATE SET difficulty = excluded.difficulty,
+                                                                           stability = excluded.stability''', states)
+
+        current_id = previous = None
+        for concept_id, timestamp_str, ai_grade in cur:
+            if concept_id != current_id:
+                if current_id is not None:
+                    states.append((current_id, previous[0], previous[1]))
+                    if len(states) >= REPLAY_BATCH_SIZE:
+                        write_states(states)
+                        rebuilt += len(states)
+                        states = []
+                current_id, previous = concept_id, None
+            timestamp = datetime.datetime.fromisoformat(timestamp_str)
+            previous = (*next_state(fsrs, previous, as_fsrs_grade(ai_grade), timestamp), timestamp)
+        if current_id is not None:
+            states.append((current_id, previous[0], previous[1]))
+
+        write_states(states)
+        rebuilt += len(states)
+        if commit:
+            conn.commit()
+        return rebuilt
+    except sqlite3.Error as e:
+        print(e)
+        if commit:
+            conn.rollback()
+        return None
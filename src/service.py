@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from database import (create_connection, main as create_db, add_topic, add_concepts,
+                      get_next_concept_to_review, get_all_topics_with_mastery)
+from grading import grade_response
+from concept_bodies import ConceptBodyCache
+from knowledge_base import allocate_technique
+from review import record_review
+from shards import DeckManager, DECKS_DIR
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_DECK = "default"
+
+
+class ReviewService:
+    """
+    Headless asyncio service exposing the review loop over newline-delimited
+    JSON on a local socket.
+
+    Each request is one JSON object {"id": ..., "op": ..., "deck": ..., ...}
+    and gets one response {"id": ..., "ok": true, "result": ...} or
+    {"id": ..., "ok": false, "error": ...}. Requests on a connection may be
+    pipelined; responses carry the request id and can arrive out of order.
+
+    Blocking SQLite work runs on a bounded thread pool, with one connection
+    per worker thread and deck. Concurrent submit_review requests for a deck
+    are collected for batch_window seconds and written in one transaction.
+    """
+
+    def __init__(self, decks_dir=DECKS_DIR, max_workers=8, batch_window=0.005, max_batch=256):
+        self.decks = DeckManager(decks_dir)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="service-db")
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.local = threading.local()
+        self.bootstrapped = set()
+        self.bootstrap_lock = threading.Lock()
+        self.pending_reviews = defaultdict(list)
+        self.flush_tasks = {}
+        self.handlers = {
+            "next_card": self.next_card,
+            "submit_review": self.submit_review,
+            "mastery": self.mastery,
+            "import": self.import_concepts,
+        }
+
+    # --- Database access (worker threads) ---
+
+    def connection(self, deck):
+        """
+        The calling worker thread's connection to a deck.
+        """
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        if deck not in connections:
+            path = self.decks.deck_path(deck)
+            with self.bootstrap_lock:
+                if deck not in self.bootstrapped:
+                    create_db(path)
+                    self.bootstrapped.add(deck)
+            conn = create_connection(path)
+            # WAL lets readers on other workers proceed while a batch is written
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            connections[deck] = conn
+        return connections[deck]
+
+    def concept_bodies(self, deck):
+        """
+        The calling worker thread's cache of full concept texts for a deck.
+        """
+        caches = getattr(self.local, "concept_bodies", None)
+        if caches is None:
+            caches = self.local.concept_bodies = {}
+        if deck not in caches:
+            caches[deck] = ConceptBodyCache(self.connection(deck))
+        return caches[deck]
+
+    def _next_card(self, deck, exclude):
+        conn = self.connection(deck)
+        concept = get_next_concept_to_review(conn, exclude=exclude)
+        if concept is None:
+            return None
+        concept_id, topic_id, _ = concept
+        content = self.concept_bodies(deck).get(concept_id)
+        return {"concept_id": concept_id, "topic_id": topic_id, "content": content,
+                "technique": allocate_technique(conn, concept_id)}
+
+    def _grade_review(self, deck, review):
+        """
+        Check a submitted review and grade its response unless the client
+        sent a grade.
+
+        :return: FSRS grade between 1 and 4
+        :raises ValueError: for an unknown concept, a response that is not a
+                            string or a grade that is not an integer from 1 to 4
+        """
+        concept_id, grade = review["concept_id"], review["grade"]
+        if not isinstance(concept_id, int) or isinstance(concept_id, bool):
+            raise ValueError(f"Invalid concept id {concept_id!r}")
+        if not isinstance(review["response"], str):
+            raise ValueError("The response must be a string")
+        if review["technique"] is not None and not isinstance(review["technique"], str):
+            raise ValueError(f"Invalid technique {review['technique']!r}")
+        content = self.concept_bodies(deck).get(concept_id)
+        if content is None:
+            raise ValueError(f"Unknown concept {concept_id}")
+        if grade is None:
+            return grade_response(review["response"], content)
+        if not isinstance(grade, int) or isinstance(grade, bool) or not 1 <= grade <= 4:
+            raise ValueError(f"Invalid grade {grade!r}; expected an integer from 1 to 4")
+        return grade
+
+    def _write_reviews(self, deck, reviews):
+        """
+        Grade and record a batch of reviews in one transaction.
+
+        Each review is written under its own savepoint, so a review that
+        fails is rolled back and reported on its own while the rest of the
+        batch is committed.
+
+        :return: one result dict or exception per review
+        """
+        conn = self.connection(deck)
+        results = []
+        try:
+            if not conn.in_transaction:
+                # Otherwise the first savepoint would start, and its release
+                # commit, a transaction of its own
+                conn.execute("BEGIN")
+            for review in reviews:
+                try:
+                    grade = self._grade_review(deck, review)
+                    conn.execute("SAVEPOINT review")
+                    try:
+                        result = record_review(conn, review["concept_id"], review["response"], grade,
+                                               technique=review["technique"], commit=False)
+                        if result is None:
+                            raise RuntimeError(f"Failed to record the review of concept {review['concept_id']}")
+                    except Exception:
+                        conn.execute("ROLLBACK TO review")
+                        raise
+                    finally:
+                        conn.execute("RELEASE review")
+                except Exception as e:
+                    results.append(e)
+                    continue
+                difficulty, stability, is_new = result
+                results.append({"concept_id": review["concept_id"], "grade": grade,
+                                "difficulty": difficulty, "stability": stability, "is_new": is_new})
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return results
+
+    def _mastery(self, deck):
+        return [{"topic_id": topic_id, "name": name, "mastery": mastery}
+                for topic_id, name, mastery in get_all_topics_with_mastery(self.connection(deck))]
+
+    def _import(self, deck, topic, concepts):
+        conn = self.connection(deck)
+        row = conn.execute("SELECT id FROM topics WHERE name = ?", (topic,)).fetchone()
+        topic_id = row[0] if row else add_topic(conn, topic)
+        concept_ids = add_concepts(conn, topic_id, concepts)
+        if topic_id is None or concept_ids is None:
+            raise RuntimeError("Failed to import concepts")
+        return {"topic_id": topic_id, "concept_ids": concept_ids}
+
+    def _close_connections(self):
+        for conn in getattr(self.local, "connections", {}).values():
+            conn.close()
+        self.local.connections = {}
+        self.local.concept_bodies = {}
+
+    # --- Request handlers (event loop) ---
+
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def next_card(self, request):
+        return await self.run_blocking(self._next_card, request.get("deck", DEFAULT_DECK),
+                                       request.get("exclude", []))
+
+    async def submit_review(self, request):
+        deck = request.get("deck", DEFAULT_DECK)
+        review = {key: request.get(key) for key in ("concept_id", "response", "grade", "technique")}
+        future = asyncio.get_running_loop().create_future()
+        self.pending_reviews[deck].append((review, future))
+
+        if len(self.pending_reviews[deck]) >= self.max_batch:
+            await self.flush_reviews(deck)
+        elif deck not in self.flush_tasks:
+            self.flush_tasks[deck] = asyncio.create_task(self._flush_later(deck))
+        return await future
+
+    async def _flush_later(self, deck):
+        await asyncio.sleep(self.batch_window)
+        await self.flush_reviews(deck)
+
+    async def flush_reviews(self, deck):
+        """
+        Write every pending review of a deck in one transaction.
+        """
+        task = self.flush_tasks.pop(deck, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        batch = self.pending_reviews.pop(deck, [])
+        if not batch:
+            return
+
+        try:
+            results = await self.run_blocking(self._write_reviews, deck, [review for review, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def mastery(self, request):
+        return await self.run_blocking(self._mastery, request.get("deck", DEFAULT_DECK))
+
+    async def import_concepts(self, request):
+        return await self.run_blocking(self._import, request.get("deck", DEFAULT_DECK),
+                                       request["topic"], request["concepts"])
+
+    async def dispatch(self, request):
+        handler = self.handlers.get(request.get("op"))
+        if handler is None:
+            raise ValueError(f"Unknown operation: {request.get('op')!r}")
+        return await handler(request)
+
+    async def handle_request(self, line, writer, write_lock):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            response = {"id": request_id, "ok": True, "result": await self.dispatch(request)}
+        except Exception as e:
+            response = {"id": request_id, "ok": False, "error": str(e)}
+        async with write_lock:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self.handle_request(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Start listening; returns the asyncio Server.
+        """
+        return await asyncio.start_server(self.handle_client, host, port, limit=2 ** 20)
+
+    async def close(self):
+        for deck in list(self.pending_reviews):
+            await self.flush_reviews(deck)
+        # Close each worker thread's connections on that thread; the barrier
+        # keeps one task per thread
+        workers = self.max_workers
+        barrier = threading.Barrier(workers)
+
+        def close_on_worker():
+            self._close_connections()
+            barrier.wait(timeout=5)
+
+        await asyncio.gather(*(self.run_blocking(close_on_worker) for _ in range(workers)),
+                             return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+
+class ReviewClient:
+    """
+    Minimal asyncio client for ReviewService.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {}
+        self.receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        reader, writer = await asyncio.open_connection(host, port, limit=2 ** 20)
+        return cls(reader, writer)
+
+    async def _receive(self):
+        while line := await self.reader.readline():
+            response = json.loads(line)
+            future = self.waiting.pop(response["id"])
+            if response["ok"]:
+                future.set_result(response["result"])
+            else:
+                future.set_exception(RuntimeError(response["error"]))
+
+    async def call(self, op, **params):
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        self.writer.write(json.dumps({"id": self.next_id, "op": op, **params}).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+
+async def serve(host, port, decks_dir, max_workers):
+    service = ReviewService(decks_dir, max_workers=max_workers)
+    server = await service.start(host, port)
+    print(f"Serving on {host}:{port} (decks in {decks_dir})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless review service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--decks-dir", default=DECKS_DIR)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.decks_dir, args.workers))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,171 @@
+import glob
+import heapq
+import os
+import re
+import sqlite3
+import clock
+from database import create_connection, main as create_db
+from fsrs import retrievability_sql
+
+DECKS_DIR = "data/decks"
+
+_DECK_NAME = re.compile(r'^[\w-]+$')
+
+
+class DeckManager:
+    """
+    One SQLite database per learner or subject ("deck") below a directory.
+
+    Decks are opened on demand, each with its own connection, so writes to
+    one deck never contend with another. Cross-deck views attach the deck
+    files to a separate connection instead of copying them into one file.
+    """
+
+    def __init__(self, decks_dir=DECKS_DIR, attach_batch_size=None):
+        """
+        :param decks_dir: directory holding the deck databases
+        :param attach_batch_size: decks attached at once by cross-deck views
+                                  (defaults to SQLite's attach limit)
+        """
+        self.decks_dir = decks_dir
+        self.attach_batch_size = attach_batch_size
+        self.connections = {}
+
+    def deck_path(self, name):
+        if not _DECK_NAME.match(name):
+            raise ValueError(f"Invalid deck name: {name!r}")
+        return os.path.join(self.decks_dir, f"{name}.db")
+
+    def list_decks(self):
+        """
+        Names of the existing decks, sorted.
+        """
+        paths = glob.glob(os.path.join(self.decks_dir, "*.db"))
+        return sorted(os.path.splitext(os.path.basename(path))[0] for path in paths)
+
+    def open_deck(self, name):
+        """
+        Get the connection of a deck, creating the deck database if needed.
+        """
+        if name not in self.connections:
+            path = self.deck_path(name)
+            # Bootstraps new decks and upgrades the schema of existing ones
+            create_db(path)
+            conn = create_connection(path)
+            if conn is None:
+                raise sqlite3.OperationalError(f"Could not open deck {name!r} at {path}")
+            self.connections[name] = conn
+        return self.connections[name]
+
+    def close_deck(self, name):
+        conn = self.connections.pop(name, None)
+        if conn:
+            conn.close()
+
+    def close_all(self):
+        for name in list(self.connections):
+            self.close_deck(name)
+
+    def attached(self, names=None):
+        """
+        Iterate over a read-only hub connection with decks attached.
+
+        SQLite limits how many databases one connection can attach, so decks
+        are attached in batches; each iteration yields (hub, [(schema, deck)])
+        for one batch.
+        """
+        names = self.list_decks() if names is None else names
+        hub = sqlite3.connect("file::memory:", uri=True)
+        try:
+            batch_size = self.attach_batch_size or hub.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+            for start in range(0, len(names), batch_size):
+                batch = [(f"deck_{i}", name) for i, name in enumerate(names[start:start + batch_size])]
+                for schema, name in batch:
+                    path = os.path.abspath(self.deck_path(name))
+                    hub.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{path}?mode=ro",))
+                try:
+                    yield hub, batch
+                finally:
+                    for schema, _ in batch:
+                        hub.execute(f"DETACH DATABASE {schema}")
+        finally:
+            hub.close()
+
+
+def _retrievability_sql(schema):
+    return retrievability_sql(
+        f"""CAST(julianday(?) - julianday(
+               (SELECT MAX(rs.timestamp) FROM {schema}.recall_sessions rs WHERE rs.concept_id = c.id)
+           ) AS INTEGER)""",
+        "ld.stability")
+
+
+def global_next_reviews(manager, limit=10, names=None):
+    """
+    The next concepts to review across decks.
+
+    As in get_next_concept_to_review, new concepts come first, then the
+    concepts with the lowest retrievability.
+
+    :param manager: DeckManager
+    :param limit: number of concepts to return
+    :param names: decks to include (defaults to every deck)
+    :return: list of (deck, concept_id, topic_id, content, retrievability);
+             retrievability is None for new concepts
+    """
+    now = clock.now().isoformat()
+    candidates = []
+    for hub, batch in manager.attached(names):
+        selects = []
+        params = []
+        for schema, name in batch:
+            selects.append(f"""
+                SELECT ? AS deck, c.id, c.topic_id, c.content,
+                       ld.concept_id IS NULL AS is_new, {_retrievability_sql(schema)} AS r
+                FROM {schema}.concepts c
+                LEFT JOIN {schema}.learning_data ld ON ld.concept_id = c.id
+            """)
+            params.extend([name, now])
+        cur = hub.execute(f"""
+            SELECT deck, id, topic_id, content, is_new, r
+            FROM ({" UNION ALL ".join(selects)})
+            WHERE is_new OR r IS NOT NULL
+            ORDER BY is_new DESC, r, deck, id
+            LIMIT ?
+        """, (*params, limit))
+        candidates.extend(cur.fetchall())
+
+    # Merge the per-batch results with the same ordering
+    best = heapq.nsmallest(limit, candidates, key=lambda row: (not row[4], row[5] or 0, row[0], row[1]))
+    return [(deck, concept_id, topic_id, content, r) for deck, concept_id, topic_id, content, _, r in best]
+
+
+def global_mastery(manager, names=None):
+    """
+    Topic mastery across decks, computed with one merged query per batch of decks.
+
+    :param manager: DeckManager
+    :param names: decks to include (defaults to every deck)
+    :return: list of (deck, topic_id, topic_name, mastery, reviewed_count)
+    """
+    now = clock.now().isoformat()
+    rows = []
+    for hub, batch in manager.attached(names):
+        selects = []
+        params = []
+        for schema, name in batch:
+            selects.append(f"""
+                SELECT ? AS deck, t.id AS topic_id, t.name, {_retrievability_sql(schema)} AS r
+                FROM {schema}.topics t
+                LEFT JOIN {schema}.concepts c ON c.topic_id = t.id
+                LEFT JOIN {schema}.learning_data ld ON ld.concept_id = c.id
+            """)
+            params.extend([name, now])
+        cur = hub.execute(f"""
+            SELECT deck, topic_id, name, COALESCE(AVG(r), 0.0), COUNT(r)
+            FROM ({" UNION ALL ".join(selects)})
+            GROUP BY deck, topic_id
+            ORDER BY deck, name
+        """, params)
+        rows.extend(cur.fetchall())
+    return rows
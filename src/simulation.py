@@ -0,0 +1,155 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fsrs import FSRS, default_params
+from forecast import vector_new_difficulty, vector_new_stability, DEFAULT_REQUEST_RETENTION
+from knowledge_base import choose_technique
+
+# FSRS grades given by virtual learners
+GRADE_AGAIN = 1
+GRADE_GOOD = 3
+
+
+def get_deck_size(conn):
+    """
+    Number of concepts in the deck behind a connection.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM concepts")
+    return cur.fetchone()[0]
+
+
+def _simulate_chunk(args):
+    """
+    Simulate a block of learners with numpy arrays of shape (learners, concepts).
+
+    Every learner introduces new_per_day new concepts a day and reviews each
+    concept once FSRS predicts its retrievability has dropped to
+    request_retention. Whether a review succeeds is drawn from the learner's
+    true memory, which is the scheduled stability scaled by a per-learner
+    ability factor. Failed recalls are graded 'Again', successful ones 'Good'.
+    """
+    n_learners, deck_size, days, new_per_day, request_retention, ability_sd, w, seed = args
+    rng = np.random.default_rng(seed)
+    fsrs = FSRS(w)
+
+    ability = rng.lognormal(0.0, ability_sd, n_learners)[:, None]
+    difficulty = np.zeros((n_learners, deck_size))
+    stability = np.ones((n_learners, deck_size))
+    last_review = np.zeros((n_learners, deck_size))
+    failures = np.zeros((n_learners, deck_size), dtype=np.int64)
+
+    daily_reviews = np.zeros(days, dtype=np.int64)
+    successes = 0
+    techniques = {}
+    seen = 0
+
+    for day in range(days):
+        if seen:
+            due = fsrs.retrievability(day - last_review[:, :seen], stability[:, :seen]) <= request_retention
+            li, ci = np.nonzero(due)
+            if li.size:
+                s = stability[li, ci]
+                elapsed = day - last_review[li, ci]
+
+                # Allocate a technique from each concept's failure history
+                counts = np.unique(failures[li, ci], return_counts=True)
+                for failure_count, n in zip(*counts):
+                    name = choose_technique(int(failure_count))
+                    techniques[name] = techniques.get(name, 0) + int(n)
+
+                recalled = rng.random(li.size) < fsrs.retrievability(elapsed, s * ability[li, 0])
+                grade = np.where(recalled, GRADE_GOOD, GRADE_AGAIN)
+
+                new_d = vector_new_difficulty(w, difficulty[li, ci], grade)
+                stability[li, ci] = vector_new_stability(w, new_d, s, fsrs.retrievability(elapsed, s), grade)
+                difficulty[li, ci] = new_d
+                last_review[li, ci] = day
+                failures[li, ci] += ~recalled
+
+                daily_reviews[day] += li.size
+                successes += int(recalled.sum())
+
+        # First exposure to new concepts initializes them as 'Good'
+        introduced = min(deck_size, seen + new_per_day)
+        if introduced > seen:
+            difficulty[:, seen:introduced] = fsrs.initial_difficulty(GRADE_GOOD)
+            stability[:, seen:introduced] = fsrs.initial_stability(GRADE_GOOD)
+            last_review[:, seen:introduced] = day
+            seen = introduced
+
+    final_r = fsrs.retrievability(days - last_review[:, :seen], stability[:, :seen] * ability)
+
+    return {
+        'daily_reviews': daily_reviews,
+        'successes': successes,
+        'retrievability_sum': float(final_r.sum()),
+        'concepts_seen': n_learners * seen,
+        'techniques': techniques,
+    }
+
+
+def simulate_learners(deck_size, n_learners=1000, days=365, new_per_day=10,
+                      request_retention=DEFAULT_REQUEST_RETENTION, ability_sd=0.3,
+                      workers=None, chunk_size=250, seed=0, params=None):
+    """
+    Simulate many virtual learners studying a deck with the FSRS scheduler.
+
+    Learners are split into chunks of chunk_size which run in parallel worker
+    processes. Each chunk gets its own seed, so results are reproducible for a
+    given seed and chunk_size regardless of the number of workers.
+
+    :param deck_size: number of concepts in the deck (see get_deck_size)
+    :param n_learners: number of virtual learners
+    :param days: number of simulated days
+    :param new_per_day: new concepts introduced per learner per day
+    :param request_retention: retrievability at which a concept is reviewed
+    :param ability_sd: spread of the learners' log-normal memory ability
+    :param workers: number of worker processes (None: one per CPU, 1: in-process)
+    :param chunk_size: learners simulated per task
+    :param seed: base random seed
+    :param params: FSRS parameters (defaults to default_params)
+    :return: dict of retention and workload metrics
+    """
+    w = list(params if params is not None else default_params)
+    workers = workers or os.cpu_count() or 1
+
+    tasks = []
+    for index, start in enumerate(range(0, n_learners, chunk_size)):
+        size = min(chunk_size, n_learners - start)
+        tasks.append((size, deck_size, days, new_per_day, request_retention, ability_sd, w, seed + index))
+
+    if workers == 1 or len(tasks) <= 1:
+        results = [_simulate_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_simulate_chunk, tasks))
+
+    daily_reviews = np.zeros(days, dtype=np.int64)
+    techniques = {}
+    successes = 0
+    retrievability_sum = 0.0
+    concepts_seen = 0
+    for result in results:
+        daily_reviews += result['daily_reviews']
+        successes += result['successes']
+        retrievability_sum += result['retrievability_sum']
+        concepts_seen += result['concepts_seen']
+        for name, count in result['techniques'].items():
+            techniques[name] = techniques.get(name, 0) + count
+
+    total_reviews = int(daily_reviews.sum())
+    per_learner = daily_reviews / max(n_learners, 1)
+
+    return {
+        'learners': n_learners,
+        'days': days,
+        'deck_size': deck_size,
+        'total_reviews': total_reviews,
+        'daily_reviews': per_learner.tolist(),
+        'mean_daily_reviews': float(per_learner.mean()) if days else 0.0,
+        'peak_daily_reviews': float(per_learner.max()) if days else 0.0,
+        'retention': successes / total_reviews if total_reviews else 0.0,
+        'mean_retrievability': retrievability_sum / concepts_seen if concepts_seen else 0.0,
+        'techniques': techniques,
+    }
@@ -0,0 +1,668 @@
+import gzip
+import json
+import re
+import sqlite3
+import uuid
+from collections import namedtuple
+from archive import with_archived_responses
+from review import replay_reviews
+from concept_bodies import decode_body, store_concept_body
+
+# 2: concepts are keyed by topic, content and the digest of their body
+SYNC_FORMAT = 2
+
+# A synced table: key and data are json_object() arguments over the row alias
+# {r} (NEW, OLD or the table itself), key_columns the columns the natural key
+# is built from, and changed the condition under which an update that keeps
+# the key is synced.
+_SyncedTable = namedtuple("_SyncedTable", ["key", "data", "key_columns", "changed"])
+
+# Row ids differ between devices, so concepts are identified by (topic name,
+# content, digest), sessions by their concept and timestamp and progress by
+# its concept and technique name. Long concepts only keep a preview in
+# content, so the digest of their full text tells apart those sharing a
+# preview; it is NULL for short concepts.
+_CONCEPT_KEY = """'topic', (SELECT t.name FROM concepts c JOIN topics t ON t.id = c.topic_id WHERE c.id = {r}.concept_id),
+                  'concept', (SELECT content FROM concepts WHERE id = {r}.concept_id),
+                  'digest', (SELECT digest FROM concept_bodies WHERE concept_id = {r}.concept_id)"""
+
+_SYNCED_TABLES = {
+    "concepts": _SyncedTable(
+        """'topic', (SELECT name FROM topics WHERE id = {r}.topic_id), 'concept', {r}.content,
+           'digest', (SELECT digest FROM concept_bodies WHERE concept_id = {r}.id)""",
+        None, ("topic_id", "content"), None),
+    # The full text of long concepts, hex-encoded since JSON cannot hold
+    # compressed blobs. The digest comes from the row itself, so an edited
+    # body is found by its old key.
+    "concept_bodies": _SyncedTable(
+        """'topic', (SELECT t.name FROM concepts c JOIN topics t ON t.id = c.topic_id WHERE c.id = {r}.concept_id),
+           'concept', (SELECT content FROM concepts WHERE id = {r}.concept_id), 'digest', {r}.digest""",
+        "'body', hex({r}.body), 'compressed', {r}.compressed", ("concept_id", "digest"),
+        "OLD.body IS NOT NEW.body OR OLD.compressed IS NOT NEW.compressed"),
+    # Archiving only clears user_response, which is not a change to sync
+    "recall_sessions": _SyncedTable(
+        _CONCEPT_KEY + ", 'timestamp', {r}.timestamp", "'user_response', {r}.user_response, 'ai_grade', {r}.ai_grade",
+        ("concept_id", "timestamp"),
+        "OLD.ai_grade IS NOT NEW.ai_grade OR (NEW.user_response IS NOT NULL AND NEW.user_response IS NOT OLD.user_response)"),
+    "learning_data": _SyncedTable(
+        _CONCEPT_KEY, "'difficulty', {r}.difficulty, 'stability', {r}.stability", ("concept_id",),
+        "OLD.difficulty IS NOT NEW.difficulty OR OLD.stability IS NOT NEW.stability"),
+    "concept_learning_progress": _SyncedTable(
+        _CONCEPT_KEY + ", 'technique', (SELECT name FROM learning_techniques WHERE id = {r}.technique_id)",
+        "'applications_count', {r}.applications_count, 'last_applied_timestamp', {r}.last_applied_timestamp",
+        ("concept_id", "technique_id"),
+        "OLD.applications_count IS NOT NEW.applications_count "
+        "OR OLD.last_applied_timestamp IS NOT NEW.last_applied_timestamp"),
+}
+
+# Tables are merged in this order so concepts exist before their sessions,
+# and learning_data comes after the sessions it may be replayed from
+_MERGE_ORDER = ["concepts", "concept_bodies", "recall_sessions", "learning_data", "concept_learning_progress"]
+
+# Payload fields that are not part of a natural key, dropped from the
+# payloads logged before keys were logged on their own
+_DATA_PATHS = ", ".join(f"'$.{field}'" for field in ["body", "compressed", "user_response", "ai_grade", "difficulty",
+                                                      "stability", "applications_count", "last_applied_timestamp"])
+
+
+def _key_sql(table, r):
+    return f"json_object({_SYNCED_TABLES[table].key.format(r=r)})"
+
+
+def _payload_sql(table, r):
+    synced = _SYNCED_TABLES[table]
+    if synced.data is None:
+        return _key_sql(table, r)
+    return f"json_object({synced.key.format(r=r)}, {synced.data.format(r=r)})"
+
+
+def _create_change_log(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            old_key TEXT,
+            origin TEXT
+        )
+    """)
+
+
+def _upgrade_change_log(c):
+    """
+    Convert a change log of full payloads into one of keys. Its entries are
+    only kept if a peer is waiting for them, and the sequence numbers peers
+    have synced up to carry over.
+    """
+    c.execute("ALTER TABLE change_log RENAME TO change_log_payloads")
+    _create_change_log(c)
+    c.execute(f"""
+        INSERT INTO change_log (seq, table_name, row_id, op, old_key, origin)
+        SELECT seq, table_name, row_id,
+               CASE WHEN old IS NULL THEN 'insert' WHEN new IS NULL THEN 'delete' ELSE 'update' END,
+               CASE WHEN new IS NULL OR json_remove(old, {_DATA_PATHS}) IS NOT json_remove(new, {_DATA_PATHS})
+                    THEN json_remove(old, {_DATA_PATHS}) END,
+               origin
+        FROM change_log_payloads
+        WHERE EXISTS (SELECT 1 FROM sync_peers)
+    """)
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log_payloads'")
+    row = c.fetchone()
+    c.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+    if row:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", row)
+    c.execute("DROP TABLE change_log_payloads")
+
+
+def create_sync_tables(conn):
+    """
+    Create the change log, its triggers and the sync bookkeeping tables.
+
+    Changes are only logged once a peer is registered, by the first export
+    to it or import from it; that first export carries every row instead.
+    """
+    try:
+        c = conn.cursor()
+
+        # Sync points: the last change sent to and received from each peer,
+        # and the last change of ours the peer has acknowledged merging
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS sync_peers (
+                peer_id TEXT PRIMARY KEY,
+                exported_seq INTEGER NOT NULL DEFAULT 0,
+                imported_seq INTEGER NOT NULL DEFAULT 0,
+                acked_seq INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = [row[1] for row in c.execute("PRAGMA table_info(sync_peers)")]
+        if "acked_seq" not in columns:
+            c.execute("ALTER TABLE sync_peers ADD COLUMN acked_seq INTEGER NOT NULL DEFAULT 0")
+
+        # Every write to a synced row since the first peer was registered.
+        # Payloads are read from the rows when they are exported; only the
+        # natural key a row had before a key change or delete is kept (NULL
+        # otherwise). origin is the device a merged change came from, so it
+        # is not sent back there.
+        _create_change_log(c)
+        columns = [row[1] for row in c.execute("PRAGMA table_info(change_log)")]
+        if "new" in columns:
+            _upgrade_change_log(c)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id)")
+        # Sequence numbers start after 1, so a sync point of 0 always means
+        # nothing was sent yet, even before any change was logged
+        c.execute("""
+            INSERT INTO sqlite_sequence (name, seq) SELECT 'change_log', 1
+            WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'change_log')
+        """)
+
+        # This device's id
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS sync_device (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                device_id TEXT NOT NULL
+            )
+        """)
+
+        # Holds the peer's device id while its changes are merged, within the
+        # merge transaction only; the triggers tag logged changes with it
+        c.execute("CREATE TABLE IF NOT EXISTS sync_apply_origin (device_id TEXT NOT NULL)")
+
+        logging = "EXISTS (SELECT 1 FROM sync_peers)"
+        origin = "(SELECT device_id FROM sync_apply_origin)"
+        for table, synced in _SYNCED_TABLES.items():
+            key_changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in synced.key_columns)
+            changed = f"{key_changed} OR {synced.changed}" if synced.changed else key_changed
+            columns = list(synced.key_columns) + re.findall(r"\{r\}\.(\w+)", synced.data or "")
+            triggers = {
+                "insert": f"""AFTER INSERT ON {table} WHEN {logging}
+                              BEGIN
+                                  INSERT INTO change_log (table_name, row_id, op, origin)
+                                  VALUES ('{table}', NEW.rowid, 'insert', {origin});
+                              END""",
+                "update": f"""AFTER UPDATE OF {', '.join(dict.fromkeys(columns))} ON {table}
+                              WHEN {logging} AND ({changed})
+                              BEGIN
+                                  INSERT INTO change_log (table_name, row_id, op, old_key, origin)
+                                  VALUES ('{table}', NEW.rowid, 'update',
+                                          CASE WHEN {key_changed} THEN {_key_sql(table, "OLD")} END, {origin});
+                              END""",
+                # Before the delete, so the key still finds the rows it refers to
+                "delete": f"""BEFORE DELETE ON {table} WHEN {logging}
+                              BEGIN
+                                  INSERT INTO change_log (table_name, row_id, op, old_key, origin)
+                                  VALUES ('{table}', OLD.rowid, 'delete', {_key_sql(table, "OLD")}, {origin});
+                              END""",
+            }
+            for event, body in triggers.items():
+                # Recreated, so databases with older triggers get the current ones
+                c.execute(f"DROP TRIGGER IF EXISTS trg_change_log_{table}_{event}")
+                c.execute(f"CREATE TRIGGER trg_change_log_{table}_{event} {body}")
+
+        c.execute("INSERT OR IGNORE INTO sync_device (id, device_id) VALUES (1, ?)", (uuid.uuid4().hex,))
+
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error creating sync tables: {e}")
+
+
+def reset_device_id(conn):
+    """
+    Give a database a new device id, e.g. after copying it from another
+    database, which would otherwise share that database's id.
+    """
+    conn.execute("UPDATE sync_device SET device_id = ? WHERE id = 1", (uuid.uuid4().hex,))
+    conn.commit()
+
+
+def get_device_id(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT device_id FROM sync_device WHERE id = 1")
+    return cur.fetchone()[0]
+
+
+def _payloads(conn, table, row_ids=None):
+    """
+    Build the payloads of a table's rows as they are now.
+
+    :param conn: the Connection object
+    :param table: synced table
+    :param row_ids: rows to read (defaults to all of them)
+    :return: iterator of (row_id, payload) pairs
+    """
+    cur = conn.cursor()
+    sessions = table == "recall_sessions"
+    columns = f"rowid, concept_id, user_response, {_payload_sql(table, table)}" if sessions \
+        else f"rowid, {_payload_sql(table, table)}"
+    if row_ids is None:
+        batches = [cur.execute(f"SELECT {columns} FROM {table} ORDER BY rowid")]
+    else:
+        row_ids = list(row_ids)
+        batches = (cur.execute(f"SELECT {columns} FROM {table} WHERE rowid IN ({','.join('?' * len(batch))})",
+                               batch).fetchall()
+                   for batch in (row_ids[i:i + 500] for i in range(0, len(row_ids), 500)))
+    for rows in batches:
+        if sessions:
+            # Archived responses travel with their sessions
+            for row_id, _, response, payload in with_archived_responses(conn, rows):
+                payload = json.loads(payload)
+                payload["user_response"] = response
+                yield row_id, payload
+        else:
+            for row_id, payload in rows:
+                yield row_id, json.loads(payload)
+
+
+def export_changes(conn, path, peer_id, since=None):
+    """
+    Write the changes a peer has not received yet to a gzip-compressed
+    JSON-lines file, and advance the peer's sync point.
+
+    Several changes to one row are coalesced into one entry from its key
+    before the first change to its state now; a row inserted and deleted
+    since the last sync is left out. A peer that has not synced before, or
+    whose changes were pruned from the log, gets every row instead.
+
+    :param conn: the Connection object
+    :param path: file to write
+    :param peer_id: device id of the receiving peer
+    :param since: resend every change after this sequence number instead,
+                  e.g. 0 after a sync file was lost
+    :return: number of entries written
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT exported_seq, imported_seq FROM sync_peers WHERE peer_id = ?", (peer_id,))
+    row = cur.fetchone()
+    if since is None:
+        since = row[0] if row else 0
+    acked = row[1] if row else 0
+
+    # Registered before anything is read, so changes from here on are logged
+    cur.execute("INSERT INTO sync_peers (peer_id) VALUES (?) ON CONFLICT (peer_id) DO NOTHING", (peer_id,))
+    conn.commit()
+
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = cur.fetchone()
+    until = max(row[0] if row else 0, since)
+    cur.execute("SELECT MIN(seq) FROM change_log WHERE seq > ?", (since,))
+    first = cur.fetchone()[0]
+    snapshot = since == 0 or (until > since and first != since + 1)
+
+    # row id -> [first operation, key before the first key change]; and the
+    # keys of rows deleted before their id was reused
+    changes = {table: {} for table in _SYNCED_TABLES}
+    deleted = {table: [] for table in _SYNCED_TABLES}
+    cur.execute("""
+        SELECT table_name, row_id, op, old_key
+        FROM change_log
+        WHERE seq > ? AND seq <= ? AND (origin IS NULL OR origin != ?)
+        ORDER BY seq
+    """, (since, until, peer_id))
+    for table, row_id, op, old_key in cur:
+        rows = changes[table]
+        change = rows.get(row_id)
+        if change is not None and op == "insert":
+            if change[0] != "insert":
+                deleted[table].append(change[1])
+            rows[row_id] = ["insert", None]
+        elif change is None:
+            rows[row_id] = [op, old_key]
+        elif change[0] != "insert" and change[1] is None:
+            change[1] = old_key
+
+    written = 0
+    with gzip.open(path, "wt", encoding="utf-8") as out:
+        out.write(json.dumps({"format": SYNC_FORMAT, "device": get_device_id(conn),
+                              "since": 0 if snapshot else since, "until": until, "acked": acked}) + "\n")
+
+        def write(table, old, new):
+            nonlocal written
+            out.write(json.dumps({"table": table, "old": old, "new": new}, separators=(",", ":")) + "\n")
+            written += 1
+
+        for table in _MERGE_ORDER:
+            for old_key in deleted[table]:
+                write(table, json.loads(old_key), None)
+            rows = changes[table]
+            current = dict(_payloads(conn, table, rows))
+            for row_id, (_, old_key) in rows.items():
+                new = current.get(row_id)
+                if old_key is not None or new is not None:
+                    write(table, json.loads(old_key) if old_key else None, new)
+            if snapshot:
+                for row_id, new in _payloads(conn, table):
+                    if row_id not in rows:
+                        write(table, None, new)
+
+    cur.execute("UPDATE sync_peers SET exported_seq = ? WHERE peer_id = ?", (until, peer_id))
+    conn.commit()
+    return written
+
+
+def prune_change_log(conn, commit=True):
+    """
+    Delete the changes every known peer has acknowledged merging.
+
+    :param conn: the Connection object
+    :param commit: whether to commit
+    :return: number of deleted changes
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(acked_seq) FROM sync_peers")
+    acked = cur.fetchone()[0]
+    if acked is None:
+        return 0
+    cur.execute("DELETE FROM change_log WHERE seq <= ?", (acked,))
+    if commit:
+        conn.commit()
+    return cur.rowcount
+
+
+def _concept_key(payload):
+    return payload["topic"], payload["concept"], payload.get("digest")
+
+
+class _Merger:
+    """
+    Applies change entries to a database by natural keys.
+
+    A row changed here since the peer last acknowledged our changes has
+    conflicting changes on both devices. The device with the greater id
+    wins, so both sides converge whichever imports first.
+    """
+
+    def __init__(self, conn, peer_id, acked):
+        self.cur = conn.cursor()
+        self.peer_id = peer_id
+        self.acked = acked
+        self.peer_wins = peer_id > get_device_id(conn)
+        self.topic_ids = {}
+        self.concept_ids = {}
+        # table -> {concept key: row id} of rows changed away from that key here
+        self.moved = {}
+        # concept id -> text to index it under, once the whole merge is applied
+        self.new_concepts = {}
+        self.replay = set()
+        self.earliest_session = None
+
+    def changed_locally(self, table, row_id):
+        """
+        Whether a row has a change here the peer had not merged when it
+        exported.
+        """
+        self.cur.execute("""
+            SELECT 1 FROM change_log
+            WHERE table_name = ? AND row_id = ? AND seq > ? AND (origin IS NULL OR origin != ?)
+            LIMIT 1
+        """, (table, row_id, self.acked, self.peer_id))
+        return self.cur.fetchone() is not None
+
+    def moved_locally(self, table, payload):
+        """
+        Find the concept a row keyed by payload was renamed or deleted from
+        here, in a change the peer had not merged when it exported.
+
+        :return: concept id of the row if it still exists, 0 if it was
+                 deleted, None without such a change
+        """
+        if table not in self.moved:
+            self.moved[table] = {}
+            self.cur.execute("""
+                SELECT row_id, old_key FROM change_log
+                WHERE table_name = ? AND old_key IS NOT NULL AND seq > ? AND (origin IS NULL OR origin != ?)
+                ORDER BY seq
+            """, (table, self.acked, self.peer_id))
+            for row_id, old_key in self.cur.fetchall():
+                self.moved[table].setdefault(_concept_key(json.loads(old_key)), row_id)
+        concept_id = self.moved[table].get(_concept_key(payload))
+        if concept_id is None:
+            return None
+        self.cur.execute("SELECT 1 FROM concepts WHERE id = ?", (concept_id,))
+        return concept_id if self.cur.fetchone() else 0
+
+    def topic_id(self, name, create):
+        if name not in self.topic_ids:
+            self.cur.execute("SELECT id FROM topics WHERE name = ?", (name,))
+            row = self.cur.fetchone()
+            if row is None and create:
+                self.cur.execute("INSERT INTO topics (name) VALUES (?)", (name,))
+                row = (self.cur.lastrowid,)
+            if row is None:
+                return None
+            self.topic_ids[name] = row[0]
+        return self.topic_ids[name]
+
+    def concept_id(self, payload, create=False):
+        key = _concept_key(payload)
+        if key in self.concept_ids:
+            return self.concept_ids[key]
+        if None in key[:2]:
+            return None
+        topic_id = self.topic_id(payload["topic"], create)
+        if topic_id is None:
+            return None
+        self.cur.execute("""
+            SELECT c.id
+            FROM concepts c
+            LEFT JOIN concept_bodies b ON b.concept_id = c.id
+            WHERE c.topic_id = ? AND c.content = ? AND b.digest IS ?
+            ORDER BY c.id LIMIT 1
+        """, (topic_id, payload["concept"], key[2]))
+        row = self.cur.fetchone()
+        if row is None and create:
+            # A long concept gets its body, and with it its digest, from its concept_bodies entry
+            self.cur.execute("INSERT INTO concepts (topic_id, content) VALUES (?, ?)", (topic_id, payload["concept"]))
+            row = (self.cur.lastrowid,)
+            self.new_concepts[row[0]] = payload["concept"]
+        if row is None:
+            return None
+        self.concept_ids[key] = row[0]
+        return row[0]
+
+    def merge_concepts(self, old, new):
+        concept_id = self.concept_id(old or new)
+        if concept_id is None:
+            # Renamed or deleted here as well
+            moved = self.moved_locally("concepts", old or new)
+            if moved is not None and not self.peer_wins:
+                return
+            concept_id = moved or None
+        if new:
+            if concept_id is not None and self.concept_id(new) is None:
+                # Edited or moved: rename in place to keep its history
+                self.cur.execute("UPDATE concepts SET topic_id = ?, content = ? WHERE id = ?",
+                                 (self.topic_id(new["topic"], True), new["concept"], concept_id))
+                self.concept_ids = {key: value for key, value in self.concept_ids.items() if value != concept_id}
+                self.concept_ids[_concept_key(new)] = concept_id
+                self.new_concepts[concept_id] = new["concept"]
+            else:
+                self.concept_id(new, create=True)
+        elif concept_id is not None:
+            for table in ("recall_sessions", "learning_data", "concept_learning_progress",
+                          "concept_minhash", "concept_lsh_buckets"):
+                self.cur.execute(f"DELETE FROM {table} WHERE concept_id = ?", (concept_id,))
+            self.cur.execute("DELETE FROM concepts WHERE id = ?", (concept_id,))
+            self.concept_ids = {key: value for key, value in self.concept_ids.items() if value != concept_id}
+            self.new_concepts.pop(concept_id, None)
+
+    def merge_concept_bodies(self, old, new):
+        # An edited body is found by its old digest
+        concept_id = self.concept_id(old) if old else None
+        if old and concept_id is None:
+            # Edited or deleted here as well
+            moved = self.moved_locally("concept_bodies", old)
+            if moved is not None and not self.peer_wins:
+                return
+            concept_id = moved or None
+        if new:
+            if concept_id is None:
+                concept_id = self.concept_id(new, create=True)
+            body = bytes.fromhex(new["body"])
+            content = decode_body(body, new["compressed"]) if new["compressed"] else body.decode("utf-8")
+            store_concept_body(self.cur.connection, concept_id, content)
+            # Entries logged before the edit keep finding the concept by the old key
+            self.concept_ids[_concept_key(new)] = concept_id
+            # Index the full text rather than the preview
+            self.new_concepts[concept_id] = content
+        elif concept_id is not None:
+            self.cur.execute("DELETE FROM concept_bodies WHERE concept_id = ?", (concept_id,))
+
+    def merge_recall_sessions(self, old, new):
+        if old and (not new or (old["topic"], old["concept"], old["timestamp"]) !=
+                    (new["topic"], new["concept"], new["timestamp"])):
+            concept_id = self.concept_id(old)
+            if concept_id is not None:
+                self.cur.execute("DELETE FROM recall_sessions WHERE concept_id = ? AND timestamp = ?",
+                                 (concept_id, old["timestamp"]))
+                self.touch(concept_id, old["timestamp"])
+        if new:
+            concept_id = self.concept_id(new, create=True)
+            self.cur.execute("SELECT id FROM recall_sessions WHERE concept_id = ? AND timestamp = ?",
+                             (concept_id, new["timestamp"]))
+            row = self.cur.fetchone()
+            if row and self.changed_locally("recall_sessions", row[0]) and not self.peer_wins:
+                return
+            if row:
+                # An archived (NULL) response keeps the local text
+                self.cur.execute("""
+                    UPDATE recall_sessions SET ai_grade = ?, user_response = COALESCE(?, user_response)
+                    WHERE id = ?
+                """, (new["ai_grade"], new["user_response"], row[0]))
+            else:
+                self.cur.execute("""
+                    INSERT INTO recall_sessions (concept_id, timestamp, user_response, ai_grade)
+                    VALUES (?, ?, ?, ?)
+                """, (concept_id, new["timestamp"], new["user_response"], new["ai_grade"]))
+            self.touch(concept_id, new["timestamp"])
+
+    def merge_learning_data(self, old, new):
+        # The state of reviewed concepts is replayed from the merged log;
+        # only take it as-is for concepts without local reviews
+        payload = new or old
+        concept_id = self.concept_id(payload)
+        if concept_id is None or concept_id in self.replay:
+            return
+        self.cur.execute("SELECT 1 FROM recall_sessions WHERE concept_id = ? LIMIT 1", (concept_id,))
+        if self.cur.fetchone():
+            return
+        self.cur.execute("SELECT id FROM learning_data WHERE concept_id = ?", (concept_id,))
+        row = self.cur.fetchone()
+        if row and self.changed_locally("learning_data", row[0]) and not self.peer_wins:
+            return
+        if new:
+            self.cur.execute("""
+                INSERT INTO learning_data (concept_id, difficulty, stability) VALUES (?, ?, ?)
+                ON CONFLICT (concept_id) DO UPDATE SET difficulty = excluded.difficulty,
+                                                       stability = excluded.stability
+            """, (concept_id, new["difficulty"], new["stability"]))
+        else:
+            self.cur.execute("DELETE FROM learning_data WHERE concept_id = ?", (concept_id,))
+
+    def merge_concept_learning_progress(self, old, new):
+        payload = new or old
+        concept_id = self.concept_id(payload, create=bool(new))
+        self.cur.execute("SELECT id FROM learning_techniques WHERE name = ?", (payload["technique"],))
+        technique = self.cur.fetchone()
+        if concept_id is None or technique is None:
+            return
+        self.cur.execute("SELECT id FROM concept_learning_progress WHERE concept_id = ? AND technique_id = ?",
+                         (concept_id, technique[0]))
+        row = self.cur.fetchone()
+        if not new:
+            if row:
+                self.cur.execute("DELETE FROM concept_learning_progress WHERE id = ?", (row[0],))
+        elif row:
+            # Counts from both devices cannot be added without a common base;
+            # keep the larger count and the later timestamp on both sides
+            self.cur.execute("""
+                UPDATE concept_learning_progress
+                SET applications_count = MAX(applications_count, ?),
+                    last_applied_timestamp = MAX(COALESCE(last_applied_timestamp, ''), COALESCE(?, ''))
+                WHERE id = ?
+            """, (new["applications_count"], new["last_applied_timestamp"], row[0]))
+        else:
+            self.cur.execute("""
+                INSERT INTO concept_learning_progress (concept_id, technique_id, applications_count, last_applied_timestamp)
+                VALUES (?, ?, ?, ?)
+            """, (concept_id, technique[0], new["applications_count"], new["last_applied_timestamp"]))
+
+    def touch(self, concept_id, timestamp):
+        self.replay.add(concept_id)
+        if self.earliest_session is None or timestamp < self.earliest_session:
+            self.earliest_session = timestamp
+
+
+def import_changes(conn, path):
+    """
+    Merge a peer's change file into this database.
+
+    Rows are matched by natural keys and applied table by table in a fixed
+    order, so merging the same files yields the same database regardless of
+    how often they are applied. Review logs from both devices are
+    interleaved by timestamp and the FSRS state of every concept with merged
+    reviews is replayed from its full log, so concurrent reviews on two
+    devices are both counted.
+
+    :param conn: the Connection object
+    :param path: file written by export_changes on the peer
+    :return: dict with the number of merged entries and replayed concepts
+    """
+    from dedupe import index_concepts
+
+    with gzip.open(path, "rt", encoding="utf-8") as source:
+        header = json.loads(source.readline())
+        if header.get("format") != SYNC_FORMAT:
+            raise ValueError(f"Unsupported sync file format: {header.get('format')!r}")
+        peer_id = header["device"]
+        if peer_id == get_device_id(conn):
+            raise ValueError("Sync file was exported by this device")
+        entries = [json.loads(line) for line in source if line.strip()]
+
+    cur = conn.cursor()
+    cur.execute("SELECT imported_seq FROM sync_peers WHERE peer_id = ?", (peer_id,))
+    row = cur.fetchone()
+    imported_seq = row[0] if row else 0
+    merging = header["until"] > imported_seq
+    if merging and header["since"] > imported_seq:
+        raise ValueError(f"Sync file starts after change {header['since']}, but only changes up to "
+                         f"{imported_seq} were received from this peer; export again with since={imported_seq}")
+
+    merger = _Merger(conn, peer_id, header.get("acked", 0))
+    try:
+        # Registered first, so the merged changes are logged for other peers
+        cur.execute("INSERT INTO sync_peers (peer_id) VALUES (?) ON CONFLICT (peer_id) DO NOTHING", (peer_id,))
+        # Even a file with nothing new tells which of our changes the peer has
+        cur.execute("UPDATE sync_peers SET acked_seq = MAX(acked_seq, ?) WHERE peer_id = ?",
+                    (header.get("acked", 0), peer_id))
+        if merging:
+            cur.execute("INSERT INTO sync_apply_origin (device_id) VALUES (?)", (peer_id,))
+            for table in _MERGE_ORDER:
+                merge = getattr(merger, f"merge_{table}")
+                for entry in entries:
+                    if entry["table"] == table:
+                        merge(entry["old"], entry["new"])
+
+            index_concepts(conn, merger.new_concepts.items(), commit=False)
+            if replay_reviews(conn, merger.replay, commit=False) is None:
+                raise sqlite3.Error("Replaying merged reviews failed")
+
+            cur.execute("DELETE FROM sync_apply_origin")
+            cur.execute("UPDATE sync_peers SET imported_seq = ? WHERE peer_id = ?", (header["until"], peer_id))
+        prune_change_log(conn, commit=False)
+        conn.commit()
+    except Exception:
+        # Also for malformed entries: a left-over sync_apply_origin row would
+        # tag later local writes as coming from the peer
+        conn.rollback()
+        raise
+    if not merging:
+        return {"merged": 0, "replayed": 0}
+
+    # Reviews landing on days the mastery history already covers invalidate it
+    cur.execute("SELECT last_day FROM mastery_history_cursor WHERE id = 1")
+    cursor_row = cur.fetchone()
+    if cursor_row and merger.earliest_session and merger.earliest_session[:10] <= cursor_row[0]:
+        from mastery_history import backfill_mastery_history
+        backfill_mastery_history(conn)
+
+    return {"merged": len(entries), "replayed": len(merger.replay)}
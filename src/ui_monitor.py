@@ -0,0 +1,181 @@
+import functools
+import json
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+HEARTBEAT_MS = 50
+STALL_MS = 250
+METRICS_WRITE_MS = 10000
+# Latency samples kept per handler, and stall stacks kept in total
+MAX_SAMPLES = 2000
+MAX_STALLS = 50
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a sequence of numbers, or None if it is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class UIMonitor:
+    """
+    Opt-in telemetry for the Tk event loop.
+
+    A heartbeat scheduled with `after` measures how late the event loop runs
+    it (event-loop lag). Wrapped handlers record their duration. A watchdog
+    thread samples the main thread's stack whenever the heartbeat is overdue
+    by more than stall_ms, which shows what a stall was spent on: SQL, FSRS,
+    matplotlib or widget updates. Percentiles and stall samples are written
+    to a JSON metrics file.
+    """
+
+    def __init__(self, root, metrics_path, heartbeat_ms=HEARTBEAT_MS, stall_ms=STALL_MS,
+                 write_ms=METRICS_WRITE_MS):
+        """
+        :param root: the Tk root (anything with after())
+        :param metrics_path: JSON file the metrics are written to
+        :param heartbeat_ms: heartbeat interval
+        :param stall_ms: heartbeat delay that counts as a stall
+        :param write_ms: interval between metrics file writes
+        """
+        self.root = root
+        self.metrics_path = metrics_path
+        self.heartbeat_ms = heartbeat_ms
+        self.stall_ms = stall_ms
+        self.write_ms = write_ms
+        self.latencies = {}
+        self.lags = deque(maxlen=MAX_SAMPLES)
+        self.stalls = deque(maxlen=MAX_STALLS)
+        self.stall_count = 0
+        self.lock = threading.Lock()
+        self.main_thread_id = threading.get_ident()
+        self.expected_beat = None
+        self.last_beat = time.monotonic()
+        self.stopping = threading.Event()
+        self.watchdog = threading.Thread(target=self.watch, name="ui-monitor", daemon=True)
+
+    def start(self):
+        self.last_beat = time.monotonic()
+        self.expected_beat = self.last_beat + self.heartbeat_ms / 1000
+        self.root.after(self.heartbeat_ms, self.heartbeat)
+        self.root.after(self.write_ms, self.write_periodically)
+        self.watchdog.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.write_metrics()
+
+    # --- Measurements ---
+
+    def heartbeat(self):
+        now = time.monotonic()
+        self.lags.append(max(now - self.expected_beat, 0.0) * 1000)
+        self.last_beat = now
+        if not self.stopping.is_set():
+            self.expected_beat = now + self.heartbeat_ms / 1000
+            self.root.after(self.heartbeat_ms, self.heartbeat)
+
+    def record(self, name, milliseconds):
+        with self.lock:
+            if name not in self.latencies:
+                self.latencies[name] = deque(maxlen=MAX_SAMPLES)
+            self.latencies[name].append(milliseconds)
+
+    def timed(self, name, fn):
+        """
+        Wrap a handler so each call's duration is recorded under name.
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+
+    def instrument(self, obj, names):
+        """
+        Replace methods of obj by timed wrappers. Call this before widgets
+        capture the bound methods as commands.
+        """
+        for name in names:
+            setattr(obj, name, self.timed(name, getattr(obj, name)))
+
+    def watch(self):
+        """
+        Watchdog thread: sample the main thread's stack during stalls.
+        """
+        interval = self.stall_ms / 2000
+        sampled_beat = None
+        while not self.stopping.wait(interval):
+            overdue = (time.monotonic() - self.last_beat) * 1000 - self.heartbeat_ms
+            if overdue > self.stall_ms and sampled_beat != self.last_beat:
+                # One sample per stall, taken while it is still going on
+                sampled_beat = self.last_beat
+                self.sample_stall(overdue)
+
+    def sample_stall(self, overdue_ms):
+        frame = sys._current_frames().get(self.main_thread_id)
+        if frame is None:
+            return
+        stack = [line.rstrip() for line in traceback.format_stack(frame)]
+        with self.lock:
+            self.stall_count += 1
+            self.stalls.append({"time": time.time(), "overdue_ms": round(overdue_ms, 1), "stack": stack})
+
+    # --- Reporting ---
+
+    def summary(self):
+        """
+        :return: dict of name -> {count, p50, p95, p99, max} in milliseconds;
+                 event-loop lag is reported as "event_loop_lag"
+        """
+        with self.lock:
+            series = {name: list(values) for name, values in self.latencies.items()}
+        series["event_loop_lag"] = list(self.lags)
+        return {name: {"count": len(values),
+                       "p50": percentile(values, 50),
+                       "p95": percentile(values, 95),
+                       "p99": percentile(values, 99),
+                       "max": max(values) if values else None}
+                for name, values in series.items()}
+
+    def status_text(self):
+        summary = self.summary()
+        lag = summary.pop("event_loop_lag")
+        text = f"Event loop lag p95 {lag['p95'] or 0:.0f} ms, stalls {self.stall_count}"
+        timed = [(stats["p95"], name) for name, stats in summary.items() if stats["count"]]
+        if timed:
+            p95, name = max(timed)
+            text += f" | slowest {name} p95 {p95:.0f} ms"
+        return text
+
+    def write_metrics(self):
+        with self.lock:
+            stalls = list(self.stalls)
+            stall_count = self.stall_count
+        metrics = {"written": time.time(), "latency_ms": self.summary(),
+                   "stall_count": stall_count, "stalls": stalls}
+        os.makedirs(os.path.dirname(self.metrics_path) or ".", exist_ok=True)
+        partial = self.metrics_path + ".partial"
+        with open(partial, "w", encoding="utf-8") as out:
+            json.dump(metrics, out, indent=1)
+        os.replace(partial, self.metrics_path)
+
+    def write_periodically(self):
+        if self.stopping.is_set():
+            return
+        self.write_metrics()
+        self.root.after(self.write_ms, self.write_periodically)
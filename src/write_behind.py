@@ -0,0 +1,153 @@
+import datetime
+import json
+import os
+import clock
+from review import schedule_review, record_review
+
+# Queued reviews that trigger a flush without waiting for the caller's timer
+DEFAULT_MAX_PENDING = 50
+
+
+class ReviewWriteBehind:
+    """
+    Write-behind buffer for reviews.
+
+    submit() applies a review to in-memory state and appends it to an
+    append-only journal, then returns without touching the database.
+    flush() writes every queued review to SQLite in one transaction and
+    truncates the journal. Callers flush on a timer and before reading the
+    reviews back; flush_if_full() flushes early once max_pending reviews
+    are queued. Reviews left in the journal by a crash are replayed when
+    the buffer is opened again.
+    """
+
+    def __init__(self, conn, journal_path, fsync=True, max_pending=DEFAULT_MAX_PENDING):
+        """
+        :param conn: the Connection object reviews are flushed to
+        :param journal_path: path of the append-only journal file
+        :param fsync: fsync every journal append, so a review survives a
+                      power loss and not only a crash of the app
+        :param max_pending: number of queued reviews at which flush_if_full() flushes
+        """
+        self.conn = conn
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self.max_pending = max_pending
+        self.queue = []
+        # concept_id -> (difficulty, stability, last_review) of queued reviews
+        self.state = {}
+
+        os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+        self.replay_journal()
+        self.journal = open(journal_path, "a", encoding="utf-8")
+
+    def replay_journal(self):
+        """
+        Write reviews left in the journal to the database.
+
+        Reviews already present in recall_sessions (flushed right before a
+        crash, but not yet truncated from the journal) are skipped.
+
+        :return: number of replayed reviews
+        """
+        if not os.path.exists(self.journal_path):
+            return 0
+
+        entries = []
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-append
+                    continue
+
+        cur = self.conn.cursor()
+        replayed = 0
+        for entry in entries:
+            cur.execute("SELECT 1 FROM recall_sessions WHERE concept_id = ? AND timestamp = ?",
+                        (entry["concept_id"], entry["timestamp"]))
+            if cur.fetchone():
+                continue
+            if record_review(self.conn, entry["concept_id"], entry["user_response"], entry["grade"],
+                             technique=entry["technique"],
+                             timestamp=datetime.datetime.fromisoformat(entry["timestamp"]),
+                             commit=False) is None:
+                self.conn.rollback()
+                raise RuntimeError(f"Could not replay review journal {self.journal_path}")
+            replayed += 1
+
+        self.conn.commit()
+        open(self.journal_path, "w").close()
+        return replayed
+
+    def submit(self, concept_id, user_response, grade, technique=None, timestamp=None):
+        """
+        Apply a review to the in-memory state and queue it for flushing.
+
+        :return: (difficulty, stability, is_new) as record_review would
+        """
+        timestamp = timestamp or clock.now()
+        difficulty, stability, is_new = schedule_review(
+            self.conn, concept_id, grade, timestamp, previous=self.state.get(concept_id))
+
+        entry = {
+            "concept_id": concept_id,
+            "user_response": user_response,
+            "grade": grade,
+            "technique": technique,
+            "timestamp": timestamp.isoformat(),
+        }
+        self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+        self.queue.append(entry)
+        self.state[concept_id] = (difficulty, stability, timestamp)
+        return difficulty, stability, is_new
+
+    def pending_concept_ids(self):
+        """
+        Concepts with queued reviews that are not in the database yet.
+        """
+        return set(self.state)
+
+    def flush(self):
+        """
+        Write all queued reviews to the database in a single transaction.
+
+        :return: number of written reviews (0 if the transaction failed; the
+                 reviews then stay queued and journaled for the next flush)
+        """
+        if not self.queue:
+            return 0
+
+        for entry in self.queue:
+            if record_review(self.conn, entry["concept_id"], entry["user_response"], entry["grade"],
+                             technique=entry["technique"],
+                             timestamp=datetime.datetime.fromisoformat(entry["timestamp"]),
+                             commit=False) is None:
+                self.conn.rollback()
+                return 0
+        self.conn.commit()
+
+        written = len(self.queue)
+        self.queue = []
+        self.state = {}
+        self.journal.truncate(0)
+        return written
+
+    def flush_if_full(self):
+        """
+        Flush if max_pending or more reviews are queued.
+
+        :return: number of written reviews
+        """
+        if len(self.queue) < self.max_pending:
+            return 0
+        return self.flush()
+
+    def close(self):
+        self.flush()
+        self.journal.close()
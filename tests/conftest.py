@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+# Add the src directory to the Python path, once for every test module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from database import clone_schema
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """
+    Factory for databases with the full schema, cloned from a template:
+    make_db() opens one in memory, make_db("name.db") a file in tmp_path.
+    Connections are closed after the test.
+    """
+    connections = []
+
+    def make(name=None):
+        conn = clone_schema(str(tmp_path / name) if name else ":memory:")
+        connections.append(conn)
+        return conn
+
+    yield make
+    for conn in connections:
+        conn.close()
+
+
+@pytest.fixture
+def db_conn(make_db):
+    """
+    An in-memory database with the full schema. Test modules that need
+    data in it override this with a fixture of the same name.
+    """
+    return make_db()
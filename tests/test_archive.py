@@ -0,0 +1,94 @@
+import datetime
+import json
+import pytest
+
+from database import create_connection, main as create_db, add_topic, add_concepts
+from review import record_review
+from archive import archive_responses, get_recall_history, get_response, compact_database
+from grading_pipeline import regrade_history
+from cli import main as cli_main
+
+START = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / "archive.db")
+    create_db(path)
+    conn = create_connection(path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def archived(conn):
+    """
+    Two concepts reviewed every 10 days, with the responses of the first
+    half of the sessions archived. Every stored grade is 1, whatever the
+    response.
+    """
+    topic_id = add_topic(conn, "Capitals")
+    concept_ids = add_concepts(conn, topic_id, ["Paris is the capital of France", "Rome is the capital of Italy"])
+    answers = {concept_ids[0]: ["Paris is the capital of France", "Paris", "Lyon"],
+               concept_ids[1]: ["Rome is the capital of Italy", "Rome", "Milan"]}
+    for day in range(0, 200, 10):
+        for concept_id in concept_ids:
+            record_review(conn, concept_id, answers[concept_id][day // 10 % 3], 1,
+                          timestamp=START + datetime.timedelta(days=day))
+    conn.execute("INSERT INTO recall_sessions (concept_id, timestamp, ai_grade) VALUES (?, ?, 1)",
+                 (concept_ids[0], START.isoformat()))
+    conn.commit()
+    responses = conn.execute("SELECT id, user_response FROM recall_sessions ORDER BY id").fetchall()
+    assert archive_responses(conn, older_than_days=100, now=START + datetime.timedelta(days=200)) == 20
+    return responses
+
+
+def test_archive_and_read_back(conn):
+    topic_id = add_topic(conn, "History")
+    concept_ids = add_concepts(conn, topic_id, ["The Battle of Hastings was in 1066", "Rome fell in 476"])
+    for day in range(0, 400, 20):
+        for concept_id in concept_ids:
+            record_review(conn, concept_id, f"answer {concept_id} on day {day} " + "with padding " * 20, 3,
+                          timestamp=START + datetime.timedelta(days=day))
+
+    history_before = [get_recall_history(conn, concept_id) for concept_id in concept_ids]
+    learning_before = conn.execute("SELECT * FROM learning_data ORDER BY concept_id").fetchall()
+
+    now = START + datetime.timedelta(days=400)
+    archived = archive_responses(conn, older_than_days=180, now=now)
+    # Days 0..200 are older than the cutoff at day 220
+    assert archived == 2 * 11
+    assert conn.execute("SELECT COUNT(*) FROM response_archive").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM recall_sessions WHERE user_response IS NULL").fetchone()[0] == 22
+
+    # Grades, timestamps and scheduling state are untouched; responses read back transparently
+    assert [get_recall_history(conn, concept_id) for concept_id in concept_ids] == history_before
+    assert conn.execute("SELECT * FROM learning_data ORDER BY concept_id").fetchall() == learning_before
+    first_session = history_before[0][0]
+    assert get_response(conn, first_session[0]) == first_session[2]
+
+    # Archiving again finds nothing new
+    assert archive_responses(conn, older_than_days=180, now=now) == 0
+
+    before, after = compact_database(conn)
+    assert after <= before
+
+
+def test_regrade_reads_archived_responses(conn, archived):
+    # Small chunks, so archive lookups span several batches
+    assert regrade_history(conn, chunk_size=3, max_workers=1) == 40
+
+    grades = dict(conn.execute("SELECT id, ai_grade FROM recall_sessions"))
+    expected = {"Paris is the capital of France": 4, "Rome is the capital of Italy": 4,
+                "Paris": 1, "Rome": 1, "Lyon": 1, "Milan": 1}
+    assert {session_id: grades[session_id] for session_id, response in archived if response} == \
+        {session_id: expected[response] for session_id, response in archived if response}
+    # The session that never had a response keeps its grade
+    assert [grades[session_id] for session_id, response in archived if response is None] == [1]
+
+
+def test_export_reads_archived_responses(conn, archived, tmp_path, capsys):
+    capsys.readouterr()
+    cli_main(["--db", str(tmp_path / "archive.db"), "export", "sessions"])
+    exported = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(row["id"], row["user_response"]) for row in exported] == archived
@@ -0,0 +1,98 @@
+import os
+import time
+import pytest
+
+from database import create_connection, main as create_db, add_topic, add_concepts
+from backup import (backup_database, list_backups, rotate_backups, verify_backup, restore_backup,
+                    BackupScheduler)
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "learning.db")
+    create_db(path)
+    conn = create_connection(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    topic_id = add_topic(conn, "Geography")
+    add_concepts(conn, topic_id, [f"Fact number {i}" for i in range(500)])
+    conn.close()
+    return path
+
+
+def _concept_count(path):
+    conn = create_connection(path)
+    count = conn.execute("SELECT COUNT(*) FROM concepts").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_backup_rotate_verify_restore(db_file, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+
+    # The app's connection keeps writing while the backup copies in small
+    # steps; each write from another connection restarts the copy
+    app_conn = create_connection(db_file)
+    steps = []
+
+    def write_between_steps(status, remaining, total):
+        steps.append(remaining)
+        if len(steps) <= 3:
+            app_conn.execute("INSERT INTO topics (name) VALUES (?)", (f"Topic {len(steps)}",))
+            app_conn.commit()
+
+    plain = backup_database(db_file, backup_dir, pages=4, sleep=0, progress=write_between_steps)
+    assert len(steps) > 3
+    packed = backup_database(db_file, backup_dir, compress=True)
+    backup_database(db_file, backup_dir)
+    app_conn.close()
+
+    assert verify_backup(plain)[0] and verify_backup(packed)[0]
+    assert rotate_backups(db_file, backup_dir, keep=2) == [plain]
+    assert list_backups(db_file, backup_dir)[0] == packed
+
+    with open(os.path.join(backup_dir, "learning-corrupt.db"), "wb") as corrupt:
+        corrupt.write(b"not a database" * 100)
+    assert not verify_backup(os.path.join(backup_dir, "learning-corrupt.db"))[0]
+    with pytest.raises(ValueError):
+        restore_backup(os.path.join(backup_dir, "learning-corrupt.db"), db_file)
+
+    conn = create_connection(db_file)
+    conn.execute("DELETE FROM concepts")
+    conn.commit()
+    conn.close()
+    restore_backup(packed, db_file)
+    assert _concept_count(db_file) == 500
+
+
+def test_backups_of_similarly_named_decks_stay_apart(tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    bio, advanced = str(tmp_path / "bio.db"), str(tmp_path / "bio-advanced.db")
+    for path in (bio, advanced):
+        create_db(path)
+    bio_backups = [backup_database(bio, backup_dir) for _ in range(2)]
+    advanced_backups = [backup_database(advanced, backup_dir, compress=True) for _ in range(3)]
+
+    assert list_backups(bio, backup_dir) == bio_backups
+    assert list_backups(advanced, backup_dir) == advanced_backups
+    # Rotating one deck never deletes the other's backups
+    assert rotate_backups(bio, backup_dir, keep=1) == bio_backups[:1]
+    assert list_backups(advanced, backup_dir) == advanced_backups
+    assert list_backups(str(tmp_path / "missing.db"), str(tmp_path / "nowhere")) == []
+
+
+def test_scheduler_runs_in_background(db_file, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    scheduler = BackupScheduler(db_file, backup_dir, interval_s=3600, keep=1).start()
+    try:
+        deadline = time.time() + 10
+        while scheduler.last_backup is None and time.time() < deadline:
+            time.sleep(0.01)
+        first = scheduler.last_backup
+        assert first and verify_backup(first)[0]
+
+        scheduler.run_now()
+        while scheduler.last_backup == first and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    assert list_backups(db_file, backup_dir) == [scheduler.last_backup]
@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+import datetime
+import sqlite3
+import pytest
+
+import clock
+from cli import main
+from clock import VirtualClock
+import review
+from review import record_review
+
+START = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    source = tmp_path / "concepts.csv"
+    source.write_text("topic,content\nCapitals,Paris is the capital of France\n"
+                      "Capitals,Rome is the capital of Italy\nRivers,The Nile flows north\n")
+    path = str(tmp_path / "learning.db")
+    assert main(["--db", path, "import", str(source)]) == 0
+    return path
+
+
+def _json_lines(text):
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def test_import_and_export(db_file, capsys):
+    capsys.readouterr()
+    main(["--db", db_file, "export", "concepts"])
+    concepts = _json_lines(capsys.readouterr().out)
+    assert [concept["content"] for concept in concepts] == [
+        "Paris is the capital of France", "Rome is the capital of Italy", "The Nile flows north"]
+
+    main(["--db", db_file, "export", "topics", "--format", "csv"])
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out)))
+    assert rows == [["id", "name"], ["1", "Capitals"], ["2", "Rivers"]]
+
+
+def test_due_mastery_and_replay(db_file, capsys, monkeypatch):
+    conn = sqlite3.connect(db_file)
+    record_review(conn, 1, "Paris", 3, timestamp=START)
+    record_review(conn, 1, "Paris?", 2, timestamp=START + datetime.timedelta(days=5))
+    record_review(conn, 2, "Rome", 3, timestamp=START + datetime.timedelta(days=30))
+    conn.close()
+
+    previous = clock.set_clock(VirtualClock(START + datetime.timedelta(days=31)))
+    try:
+        capsys.readouterr()
+        main(["--db", db_file, "due"])
+        due = _json_lines(capsys.readouterr().out)
+        assert [row["concept_id"] for row in due] == [1]
+
+        main(["--db", db_file, "due", "--include-new", "--threshold", "1"])
+        due = _json_lines(capsys.readouterr().out)
+        assert [row["concept_id"] for row in due] == [1, 2, 3]
+        assert due[2]["retrievability"] is None
+
+        main(["--db", db_file, "mastery"])
+        mastery = {row["topic"]: row["mastery"] for row in _json_lines(capsys.readouterr().out)}
+        assert mastery["Rivers"] == 0.0 and 0 < mastery["Capitals"] < 1
+    finally:
+        clock.set_clock(previous)
+
+    # Replaying the log reproduces the recorded state
+    conn = sqlite3.connect(db_file)
+    recorded = conn.execute("SELECT concept_id, difficulty, stability FROM learning_data ORDER BY concept_id").fetchall()
+    conn.execute("UPDATE learning_data SET stability = 1000")
+    conn.commit()
+    main(["--db", db_file, "replay"])
+    replayed = conn.execute("SELECT concept_id, difficulty, stability FROM learning_data ORDER BY concept_id").fetchall()
+    assert replayed == recorded
+
+    # Also when the states are written in several batches
+    monkeypatch.setattr(review, "REPLAY_BATCH_SIZE", 1)
+    conn.execute("UPDATE learning_data SET stability = 1000")
+    conn.commit()
+    assert review.replay_reviews(conn) == 2
+    replayed = conn.execute("SELECT concept_id, difficulty, stability FROM learning_data ORDER BY concept_id").fetchall()
+    assert replayed == recorded
+    conn.close()
+
+
+def test_missing_database(tmp_path):
+    with pytest.raises(SystemExit):
+        main(["--db", str(tmp_path / "missing.db"), "due"])
+
+
+def test_regrade_replays_changed_concepts(db_file, capsys):
+    conn = sqlite3.connect(db_file)
+    record_review(conn, 1, "Paris is the capital of France", 1, timestamp=START)
+    record_review(conn, 1, "Paris is the capital", 1, timestamp=START + datetime.timedelta(days=3))
+    record_review(conn, 2, "Rome is the capital of Italy", 4, timestamp=START)
+    # Concept 2 keeps its grade, so its state is left alone
+    conn.execute("UPDATE learning_data SET stability = 1000 WHERE concept_id = 2")
+    conn.commit()
+
+    assert main(["--db", db_file, "regrade", "--workers", "1"]) == 0
+    assert "Rebuilt the FSRS state of 1 concepts" in capsys.readouterr().err
+
+    grades = [row[0] for row in conn.execute("SELECT ai_grade FROM recall_sessions ORDER BY id")]
+    assert grades == [4, 3, 4]
+    regraded = conn.execute("SELECT difficulty, stability FROM learning_data WHERE concept_id = 1").fetchone()
+    assert review.replay_reviews(conn, [1]) == 1
+    assert conn.execute("SELECT difficulty, stability FROM learning_data WHERE concept_id = 1").fetchone() == regraded
+    assert conn.execute("SELECT stability FROM learning_data WHERE concept_id = 2").fetchone()[0] == 1000
+    conn.close()
+
+
+def test_dedupe_report(db_file, capsys):
+    conn = sqlite3.connect(db_file)
+    conn.execute("INSERT INTO concepts (topic_id, content) VALUES (1, 'Paris is the capital of France!')")
+    conn.commit()
+    capsys.readouterr()
+
+    # Inserted behind the index's back, so only found after a rebuild
+    main(["--db", db_file, "dedupe"])
+    assert _json_lines(capsys.readouterr().out) == []
+
+    main(["--db", db_file, "dedupe", "--rebuild", "--format", "csv"])
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out)))
+    assert rows == [["cluster", "concept_id", "topic", "content"],
+                    ["1", "1", "Capitals", "Paris is the capital of France"],
+                    ["1", "4", "Capitals", "Paris is the capital of France!"]]
+    conn.close()
+
+
+def test_areas(db_file, capsys):
+    assert main(["--db", db_file, "areas", "add", "Geography"]) == 0
+    main(["--db", db_file, "areas", "add", "Europe", "--parent", "Geography"])
+    main(["--db", db_file, "areas", "assign", "Capitals", "Europe"])
+    capsys.readouterr()
+
+    main(["--db", db_file, "areas", "list"])
+    assert _json_lines(capsys.readouterr().out) == [
+        {"area_id": 1, "name": "Geography", "parent": None, "topics": 0},
+        {"area_id": 2, "name": "Europe", "parent": "Geography", "topics": 1}]
+
+    with pytest.raises(SystemExit):
+        main(["--db", db_file, "areas", "add", "Asia", "--parent", "Orient"])
+    with pytest.raises(SystemExit):
+        main(["--db", db_file, "areas", "assign", "Mountains", "Europe"])
+
+
+def test_upgrades_a_database_with_the_original_schema(tmp_path, capsys):
+    path = str(tmp_path / "original.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE topics (id integer PRIMARY KEY, name text NOT NULL UNIQUE);
+        CREATE TABLE concepts (id integer PRIMARY KEY, topic_id integer NOT NULL, content text NOT NULL);
+        CREATE TABLE recall_sessions (id integer PRIMARY KEY, concept_id integer NOT NULL, timestamp text NOT NULL,
+                                      user_response text, ai_grade real);
+        CREATE TABLE learning_data (id integer PRIMARY KEY, concept_id integer NOT NULL UNIQUE,
+                                    difficulty real NOT NULL, stability real NOT NULL);
+        CREATE TABLE knowledge_areas (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE learning_techniques (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE concept_learning_progress (id INTEGER PRIMARY KEY, concept_id INTEGER NOT NULL,
+                                                technique_id INTEGER NOT NULL,
+                                                applications_count INTEGER NOT NULL DEFAULT 0,
+                                                last_applied_timestamp TEXT);
+        INSERT INTO learning_techniques (name) VALUES ('Recall'), ('Elaboration'), ('Visualization');
+        INSERT INTO topics (name) VALUES ('Capitals');
+        INSERT INTO concepts (topic_id, content) VALUES (1, 'Paris is the capital of France');
+        INSERT INTO recall_sessions (concept_id, timestamp, user_response, ai_grade)
+            VALUES (1, '2024-01-01T09:00:00', 'Paris', 3);
+        INSERT INTO learning_data (concept_id, difficulty, stability) VALUES (1, 5.0, 3.0);
+    """)
+    conn.close()
+    capsys.readouterr()
+
+    with clock.use_clock(VirtualClock(START + datetime.timedelta(days=1))):
+        main(["--db", path, "mastery"])
+    (mastery,) = _json_lines(capsys.readouterr().out)
+    assert mastery["topic"] == "Capitals" and 0 < mastery["mastery"] < 1
+
+    main(["--db", path, "export", "concepts"])
+    assert [row["content"] for row in _json_lines(capsys.readouterr().out)] == ["Paris is the capital of France"]
+    main(["--db", path, "export", "sessions"])
+    assert _json_lines(capsys.readouterr().out)[0]["user_response"] == "Paris"
+
+    main(["--db", path, "plans"])
+    main(["--db", path, "archive", "--older-than", "0"])
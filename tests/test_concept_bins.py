@@ -0,0 +1,88 @@
+import random
+import datetime
+import numpy as np
+import pytest
+
+from database import add_topic, add_concepts, initialize_learning_data
+from concept_bins import bin_concepts
+from fsrs import FSRS, default_params
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def deck(make_db):
+    """
+    Two topics of reviewed concepts, one new concept, and the expected
+    (topic_id, retrievability, stability) of every reviewed concept.
+    """
+    conn = make_db()
+    rng = random.Random(1)
+    fsrs = FSRS(default_params)
+    expected = []
+    for name in ("Biology", "Chemistry"):
+        topic_id = add_topic(conn, name)
+        concept_ids = add_concepts(conn, topic_id, [f"{name} concept {i}" for i in range(300)])
+        for concept_id in concept_ids:
+            stability = round(rng.uniform(0.5, 400), 3)
+            days_ago = rng.randint(0, 200)
+            initialize_learning_data(conn, concept_id, 5, stability)
+            conn.execute("INSERT INTO recall_sessions (concept_id, timestamp, ai_grade) VALUES (?, ?, 3)",
+                         (concept_id, (NOW - datetime.timedelta(days=days_ago)).isoformat()))
+            expected.append((topic_id, fsrs.retrievability(days_ago, stability), stability))
+    add_concepts(conn, topic_id, ["Never reviewed"])
+    conn.commit()
+    return conn, np.array(expected)
+
+
+def expected_counts(expected, column, edges, scale=lambda x: x):
+    return np.array([np.histogram(scale(expected[expected[:, 0] == topic_id, column]), bins=scale(edges))[0]
+                     for topic_id in np.unique(expected[:, 0])])
+
+
+def test_retrievability_bins(deck):
+    conn, expected = deck
+    topics, edges, counts = bin_concepts(conn, "retrievability", bins=10, now=NOW)
+
+    assert [name for _, name in topics] == ["Biology", "Chemistry"]
+    assert counts.shape == (2, 10)
+    assert np.allclose(edges, np.linspace(0, 1, 11))
+    # Every reviewed concept is counted once, the new one not at all
+    assert counts.sum() == len(expected)
+    assert np.array_equal(counts, expected_counts(expected, 1, edges))
+
+
+def test_stability_bins_on_log_scale(deck):
+    conn, expected = deck
+    topics, edges, counts = bin_concepts(conn, "stability", bins=16, now=NOW)
+
+    assert edges[0] == pytest.approx(expected[:, 2].min())
+    assert edges[-1] == pytest.approx(expected[:, 2].max())
+    assert np.allclose(np.diff(np.log(edges)), np.log(edges[1] / edges[0]))
+    assert counts.sum() == len(expected)
+    assert np.array_equal(counts, expected_counts(expected, 2, edges, np.log))
+
+
+def test_zoomed_range_is_rebinned(deck):
+    conn, expected = deck
+    topics, edges, counts = bin_concepts(conn, "retrievability", bins=20, value_range=(0.8, 0.9), now=NOW)
+
+    # The whole resolution goes to the visible range; the rest is left out
+    assert edges[0] == pytest.approx(0.8) and edges[-1] == pytest.approx(0.9)
+    visible = (expected[:, 1] >= 0.8) & (expected[:, 1] <= 0.9)
+    assert counts.sum() == visible.sum()
+    assert np.array_equal(counts, expected_counts(expected, 1, edges))
+
+    chemistry, _, counts = bin_concepts(conn, "stability", value_range=(10, 100), topic_ids=[topics[1][0]])
+    assert [name for _, name in chemistry] == ["Chemistry"]
+    assert counts.shape == (1, 20)
+
+
+def test_invalid_arguments(deck):
+    conn, _ = deck
+    with pytest.raises(ValueError):
+        bin_concepts(conn, "difficulty")
+    with pytest.raises(ValueError):
+        bin_concepts(conn, "stability", value_range=(0, 10))
+    topics, _, counts = bin_concepts(conn, topic_ids=[])
+    assert topics == [] and counts.shape == (0, 20)
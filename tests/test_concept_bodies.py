@@ -0,0 +1,124 @@
+import pytest
+
+from database import (create_connection, main as create_db, add_topic, add_concept, add_concepts,
+                      get_concepts_for_topic, get_next_concept_to_review)
+from concept_bodies import (INLINE_CONTENT_CHARS, PREVIEW_CHARS, ConceptBodyCache, get_concept_body,
+                            preview, move_long_content)
+from dedupe import BANDS, find_near_duplicates
+from sync import get_device_id, export_changes, import_changes
+
+SHORT = "Water is H2O"
+MEDIUM = "Photosynthesis " + "converts light into chemical energy in chloroplasts. " * 8
+LONG = "Reference: " + " ".join(f"paragraph {i} of the pasted lecture notes." for i in range(200))
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "learning.db")
+    create_db(path)
+    return path
+
+
+def test_long_content_stored_out_of_line(db_file):
+    conn = create_connection(db_file)
+    topic_id = add_topic(conn, "Biology")
+    short_id = add_concept(conn, topic_id, SHORT)
+    medium_id, long_id = add_concepts(conn, topic_id, [MEDIUM, LONG])
+
+    # Lists and scheduling only see the previews
+    listed = {concept_id: content for concept_id, _, content in get_concepts_for_topic(conn, topic_id)}
+    assert listed[short_id] == SHORT
+    assert listed[long_id] == preview(LONG) and len(listed[long_id]) == PREVIEW_CHARS + 1
+    assert get_next_concept_to_review(conn)[2] == SHORT
+
+    rows = dict(conn.execute("SELECT concept_id, compressed FROM concept_bodies").fetchall())
+    assert rows == {medium_id: 0, long_id: 1}
+
+    cache = ConceptBodyCache(conn, maxsize=2)
+    assert [cache.get(concept_id) for concept_id in (short_id, medium_id, long_id, long_id)] == [SHORT, MEDIUM, LONG, LONG]
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert list(cache.bodies) == [medium_id, long_id]
+    assert cache.get(9999) is None
+
+    # The near-duplicate index sees the full text
+    assert find_near_duplicates(conn, content=LONG)[0][0] == long_id
+
+    conn.execute("DELETE FROM concepts WHERE id = ?", (long_id,))
+    assert conn.execute("SELECT COUNT(*) FROM concept_bodies WHERE concept_id = ?", (long_id,)).fetchone()[0] == 0
+    conn.close()
+
+
+def test_existing_inline_content_is_moved(db_file):
+    conn = create_connection(db_file)
+    conn.execute("INSERT INTO topics (id, name) VALUES (1, 'Notes')")
+    conn.execute("INSERT INTO concepts (id, topic_id, content) VALUES (1, 1, ?), (2, 1, ?)", (LONG, SHORT))
+    # As written by a version from before concept bodies
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+    conn.close()
+
+    # Opening the database with create_db moves long texts out of line
+    create_db(db_file)
+    conn = create_connection(db_file)
+    assert conn.execute("SELECT MAX(length(content)) FROM concepts").fetchone()[0] <= INLINE_CONTENT_CHARS
+    assert get_concept_body(conn, 1) == LONG
+    assert move_long_content(conn) == 0
+
+    # Once per database: a current one is not scanned again
+    conn.execute("INSERT INTO concepts (id, topic_id, content) VALUES (3, 1, ?)", (LONG,))
+    conn.commit()
+    conn.close()
+    create_db(db_file)
+    conn = create_connection(db_file)
+    assert conn.execute("SELECT length(content) FROM concepts WHERE id = 3").fetchone()[0] == len(LONG)
+    conn.close()
+
+
+def test_bodies_are_synced(tmp_path):
+    create_db(str(tmp_path / "laptop.db"))
+    create_db(str(tmp_path / "desktop.db"))
+    laptop = create_connection(str(tmp_path / "laptop.db"))
+    desktop = create_connection(str(tmp_path / "desktop.db"))
+
+    add_concepts(laptop, add_topic(laptop, "Notes"), [MEDIUM, LONG])
+    export_changes(laptop, tmp_path / "1.sync", get_device_id(desktop))
+    import_changes(desktop, tmp_path / "1.sync")
+
+    bodies = [get_concept_body(desktop, concept_id)
+              for (concept_id,) in desktop.execute("SELECT id FROM concepts ORDER BY id")]
+    assert bodies == [MEDIUM, LONG]
+    laptop.close()
+    desktop.close()
+
+
+def test_long_concepts_sharing_a_preview_stay_apart(tmp_path):
+    create_db(str(tmp_path / "laptop.db"))
+    create_db(str(tmp_path / "desktop.db"))
+    laptop = create_connection(str(tmp_path / "laptop.db"))
+    desktop = create_connection(str(tmp_path / "desktop.db"))
+    first, second = LONG + " The first ending.", LONG + " The second ending."
+    assert preview(first) == preview(second)
+
+    first_id, second_id = add_concepts(laptop, add_topic(laptop, "Notes"), [first, second])
+    export_changes(laptop, tmp_path / "1.sync", get_device_id(desktop))
+    import_changes(desktop, tmp_path / "1.sync")
+
+    def bodies(conn):
+        return sorted(get_concept_body(conn, concept_id) for (concept_id,) in conn.execute("SELECT id FROM concepts"))
+
+    assert bodies(desktop) == [first, second]
+    # Indexed once, under the full text
+    assert desktop.execute("SELECT COUNT(*) FROM concept_lsh_buckets").fetchone()[0] == 2 * BANDS
+
+    # Deletes and reviews reach the right one of the two
+    from review import record_review
+    record_review(laptop, second_id, "response", 3)
+    laptop.execute("DELETE FROM concepts WHERE id = ?", (first_id,))
+    laptop.commit()
+    export_changes(laptop, tmp_path / "2.sync", get_device_id(desktop))
+    import_changes(desktop, tmp_path / "2.sync")
+    assert bodies(desktop) == [second]
+    (reviewed,) = desktop.execute("SELECT concept_id FROM recall_sessions").fetchone()
+    assert get_concept_body(desktop, reviewed) == second
+    laptop.close()
+    desktop.close()
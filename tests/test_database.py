@@ -1,37 +1,54 @@
 import sqlite3
 import os
-import sys
 import pytest
 
-# Add the src directory to the Python path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
-
-from database import create_connection, main as create_db, add_topic, get_all_topics, add_concept, get_concepts_for_topic
-
-DB_FILE = "data/learning_data.db"
+from database import (main as create_db, clone_schema, init_schema, add_topic, get_all_topics, add_concept, get_concepts_for_topic,
+                      get_topic_mastery, compute_topic_mastery, get_all_topics_with_mastery, initialize_learning_data)
+from review import record_review
 
 @pytest.fixture(scope="module")
 def db_connection():
-    # Set up: create the database and tables
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
+    conn = clone_schema()
+    yield conn
+    conn.close()
 
-    create_db()
+def test_database_file_creation(tmp_path):
+    db_file = str(tmp_path / "data" / "learning_data.db")
+    create_db(db_file)
+    assert os.path.exists(db_file)
 
-    conn = create_connection(DB_FILE)
-    yield conn
+def test_init_schema_on_any_connection(db_connection):
+    conn = sqlite3.connect(":memory:")
+    init_schema(conn)
+    schema = "SELECT type, name FROM sqlite_master ORDER BY type, name"
+    assert conn.execute(schema).fetchall() == db_connection.execute(schema).fetchall()
+    conn.close()
 
-    # Tear down: close the connection and remove the database file
+def test_init_schema_upgrades_baseline_database():
+    # The schema of databases created before the near-duplicate index and the mastery cache
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE topics (id integer PRIMARY KEY, name text NOT NULL UNIQUE)")
+    conn.execute("CREATE TABLE concepts (id integer PRIMARY KEY, topic_id integer NOT NULL, content text NOT NULL)")
+    conn.execute("""CREATE TABLE recall_sessions (id integer PRIMARY KEY, concept_id integer NOT NULL,
+                    timestamp text NOT NULL, user_response text, ai_grade real)""")
+    conn.execute("""CREATE TABLE learning_data (id integer PRIMARY KEY, concept_id integer NOT NULL UNIQUE,
+                    difficulty real NOT NULL, stability real NOT NULL)""")
+    conn.execute("INSERT INTO topics (id, name) VALUES (1, 'Biology')")
+    conn.commit()
+
+    init_schema(conn)
+    assert add_concept(conn, 1, "Cells are the basic unit of life") is not None
+    assert get_all_topics_with_mastery(conn) == [(1, "Biology", 0.0)]
     conn.close()
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
 
-def test_database_file_creation():
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
-    create_db()
-    assert os.path.exists(DB_FILE)
-    os.remove(DB_FILE)
+def test_clones_are_independent(make_db, tmp_path):
+    from sync import get_device_id
+
+    first, second = make_db(), make_db("second.db")
+    add_topic(first, "Only in the first")
+    assert get_all_topics(second) == []
+    assert get_device_id(first) != get_device_id(second)
+    assert (tmp_path / "second.db").exists()
 
 def test_database_connection(db_connection):
     assert db_connection is not None
@@ -42,7 +59,12 @@ def test_tables_creation(db_connection):
     tables = sorted([row[0] for row in cursor.fetchall()])
 
     expected_tables = sorted(['topics', 'concepts', 'recall_sessions', 'learning_data',
-                              'knowledge_areas', 'learning_techniques', 'concept_learning_progress'])
+                              'knowledge_areas', 'knowledge_area_closure', 'topic_areas',
+                              'learning_techniques', 'concept_learning_progress',
+                              'concept_minhash', 'concept_lsh_buckets', 'topic_mastery_cache',
+                              'topic_mastery_history', 'mastery_history_state', 'mastery_history_cursor',
+                              'response_archive', 'change_log', 'sqlite_sequence', 'sync_device',
+                              'sync_peers', 'sync_apply_origin', 'concept_bodies'])
 
     assert tables == expected_tables
 
@@ -142,3 +164,67 @@ def test_get_concepts_for_topic(db_connection):
 
     retrieved_concept_contents = sorted([row[2] for row in retrieved_concepts])
     assert retrieved_concept_contents == sorted(concepts)
+
+def cached_mastery_topics(conn):
+    return [row[0] for row in conn.execute("SELECT topic_id FROM topic_mastery_cache ORDER BY topic_id")]
+
+def test_topic_mastery_cache(db_connection):
+    cursor = db_connection.cursor()
+    cursor.execute("DELETE FROM topic_mastery_cache")
+    db_connection.commit()
+
+    t1 = add_topic(db_connection, "Cached Topic 1")
+    t2 = add_topic(db_connection, "Cached Topic 2")
+    c1 = add_concept(db_connection, t1, "Cached concept 1")
+    c2 = add_concept(db_connection, t2, "Cached concept 2")
+    record_review(db_connection, c1, "response", 3)
+    record_review(db_connection, c2, "response", 3)
+
+    mastery = get_topic_mastery(db_connection, t1)
+    assert mastery == compute_topic_mastery(db_connection, t1)
+    get_all_topics_with_mastery(db_connection)
+    assert {t1, t2} <= set(cached_mastery_topics(db_connection))
+
+    # A review of a concept in topic 1 only invalidates topic 1
+    record_review(db_connection, c1, "response", 1)
+    cached = cached_mastery_topics(db_connection)
+    assert t1 not in cached
+    assert t2 in cached
+
+    assert get_topic_mastery(db_connection, t1) == compute_topic_mastery(db_connection, t1)
+    assert t1 in cached_mastery_topics(db_connection)
+
+def test_cached_mastery_expires_when_a_day_has_elapsed(make_db):
+    import datetime
+    from clock import VirtualClock, use_clock
+
+    conn = make_db()
+    topic_id = add_topic(conn, "Evening reviews")
+    concept_id = add_concept(conn, topic_id, "Reviewed at 10:00")
+    clock = VirtualClock(datetime.datetime(2024, 1, 1, 10, 0))
+    with use_clock(clock):
+        record_review(conn, concept_id, "response", 3)
+        # Stability 1 leaves a retrievability of exactly 0.9 after one day
+        conn.execute("UPDATE learning_data SET stability = 1.0 WHERE concept_id = ?", (concept_id,))
+        conn.commit()
+
+        clock.set(datetime.datetime(2024, 1, 2, 8, 0))
+        assert get_topic_mastery(conn, topic_id) == 1.0
+        # One whole day since the review has now elapsed
+        clock.set(datetime.datetime(2024, 1, 2, 12, 0))
+        assert get_topic_mastery(conn, topic_id) == compute_topic_mastery(conn, topic_id) == pytest.approx(0.9)
+        assert get_all_topics_with_mastery(conn) == [(topic_id, "Evening reviews", pytest.approx(0.9))]
+
+def test_mastery_cache_write_joins_the_callers_transaction(make_db):
+    conn = make_db()
+    topic_id = add_topic(conn, "Uncommitted")
+    conn.execute("INSERT INTO concepts (topic_id, content) VALUES (?, 'Pending')", (topic_id,))
+    assert conn.in_transaction
+
+    get_all_topics_with_mastery(conn)
+    get_topic_mastery(conn, topic_id)
+    # Reading mastery does not commit the caller's insert
+    assert conn.in_transaction
+    conn.rollback()
+    assert get_concepts_for_topic(conn, topic_id) == []
+    assert cached_mastery_topics(conn) == []
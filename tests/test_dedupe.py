@@ -0,0 +1,82 @@
+from database import add_topic, add_concept, add_concepts, init_schema
+from dedupe import (BANDS, find_near_duplicates, dedupe_report, rebuild_index, index_concept, index_concepts, minhash,
+                    similarity)
+
+
+def test_minhash_similarity():
+    a = minhash("The mitochondria is the powerhouse of the cell")
+    b = minhash("the mitochondria is the powerhouse of the cell!")
+    c = minhash("Photosynthesis converts light into chemical energy")
+    assert similarity(a, b) == 1.0
+    assert similarity(a, c) < 0.3
+
+
+def test_add_concept_maintains_index(db_conn):
+    topic_id = add_topic(db_conn, "Biology")
+    original = add_concept(db_conn, topic_id, "The mitochondria is the powerhouse of the cell")
+    add_concept(db_conn, topic_id, "Photosynthesis converts light into chemical energy")
+
+    matches = find_near_duplicates(db_conn, content="The mitochondria is the powerhouse of a cell")
+    assert [match[0] for match in matches] == [original]
+    assert matches[0][1] >= 0.8
+
+    # Looking up an indexed concept does not report the concept itself
+    assert find_near_duplicates(db_conn, concept_id=original) == []
+
+
+def test_bulk_load_and_dedupe_report(db_conn):
+    topic_id = add_topic(db_conn, "History")
+    ids = add_concepts(db_conn, topic_id, [
+        "The French Revolution began in 1789",
+        "Napoleon was crowned emperor in 1804",
+        "The French Revolution began in 1789.",
+        "the french revolution began in 1789",
+        "Napoleon was crowned Emperor in 1804!",
+        "The Congress of Vienna met in 1815",
+    ])
+    assert len(ids) == 6
+
+    assert dedupe_report(db_conn) == [[ids[0], ids[2], ids[3]], [ids[1], ids[4]]]
+
+
+def test_rebuild_index(db_conn):
+    topic_id = add_topic(db_conn, "Topic")
+    db_conn.executemany("INSERT INTO concepts (topic_id, content) VALUES (?, ?)",
+                        [(topic_id, "Water boils at 100 degrees"), (topic_id, "Water boils at 100 degrees.")])
+    db_conn.commit()
+    assert dedupe_report(db_conn) == []
+
+    assert rebuild_index(db_conn) == 2
+    assert dedupe_report(db_conn) == [[1, 2]]
+
+
+def test_upgrade_indexes_existing_concepts(db_conn):
+    topic_id = add_topic(db_conn, "Topic")
+    add_concepts(db_conn, topic_id, ["Water boils at 100 degrees", "Water boils at 100 degrees."])
+    # A database from before the index existed
+    db_conn.execute("DROP TABLE concept_minhash")
+    db_conn.execute("DROP TABLE concept_lsh_buckets")
+    db_conn.commit()
+
+    init_schema(db_conn)
+    assert dedupe_report(db_conn) == [[1, 2]]
+
+    # Later opens leave the index alone
+    db_conn.execute("DELETE FROM concept_lsh_buckets")
+    db_conn.commit()
+    init_schema(db_conn)
+    assert dedupe_report(db_conn) == []
+
+
+def test_reindexing_replaces_buckets(db_conn):
+    topic_id = add_topic(db_conn, "Topic")
+    concept_id = add_concept(db_conn, topic_id, "Water boils at 100 degrees")
+    other = add_concept(db_conn, topic_id, "Ice melts at 0 degrees")
+
+    index_concept(db_conn, concept_id, "Photosynthesis converts light into chemical energy")
+    # Listed twice, the last text wins
+    index_concepts(db_conn, [(other, "Water boils at 100 degrees"), (other, "Ice melts at 0 degrees")])
+
+    buckets = dict(db_conn.execute("SELECT concept_id, COUNT(*) FROM concept_lsh_buckets GROUP BY concept_id"))
+    assert buckets == {concept_id: BANDS, other: BANDS}
+    assert find_near_duplicates(db_conn, content="Water boils at 100 degrees") == []
@@ -0,0 +1,55 @@
+import datetime
+import pytest
+
+from database import add_topic, add_concept, initialize_learning_data
+from forecast import forecast_reviews
+from fsrs import FSRS, default_params
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def add_reviewed_concept(conn, topic_id, stability, days_ago):
+    concept_id = add_concept(conn, topic_id, f"Concept {stability} {days_ago}")
+    initialize_learning_data(conn, concept_id, 5, stability)
+    timestamp = (NOW - datetime.timedelta(days=days_ago)).isoformat()
+    conn.execute("INSERT INTO recall_sessions(concept_id, timestamp, ai_grade) VALUES (?,?,3)", (concept_id, timestamp))
+    conn.commit()
+    return concept_id
+
+
+def test_next_interval_inverts_retrievability():
+    fsrs = FSRS(default_params)
+    interval = fsrs.next_interval(10, 0.9)
+    assert fsrs.retrievability(interval, 10) == pytest.approx(0.9)
+
+
+def test_forecast_without_simulation(db_conn):
+    t1 = add_topic(db_conn, "Topic 1")
+    t2 = add_topic(db_conn, "Topic 2")
+    add_reviewed_concept(db_conn, t1, stability=10, days_ago=3)   # due in 7 days
+    add_reviewed_concept(db_conn, t1, stability=5, days_ago=20)   # overdue
+    add_reviewed_concept(db_conn, t2, stability=100, days_ago=0)  # beyond the horizon
+
+    topics, counts = forecast_reviews(db_conn, horizon_days=30, simulate=False, now=NOW)
+
+    assert [t[1] for t in topics] == ["Topic 1", "Topic 2"]
+    assert counts.shape == (2, 30)
+    assert counts[0, 0] == 1
+    assert counts[0, 7] == 1
+    assert counts[0].sum() == 2
+    assert counts[1].sum() == 0
+
+
+def test_forecast_simulates_follow_up_reviews(db_conn):
+    topic_id = add_topic(db_conn, "Topic")
+    add_reviewed_concept(db_conn, topic_id, stability=2, days_ago=0)
+
+    _, single = forecast_reviews(db_conn, horizon_days=365, simulate=False, now=NOW)
+    _, simulated = forecast_reviews(db_conn, horizon_days=365, simulate=True, now=NOW)
+
+    assert single.sum() == 1
+    assert simulated.sum() > 1
+    # Intervals grow after each successful review
+    due_days = simulated[0].nonzero()[0]
+    gaps = due_days[1:] - due_days[:-1]
+    assert all(later >= earlier for earlier, later in zip(gaps, gaps[1:]))
@@ -0,0 +1,75 @@
+import datetime
+
+from database import add_topic, add_concept
+from grading import to_fsrs_grade, grade_response
+from grading_pipeline import GradingPipeline, regrade_history, DEFAULT_GRADE
+from review import record_review
+
+
+def failing_grader(user_response, correct_answer):
+    raise ValueError("grader unavailable")
+
+
+def test_to_fsrs_grade():
+    assert to_fsrs_grade(0.0) == 1
+    assert to_fsrs_grade(0.5) == 2
+    assert to_fsrs_grade(0.75) == 3
+    assert to_fsrs_grade(1.0) == 4
+    assert grade_response("the cat sat on the mat", "the cat sat on the mat") == 4
+
+
+def test_record_review_initializes_then_updates(db_conn):
+    topic_id = add_topic(db_conn, "Topic")
+    concept_id = add_concept(db_conn, topic_id, "Concept")
+    start = datetime.datetime(2024, 1, 1)
+
+    d0, s0, is_new = record_review(db_conn, concept_id, "first", 3, technique="Recall", timestamp=start)
+    assert is_new
+    d1, s1, is_new = record_review(db_conn, concept_id, "second", 3, technique="Recall",
+                                   timestamp=start + datetime.timedelta(days=5))
+    assert not is_new
+    assert s1 > s0
+
+    assert db_conn.execute("SELECT COUNT(*) FROM recall_sessions").fetchone()[0] == 2
+    assert db_conn.execute("SELECT stability FROM learning_data WHERE concept_id = ?", (concept_id,)).fetchone()[0] == s1
+    assert db_conn.execute("SELECT applications_count FROM concept_learning_progress").fetchone()[0] == 2
+
+
+def test_grading_pipeline_grades_in_background():
+    pipeline = GradingPipeline(max_workers=2)
+    pipeline.submit(1, "the cat sat on the mat", "the cat sat on the mat", technique="Recall")
+    pipeline.submit(2, "nothing", "the cat sat on the mat")
+    assert pipeline.pending_concept_ids() == {1, 2}
+
+    pipeline.shutdown(wait=True)
+    graded = {result.concept_id: result for result in pipeline.drain()}
+
+    assert graded[1].grade == 4
+    assert graded[1].technique == "Recall"
+    assert graded[2].grade == 1
+    assert pipeline.pending_concept_ids() == set()
+
+
+def test_grading_pipeline_falls_back_on_grader_errors():
+    pipeline = GradingPipeline(grader=failing_grader)
+    pipeline.submit(1, "response", "answer")
+    pipeline.shutdown(wait=True)
+
+    (result,) = pipeline.drain()
+    assert result.grade == DEFAULT_GRADE
+    assert isinstance(result.error, ValueError)
+
+
+def test_regrade_history(db_conn):
+    topic_id = add_topic(db_conn, "Topic")
+    concept_id = add_concept(db_conn, topic_id, "the cat sat on the mat")
+    responses = ["the cat sat on the mat", "the cat", "dog", None]
+    for response in responses:
+        db_conn.execute("INSERT INTO recall_sessions(concept_id, timestamp, user_response, ai_grade) VALUES (?, '2024-01-01', ?, 3)",
+                        (concept_id, response))
+    db_conn.commit()
+
+    assert regrade_history(db_conn, chunk_size=2, max_workers=2) == 3
+
+    grades = [row[0] for row in db_conn.execute("SELECT ai_grade FROM recall_sessions ORDER BY id")]
+    assert grades == [4, 2, 1, 3]
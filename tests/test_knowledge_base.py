@@ -1,39 +1,23 @@
 import sqlite3
+import datetime
 import pytest
-from src.database import create_table
-from src.knowledge_base import allocate_technique, create_knowledge_tables
+
+from knowledge_base import (allocate_technique, create_knowledge_tables, add_knowledge_area,
+                            assign_topic_to_area, get_child_areas, get_area_rollups, get_area_topic_rollups,
+                            get_technique_id_by_name, update_concept_learning_progress,
+                            update_concept_learning_progress_many)
+from fsrs import FSRS, default_params
+from clock import VirtualClock, use_clock
 
 @pytest.fixture
-def db_conn():
+def db_conn(make_db):
     """Fixture to set up an in-memory SQLite database for tests."""
-    conn = sqlite3.connect(":memory:")
-
-    # Create tables from the main schema
-    sql_create_concepts_table = """CREATE TABLE IF NOT EXISTS concepts (
-                                    id integer PRIMARY KEY,
-                                    topic_id integer NOT NULL,
-                                    content text NOT NULL
-                                );"""
-    sql_create_recall_sessions_table = """CREATE TABLE IF NOT EXISTS recall_sessions (
-                                            id integer PRIMARY KEY,
-                                            concept_id integer NOT NULL,
-                                            timestamp text NOT NULL,
-                                            user_response text,
-                                            ai_grade real,
-                                            FOREIGN KEY (concept_id) REFERENCES concepts (id)
-                                        );"""
-    create_table(conn, sql_create_concepts_table)
-    create_table(conn, sql_create_recall_sessions_table)
-
-    # Create tables from the knowledge base schema
-    create_knowledge_tables(conn)
+    conn = make_db()
 
     # Add a dummy concept
     conn.execute("INSERT INTO concepts (id, topic_id, content) VALUES (1, 1, 'Test Concept')")
     conn.commit()
-
-    yield conn
-    conn.close()
+    return conn
 
 def test_allocate_technique_no_history(db_conn):
     """Test that 'Recall' is allocated for a concept with no history."""
@@ -73,3 +57,118 @@ def test_allocate_technique_mixed_history(db_conn):
 
     technique = allocate_technique(db_conn, 1)
     assert technique == "Elaboration"
+
+
+@pytest.fixture
+def area_conn(db_conn):
+    """Start the knowledge base fixture without concepts."""
+    db_conn.execute("DELETE FROM concepts")
+    db_conn.commit()
+    return db_conn
+
+def test_knowledge_area_tree(area_conn):
+    science = add_knowledge_area(area_conn, "Science")
+    biology = add_knowledge_area(area_conn, "Biology", parent_id=science)
+    genetics = add_knowledge_area(area_conn, "Genetics", parent_id=biology)
+    add_knowledge_area(area_conn, "History")
+
+    # An unknown parent is an error, not a new root area
+    with pytest.raises(ValueError):
+        add_knowledge_area(area_conn, "Orphan", parent_id=genetics + 100)
+    with pytest.raises(ValueError):
+        assign_topic_to_area(area_conn, 999, science)
+
+    assert [name for _, name in get_child_areas(area_conn)] == ["History", "Science"]
+    assert get_child_areas(area_conn, science) == [(biology, "Biology")]
+
+    depths = area_conn.execute("""
+        SELECT ancestor_id, depth FROM knowledge_area_closure WHERE descendant_id = ? ORDER BY depth
+    """, (genetics,)).fetchall()
+    assert depths == [(genetics, 0), (biology, 1), (science, 2)]
+
+def test_area_rollups(area_conn):
+    now = datetime.datetime(2024, 1, 31)
+    science = add_knowledge_area(area_conn, "Science")
+    biology = add_knowledge_area(area_conn, "Biology", parent_id=science)
+    chemistry = add_knowledge_area(area_conn, "Chemistry", parent_id=science)
+
+    area_conn.execute("INSERT INTO topics (id, name) VALUES (1, 'Cells'), (2, 'Atoms')")
+    assign_topic_to_area(area_conn, 1, biology)
+    assign_topic_to_area(area_conn, 2, chemistry)
+    # Cells: two reviewed concepts, one of them due. Atoms: one reviewed, one new.
+    area_conn.execute("""INSERT INTO concepts (id, topic_id, content) VALUES
+                         (1, 1, 'a'), (2, 1, 'b'), (3, 2, 'c'), (4, 2, 'd')""")
+    area_conn.execute("INSERT INTO learning_data (concept_id, difficulty, stability) VALUES (1, 5, 10), (2, 5, 10), (3, 5, 40)")
+    area_conn.execute("""INSERT INTO recall_sessions (concept_id, timestamp, ai_grade) VALUES
+                         (1, '2024-01-01T00:00:00', 3), (1, '2024-01-29T00:00:00', 3),
+                         (2, '2024-01-11T00:00:00', 3), (3, '2024-01-21T00:00:00', 3)""")
+    area_conn.commit()
+
+    fsrs = FSRS(default_params)
+    r1, r2, r3 = fsrs.retrievability(2, 10), fsrs.retrievability(20, 10), fsrs.retrievability(10, 40)
+
+    with use_clock(VirtualClock(now)):
+        (root,) = get_area_rollups(area_conn)
+        children = get_area_rollups(area_conn, science)
+        topics = get_area_topic_rollups(area_conn, biology)
+
+    assert root[:4] == (science, "Science", 4, 3)
+    assert root[4] == pytest.approx((r1 + r2 + r3) / 3)
+    assert root[5] == 1
+
+    assert [row[:4] for row in children] == [(biology, "Biology", 2, 2), (chemistry, "Chemistry", 2, 1)]
+    assert children[1][4] == pytest.approx(r3)
+    assert topics[0][:4] == (1, "Cells", 2, 2)
+    assert topics[0][4] == pytest.approx((r1 + r2) / 2)
+    assert topics[0][5] == 1
+
+
+def test_progress_upsert(db_conn):
+    """Each application is one upsert on the (concept, technique) row."""
+    recall = get_technique_id_by_name(db_conn, "Recall")
+    assert recall == 1
+    assert get_technique_id_by_name(db_conn, "Unknown") is None
+
+    update_concept_learning_progress(db_conn, 1, recall, timestamp=datetime.datetime(2024, 1, 1))
+    update_concept_learning_progress(db_conn, 1, recall, timestamp=datetime.datetime(2024, 1, 2))
+    counted = update_concept_learning_progress_many(db_conn, [
+        (1, "Recall", datetime.datetime(2024, 1, 3)),
+        (1, "Elaboration", datetime.datetime(2024, 1, 3)),
+        (1, "Unknown", datetime.datetime(2024, 1, 3)),
+    ])
+    assert counted == 2
+
+    rows = db_conn.execute("""SELECT technique_id, applications_count, last_applied_timestamp
+                              FROM concept_learning_progress ORDER BY technique_id""").fetchall()
+    assert rows == [(1, 3, "2024-01-03T00:00:00"), (2, 1, "2024-01-03T00:00:00")]
+
+
+def test_custom_techniques_resolve_per_database(make_db):
+    """Custom techniques get different ids in different decks."""
+    first, second = make_db(), make_db()
+    first.execute("INSERT INTO learning_techniques (name) VALUES ('Mnemonic')")
+    second.execute("INSERT INTO learning_techniques (name) VALUES ('Interleaving'), ('Mnemonic')")
+
+    assert get_technique_id_by_name(first, "Mnemonic") == 4
+    assert get_technique_id_by_name(second, "Mnemonic") == 5
+    assert get_technique_id_by_name(second, "Interleaving") == 4
+    assert get_technique_id_by_name(first, "Interleaving") is None
+    assert get_technique_id_by_name(second, "Elaboration") == 2
+
+
+def test_duplicate_progress_merged_before_unique_index():
+    """Databases with duplicate progress rows are folded into one row per pair."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""CREATE TABLE concept_learning_progress (
+                        id INTEGER PRIMARY KEY, concept_id INTEGER NOT NULL, technique_id INTEGER NOT NULL,
+                        applications_count INTEGER NOT NULL DEFAULT 0, last_applied_timestamp TEXT)""")
+    conn.execute("""INSERT INTO concept_learning_progress (concept_id, technique_id, applications_count, last_applied_timestamp)
+                    VALUES (1, 1, 2, '2024-01-01'), (1, 1, 3, '2024-02-01'), (1, 2, 1, '2024-01-05')""")
+    create_knowledge_tables(conn)
+
+    rows = conn.execute("""SELECT concept_id, technique_id, applications_count, last_applied_timestamp
+                           FROM concept_learning_progress ORDER BY id""").fetchall()
+    assert rows == [(1, 1, 5, "2024-02-01"), (1, 2, 1, "2024-01-05")]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO concept_learning_progress (concept_id, technique_id) VALUES (1, 1)")
+    conn.close()
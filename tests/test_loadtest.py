@@ -0,0 +1,41 @@
+import sqlite3
+import pytest
+
+from loadtest import generate_database, run_load_test
+
+
+@pytest.fixture(scope="module")
+def db_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("loadtest") / "deck.db")
+    generate_database(path, topics=3, concepts_per_topic=30)
+    return path
+
+
+def test_threads_report_throughput_and_latency(db_file):
+    report = run_load_test(db_file, workers=3, duration=0.3, journal_mode="wal")
+    assert report["journal_mode"] == "wal"
+    assert report["per_second"] > 0
+    for name, stats in report["operations"].items():
+        assert stats["count"] > 0, name
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+        assert stats["locked_errors"] == stats["other_errors"] == 0
+    assert report["lock_wait_max_ms"] is not None
+
+
+def test_locked_errors_are_counted(db_file):
+    # Another connection holds the write lock for the whole run
+    blocker = sqlite3.connect(db_file)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        report = run_load_test(db_file, workers=1, duration=0.2, mix={"submit": 1}, journal_mode=None,
+                               busy_timeout_ms=0)
+    finally:
+        blocker.rollback()
+        blocker.close()
+    submit = report["operations"]["submit"]
+    assert submit["count"] == 0 and submit["locked_errors"] > 0
+
+
+def test_unknown_operation(db_file):
+    with pytest.raises(ValueError):
+        run_load_test(db_file, duration=0.1, mix={"delete_everything": 1})
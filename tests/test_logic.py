@@ -1,16 +1,10 @@
 import pytest
-import os
-import sys
 import datetime
 
-# Add the src directory to the Python path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
-
 from fsrs import FSRS, default_params
 from grading import rule_based_grade
 from database import (
-    create_connection,
-    main as create_db,
+    clone_schema,
     add_topic,
     add_concept,
     initialize_learning_data,
@@ -19,37 +13,11 @@ from database import (
     get_next_concept_to_review
 )
 
-DB_FILE = "data/test_logic.db"
-
 @pytest.fixture(scope="module")
 def db_connection():
-    # Set up: create the database and tables
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
-
-    conn = create_connection(DB_FILE)
-
-    # Manually create tables
-    from database import main
-    main() # this will create the tables in the default db, not test one.
-
-    # We need to create tables in our test db
-    conn.close()
-    # HACK: The main function from database.py uses a hardcoded path.
-    # We will rename the db file to what main() expects, call main, then rename it back.
-    if os.path.exists("data/learning_data.db"):
-        os.remove("data/learning_data.db")
-    os.rename(DB_FILE, "data/learning_data.db")
-    main()
-    os.rename("data/learning_data.db", DB_FILE)
-
-    conn = create_connection(DB_FILE)
+    conn = clone_schema()
     yield conn
-
-    # Tear down: close the connection and remove the database file
     conn.close()
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
 
 
 def test_fsrs_calculations():
@@ -0,0 +1,86 @@
+import datetime
+import pytest
+
+from clock import VirtualClock, use_clock
+from database import add_topic, add_concept, compute_topic_mastery
+from mastery_history import update_mastery_history, backfill_mastery_history, get_mastery_history
+from review import record_review
+
+START = datetime.datetime(2024, 3, 1, 10, 30)
+
+
+@pytest.fixture
+def db_conn(make_db):
+    conn = make_db()
+
+    t1 = add_topic(conn, "Topic 1")
+    t2 = add_topic(conn, "Topic 2")
+    c1 = add_concept(conn, t1, "Concept 1")
+    c2 = add_concept(conn, t1, "Concept 2")
+    c3 = add_concept(conn, t2, "Concept 3")
+    reviews = [(c1, 0, 3), (c2, 0, 1), (c1, 3, 3), (c3, 4, 4), (c2, 6, 3), (c1, 9, 2)]
+    for concept_id, day, grade in reviews:
+        record_review(conn, concept_id, "response", grade, timestamp=START + datetime.timedelta(days=day, hours=day))
+    return conn
+
+
+def test_backfill_matches_live_mastery(db_conn):
+    last_day = START.date() + datetime.timedelta(days=12)
+    assert backfill_mastery_history(db_conn, until=last_day) == 13
+
+    history = get_mastery_history(db_conn, topic_id=1)
+    assert len(history) == 13
+    # The final snapshot is the mastery a live query would report at the end of that day
+    with use_clock(VirtualClock(datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time()))):
+        assert history[-1][2] == pytest.approx(compute_topic_mastery(db_conn, 1))
+        assert get_mastery_history(db_conn, topic_id=2)[-1][2] == pytest.approx(compute_topic_mastery(db_conn, 2))
+    # Topic 2 has no reviewed concepts before day 4
+    assert get_mastery_history(db_conn, topic_id=2)[0][1] == (START.date() + datetime.timedelta(days=4)).isoformat()
+
+
+def test_incremental_updates_match_backfill(db_conn):
+    last_day = START.date() + datetime.timedelta(days=12)
+    for offset in (2, 5, 5, 12):
+        update_mastery_history(db_conn, until=START.date() + datetime.timedelta(days=offset))
+    incremental = get_mastery_history(db_conn)
+
+    backfill_mastery_history(db_conn, until=last_day)
+    backfilled = get_mastery_history(db_conn)
+
+    assert [row[:2] for row in incremental] == [row[:2] for row in backfilled]
+    assert [row[2] for row in incremental] == pytest.approx([row[2] for row in backfilled])
+    assert update_mastery_history(db_conn, until=last_day) == 0
+
+
+def test_backfill_over_gaps(db_conn):
+    # A month without reviews, then one more review
+    record_review(db_conn, 3, "response", 3, timestamp=START + datetime.timedelta(days=40))
+    last_day = START.date() + datetime.timedelta(days=45)
+    assert backfill_mastery_history(db_conn, until=last_day) == 46
+
+    history = get_mastery_history(db_conn, topic_id=2)
+    days = [datetime.date.fromisoformat(day) for _, day, _, _ in history]
+    assert days == [START.date() + datetime.timedelta(days=offset) for offset in range(4, 46)]
+    # Nothing is reviewed in the gap, so mastery only decays
+    gap = [mastery for _, day, mastery, _ in history if days[0] < datetime.date.fromisoformat(day) < days[36]]
+    assert gap == sorted(gap, reverse=True) and gap[0] > gap[-1]
+    assert history[36][2] > history[35][2]
+
+    # A topic with no reviews at all has no history
+    add_topic(db_conn, "Topic 3")
+    assert backfill_mastery_history(db_conn, until=last_day) == 46
+    assert get_mastery_history(db_conn, topic_id=3) == []
+
+
+def test_update_after_past_dated_review(db_conn):
+    update_mastery_history(db_conn, until=START.date() + datetime.timedelta(days=12))
+    # E.g. merged from another device: dated inside the computed history
+    record_review(db_conn, 3, "response", 1, timestamp=START + datetime.timedelta(days=5))
+    last_day = START.date() + datetime.timedelta(days=14)
+    update_mastery_history(db_conn, until=last_day)
+    incremental = get_mastery_history(db_conn)
+
+    backfill_mastery_history(db_conn, until=last_day)
+    backfilled = get_mastery_history(db_conn)
+    assert [row[:2] for row in incremental] == [row[:2] for row in backfilled]
+    assert [row[2] for row in incremental] == pytest.approx([row[2] for row in backfilled])
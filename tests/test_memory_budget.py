@@ -0,0 +1,33 @@
+import json
+import pytest
+
+from memory_budget import (DEFAULT_BUDGETS, MemoryBudget, MemoryBudgetError, profile_memory, check_memory_budgets,
+                           load_budgets)
+
+SIZES = [200, 1000]
+
+
+@pytest.fixture(scope="module")
+def results():
+    return profile_memory(SIZES)
+
+
+def test_operations_within_budget(results):
+    assert len(results) == len(SIZES) * len(DEFAULT_BUDGETS)
+    check_memory_budgets(results)
+
+
+def test_scheduling_memory_does_not_grow_with_deck(results):
+    peaks = {result.concepts: result.peak for result in results if result.operation == "next_concept"}
+    assert peaks[1000] < 2 * peaks[200] + 4096
+
+
+def test_regression_fails_budget(tmp_path):
+    budgets = dict(DEFAULT_BUDGETS, concepts_for_topic=MemoryBudget(1024, 0, 16 * 1024))
+    results = profile_memory([200], ["concepts_for_topic"], budgets)
+    with pytest.raises(MemoryBudgetError, match="1 over budget"):
+        check_memory_budgets(results)
+
+    path = tmp_path / "budgets.json"
+    path.write_text(json.dumps({"forecast": {"peak_per_concept": 1}}))
+    assert load_budgets(str(path))["forecast"] == DEFAULT_BUDGETS["forecast"]._replace(peak_per_concept=1)
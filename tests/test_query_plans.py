@@ -0,0 +1,46 @@
+import pytest
+
+from database import create_connection, main as create_db
+from query_plans import (classify, check_query_plans, assert_query_plans, load_hot_queries,
+                         QueryPlanError)
+from cli import main as cli_main
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / "learning.db")
+    create_db(path)
+    conn = create_connection(path)
+    yield conn
+    conn.close()
+
+
+def test_classify():
+    assert classify("SEARCH recall_sessions USING INDEX idx_x (concept_id=?)").kind == "seek"
+    assert classify("SEARCH TABLE topics USING INTEGER PRIMARY KEY (rowid=?)").table == "topics"
+    assert classify("SCAN concept_learning_progress").table == "concept_learning_progress"
+    assert classify("SCAN c USING COVERING INDEX idx_concepts_topic").kind == "scan"
+    assert classify("USE TEMP B-TREE FOR ORDER BY").kind == "temp sort"
+    # MAX() walking an index that does not lead with the filtered column
+    assert classify("SEARCH recall_sessions USING INDEX idx_recall_sessions_timestamp").kind == "scan"
+    assert classify("CORRELATED SCALAR SUBQUERY 1").kind == "other"
+
+
+def test_hot_queries_use_indexes(conn):
+    assert {"next_concept.reviewed", "schedule_review.last_review",
+            "technique_id_by_name"} <= set(load_hot_queries())
+    assert "0 with unexpected plans" in assert_query_plans(conn)
+
+
+def test_dropped_index_is_reported(conn, tmp_path):
+    conn.execute("DROP INDEX idx_recall_sessions_concept_timestamp")
+    conn.commit()
+    failed = {check.query.name for check in check_query_plans(conn) if check.problems}
+    # The timestamp index still serves ORDER BY and MAX(), but only by walking all of it
+    assert {"allocate_technique.grades", "schedule_review.last_review", "topic_mastery.last_review"} <= failed
+    with pytest.raises(QueryPlanError, match="full scan of recall_sessions"):
+        assert_query_plans(conn)
+
+    # Opening the database from the command line restores the index
+    cli_main(["--db", str(tmp_path / "learning.db"), "plans"])
+    assert not any(check.problems for check in check_query_plans(conn))
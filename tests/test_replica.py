@@ -0,0 +1,65 @@
+import sqlite3
+import datetime
+import pytest
+
+from database import (create_connection, main as create_db, add_topic, add_concepts,
+                      get_all_topics_with_mastery, get_next_concept_to_review)
+from review import record_review
+from replica import ReplicatedConnection, open_replicated, is_write
+
+START = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "learning.db")
+    create_db(path)
+    return path
+
+
+def _dump(conn, table):
+    return conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+
+
+def test_is_write():
+    assert is_write("INSERT INTO topics(name) VALUES(?)")
+    assert is_write("  update learning_data SET stability = 1")
+    assert is_write("WITH x AS (SELECT 1) DELETE FROM topics WHERE id IN x")
+    assert not is_write("SELECT * FROM topics")
+    assert not is_write("WITH x AS (SELECT 1) SELECT * FROM x")
+    assert not is_write("PRAGMA page_count")
+
+
+@pytest.mark.parametrize("async_writes", [True, False])
+def test_writes_reach_disk(db_file, async_writes):
+    conn = ReplicatedConnection(db_file, async_writes=async_writes)
+    topic_id = add_topic(conn, "Physics")
+    concept_ids = add_concepts(conn, topic_id, ["F = ma", "E = mc^2"])
+    for concept_id in concept_ids:
+        record_review(conn, concept_id, "answer", 3, timestamp=START)
+    assert get_next_concept_to_review(conn) is not None
+    assert [name for _, name, _ in get_all_topics_with_mastery(conn)] == ["Physics"]
+
+    # A rolled back write never reaches the file
+    conn.execute("INSERT INTO topics(name) VALUES ('Discarded')")
+    conn.rollback()
+
+    conn.flush()
+    disk = create_connection(db_file)
+    for table in ["topics", "concepts", "recall_sessions", "learning_data", "concept_minhash", "change_log"]:
+        assert _dump(disk, table) == _dump(conn, table), table
+    disk.close()
+
+    assert conn.memory_bytes() > 0
+    conn.close()
+    assert conn.disk_error is None
+
+
+def test_falls_back_to_disk_when_too_large(db_file):
+    conn, mode = open_replicated(db_file, max_bytes=1)
+    assert isinstance(conn, sqlite3.Connection) and mode.startswith("disk")
+    conn.close()
+
+    conn, mode = open_replicated(db_file)
+    assert isinstance(conn, ReplicatedConnection) and "RAM" in mode
+    conn.close()
@@ -0,0 +1,108 @@
+import os
+import asyncio
+import sqlite3
+import pytest
+
+from service import ReviewService, ReviewClient
+
+
+async def _run_session(decks_dir):
+    service = ReviewService(decks_dir, max_workers=4)
+    server = await service.start("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await ReviewClient.connect("127.0.0.1", port)
+    try:
+        imported = await client.call("import", deck="alice", topic="Capitals",
+                                     concepts=[f"Capital number {i}" for i in range(20)])
+        assert len(imported["concept_ids"]) == 20
+
+        card = await client.call("next_card", deck="alice")
+        assert card["concept_id"] in imported["concept_ids"]
+        assert card["technique"]
+
+        # Concurrent submits are written in shared transactions
+        reviews = await asyncio.gather(*(
+            client.call("submit_review", deck="alice", concept_id=concept_id,
+                        response=f"Capital number {i}", technique=card["technique"])
+            for i, concept_id in enumerate(imported["concept_ids"])))
+        assert [review["concept_id"] for review in reviews] == imported["concept_ids"]
+        assert all(review["is_new"] and review["grade"] == 4 for review in reviews)
+
+        mastery = await client.call("mastery", deck="alice")
+        assert [topic["name"] for topic in mastery] == ["Capitals"]
+        assert mastery[0]["mastery"] > 0.9
+
+        # Errors come back as responses without closing the connection
+        with pytest.raises(RuntimeError):
+            await client.call("submit_review", deck="alice", concept_id=9999, response="x")
+        with pytest.raises(RuntimeError):
+            await client.call("no_such_op")
+        assert await client.call("next_card", deck="bob") is None
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+
+
+def test_service_round_trip(tmp_path):
+    decks_dir = str(tmp_path / "decks")
+    asyncio.run(_run_session(decks_dir))
+
+    conn = sqlite3.connect(os.path.join(decks_dir, "alice.db"))
+    assert conn.execute("SELECT COUNT(*) FROM recall_sessions").fetchone()[0] == 20
+    assert conn.execute("SELECT COUNT(*) FROM learning_data").fetchone()[0] == 20
+    conn.close()
+
+
+async def _submit_mixed_batch(decks_dir):
+    service = ReviewService(decks_dir, max_workers=2, batch_window=0.05)
+    server = await service.start("127.0.0.1", 0)
+    client = await ReviewClient.connect("127.0.0.1", server.sockets[0].getsockname()[1])
+    try:
+        imported = await client.call("import", deck="alice", topic="Capitals",
+                                     concepts=["Paris is the capital of France", "Rome is the capital of Italy",
+                                               "Bern is the capital of Switzerland"])
+        paris, rome, bern = imported["concept_ids"]
+        # Writing Bern's FSRS state fails inside the database, after its
+        # session row was inserted
+        conn = sqlite3.connect(os.path.join(decks_dir, "alice.db"))
+        conn.execute(f"""CREATE TRIGGER fail_bern BEFORE INSERT ON learning_data WHEN NEW.concept_id = {bern}
+                         BEGIN SELECT RAISE(ABORT, 'disk full'); END""")
+        conn.commit()
+        conn.close()
+
+        # Submitted together, so written as one batch
+        return paris, rome, bern, await asyncio.gather(
+            client.call("submit_review", deck="alice", concept_id=paris, response="Paris", grade=3),
+            client.call("submit_review", deck="alice", concept_id=rome, response="Rome", grade=7),
+            client.call("submit_review", deck="alice", concept_id=rome, response="Rome", grade="3"),
+            client.call("submit_review", deck="alice", concept_id=rome, response=None),
+            client.call("submit_review", deck="alice", concept_id=9999, response="Oslo", grade=3),
+            client.call("submit_review", deck="alice", concept_id=bern, response="Bern", grade=3),
+            client.call("submit_review", deck="alice", concept_id=rome, response="Rome is the capital of Italy"),
+            return_exceptions=True)
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+
+
+def test_failing_reviews_do_not_roll_back_the_batch(tmp_path):
+    decks_dir = str(tmp_path / "decks")
+    paris, rome, bern, results = asyncio.run(_submit_mixed_batch(decks_dir))
+
+    assert results[0]["concept_id"] == paris and results[0]["grade"] == 3
+    assert results[6]["concept_id"] == rome and results[6]["grade"] == 4
+    errors = [str(result) for result in results[1:6]]
+    assert all(isinstance(result, RuntimeError) for result in results[1:6])
+    assert "Invalid grade 7" in errors[0] and "Invalid grade '3'" in errors[1]
+    assert "must be a string" in errors[2] and "Unknown concept 9999" in errors[3]
+    assert "Failed to record" in errors[4]
+
+    conn = sqlite3.connect(os.path.join(decks_dir, "alice.db"))
+    sessions = conn.execute("SELECT concept_id, user_response FROM recall_sessions ORDER BY id").fetchall()
+    assert sessions == [(paris, "Paris"), (rome, "Rome is the capital of Italy")]
+    assert [row[0] for row in conn.execute("SELECT concept_id FROM learning_data ORDER BY concept_id")] == [paris, rome]
+    conn.close()
@@ -0,0 +1,56 @@
+import os
+import datetime
+import pytest
+
+from clock import VirtualClock, use_clock
+from database import add_topic, add_concept
+from review import record_review
+from shards import DeckManager, global_next_reviews, global_mastery
+
+START = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = DeckManager(str(tmp_path / "decks"))
+    yield manager
+    manager.close_all()
+
+
+def test_open_deck_creates_schema(manager):
+    conn = manager.open_deck("alice")
+    assert os.path.exists(manager.deck_path("alice"))
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert {"topics", "concepts", "recall_sessions", "learning_data"} <= tables
+    assert manager.open_deck("alice") is conn
+    assert manager.list_decks() == ["alice"]
+
+    with pytest.raises(ValueError):
+        manager.deck_path("../escape")
+
+
+def test_cross_deck_queries(manager):
+    alice = manager.open_deck("alice")
+    bob = manager.open_deck("bob")
+    a_topic = add_topic(alice, "Algebra")
+    b_topic = add_topic(bob, "Biology")
+    a_old = add_concept(alice, a_topic, "Old algebra concept")
+    a_recent = add_concept(alice, a_topic, "Recent algebra concept")
+    b_mid = add_concept(bob, b_topic, "Biology concept")
+    b_new = add_concept(bob, b_topic, "New biology concept")
+    record_review(alice, a_old, "response", 3, timestamp=START)
+    record_review(alice, a_recent, "response", 3, timestamp=START + datetime.timedelta(days=20))
+    record_review(bob, b_mid, "response", 3, timestamp=START + datetime.timedelta(days=10))
+
+    # Force one deck per ATTACH batch to exercise merging across batches
+    manager.attach_batch_size = 1
+
+    with use_clock(VirtualClock(START + datetime.timedelta(days=21))):
+        next_reviews = global_next_reviews(manager, limit=3)
+        mastery = global_mastery(manager)
+
+    assert [(deck, concept_id) for deck, concept_id, *_ in next_reviews] == [
+        ("bob", b_new), ("alice", a_old), ("bob", b_mid)]
+    assert next_reviews[0][4] is None
+    assert [(deck, name, count) for deck, _, name, _, count in mastery] == [("alice", "Algebra", 2), ("bob", "Biology", 1)]
+    assert all(0 < row[3] <= 1 for row in mastery)
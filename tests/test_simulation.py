@@ -0,0 +1,51 @@
+import datetime
+
+import clock
+from clock import VirtualClock, use_clock
+from database import add_topic, add_concept, initialize_learning_data, record_recall_session, get_next_concept_to_review
+from simulation import simulate_learners, get_deck_size
+
+
+def test_virtual_clock_drives_scheduling(db_conn):
+    start = datetime.datetime(2024, 1, 1, 9, 0, 0)
+    virtual = VirtualClock(start)
+    topic_id = add_topic(db_conn, "Topic")
+    c1 = add_concept(db_conn, topic_id, "Concept 1")
+    c2 = add_concept(db_conn, topic_id, "Concept 2")
+    initialize_learning_data(db_conn, c1, 5, 10)
+    initialize_learning_data(db_conn, c2, 5, 10)
+
+    with use_clock(virtual):
+        record_recall_session(db_conn, c1, "response", 3)
+        virtual.advance(days=30)
+        record_recall_session(db_conn, c2, "response", 3)
+        next_concept = get_next_concept_to_review(db_conn)
+
+    assert next_concept[0] == c1
+    timestamps = [row[0] for row in db_conn.execute("SELECT timestamp FROM recall_sessions ORDER BY id")]
+    assert timestamps == [start.isoformat(), (start + datetime.timedelta(days=30)).isoformat()]
+    assert not isinstance(clock.get_clock(), VirtualClock)
+
+
+def test_get_deck_size(db_conn):
+    topic_id = add_topic(db_conn, "Topic")
+    for i in range(3):
+        add_concept(db_conn, topic_id, f"Concept {i}")
+    assert get_deck_size(db_conn) == 3
+
+
+def test_simulate_learners_metrics():
+    result = simulate_learners(deck_size=50, n_learners=20, days=60, new_per_day=5, workers=1, chunk_size=10)
+
+    assert result['learners'] == 20
+    assert len(result['daily_reviews']) == 60
+    assert result['total_reviews'] > 0
+    assert 0 < result['retention'] <= 1
+    assert 0 < result['mean_retrievability'] <= 1
+    assert sum(result['techniques'].values()) == result['total_reviews']
+
+
+def test_simulate_learners_is_reproducible_across_workers():
+    in_process = simulate_learners(deck_size=30, n_learners=8, days=30, workers=1, chunk_size=4, seed=7)
+    parallel = simulate_learners(deck_size=30, n_learners=8, days=30, workers=2, chunk_size=4, seed=7)
+    assert in_process == parallel
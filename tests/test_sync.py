@@ -0,0 +1,257 @@
+import datetime
+import gzip
+import json
+import pytest
+
+from database import create_connection, main as create_db, add_topic, add_concepts
+from archive import archive_responses
+from review import record_review, replay_reviews
+from sync import create_sync_tables, get_device_id, export_changes, import_changes, prune_change_log
+
+START = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+
+def _device(path):
+    create_db(str(path))
+    return create_connection(str(path))
+
+
+def _state(conn):
+    return {
+        "sessions": conn.execute("""
+            SELECT c.content, rs.timestamp, rs.ai_grade FROM recall_sessions rs
+            JOIN concepts c ON c.id = rs.concept_id ORDER BY c.content, rs.timestamp
+        """).fetchall(),
+        "learning_data": conn.execute("""
+            SELECT c.content, ld.difficulty, ld.stability FROM learning_data ld
+            JOIN concepts c ON c.id = ld.concept_id ORDER BY c.content
+        """).fetchall(),
+    }
+
+
+def _concept_id(conn, content):
+    return conn.execute("SELECT id FROM concepts WHERE content = ?", (content,)).fetchone()[0]
+
+
+@pytest.fixture
+def devices(tmp_path):
+    laptop = _device(tmp_path / "laptop.db")
+    desktop = _device(tmp_path / "desktop.db")
+    yield laptop, desktop
+    laptop.close()
+    desktop.close()
+
+
+def test_delta_sync_merges_concurrent_reviews(devices, tmp_path):
+    laptop, desktop = devices
+    laptop_id, desktop_id = get_device_id(laptop), get_device_id(desktop)
+
+    # Concepts created on the laptop reach the desktop
+    topic_id = add_topic(laptop, "Chemistry")
+    add_concepts(laptop, topic_id, ["Water is H2O", "Salt is NaCl"])
+    record_review(laptop, _concept_id(laptop, "Water is H2O"), "H2O", 3, timestamp=START)
+    export_changes(laptop, tmp_path / "1.sync", desktop_id)
+    assert import_changes(desktop, tmp_path / "1.sync")["merged"] > 0
+    assert _state(desktop) == _state(laptop)
+
+    # Both devices review the same concept while apart
+    record_review(laptop, _concept_id(laptop, "Water is H2O"), "H2O", 4,
+                  timestamp=START + datetime.timedelta(days=3))
+    record_review(desktop, _concept_id(desktop, "Water is H2O"), "water", 2,
+                  timestamp=START + datetime.timedelta(days=5))
+    record_review(desktop, _concept_id(desktop, "Salt is NaCl"), "NaCl", 3,
+                  timestamp=START + datetime.timedelta(days=5))
+
+    export_changes(laptop, tmp_path / "2.sync", desktop_id)
+    export_changes(desktop, tmp_path / "3.sync", laptop_id)
+    import_changes(desktop, tmp_path / "2.sync")
+    import_changes(laptop, tmp_path / "3.sync")
+
+    # Both hold every review and the same FSRS state, replayed in timestamp order
+    assert _state(laptop) == _state(desktop)
+    assert len(_state(laptop)["sessions"]) == 4
+
+    # Only the deltas travel: merged changes are not echoed back to their origin
+    export_changes(desktop, tmp_path / "4.sync", laptop_id)
+    with gzip.open(tmp_path / "4.sync", "rt") as source:
+        assert [json.loads(line) for line in source][1:] == []
+
+    # Re-importing an applied file is a no-op
+    assert import_changes(desktop, tmp_path / "2.sync") == {"merged": 0, "replayed": 0}
+    with pytest.raises(ValueError):
+        import_changes(laptop, tmp_path / "2.sync")
+
+    # Changes are pruned once every peer has acknowledged merging them, which
+    # the laptop does with its next export
+    assert prune_change_log(desktop) == 0
+    import_changes(laptop, tmp_path / "4.sync")
+    export_changes(laptop, tmp_path / "5.sync", desktop_id)
+    import_changes(desktop, tmp_path / "5.sync")
+    assert desktop.execute("SELECT COUNT(*) FROM change_log").fetchone()[0] == 0
+
+
+def test_corrupt_entry_rolls_back_the_import(devices, tmp_path):
+    laptop, desktop = devices
+    add_concepts(laptop, add_topic(laptop, "Chemistry"), ["Water is H2O"])
+    export_changes(laptop, tmp_path / "1.sync", get_device_id(desktop))
+    with gzip.open(tmp_path / "1.sync", "rt") as source:
+        lines = source.read().splitlines()
+    # A review entry without its timestamp
+    lines.append(json.dumps({"table": "recall_sessions", "old": None,
+                             "new": {"topic": "Chemistry", "concept": "Water is H2O", "ai_grade": 3}}))
+    with gzip.open(tmp_path / "1.sync", "wt") as target:
+        target.write("\n".join(lines) + "\n")
+
+    with pytest.raises(KeyError):
+        import_changes(desktop, tmp_path / "1.sync")
+    assert not desktop.in_transaction
+    assert desktop.execute("SELECT COUNT(*) FROM sync_apply_origin").fetchone()[0] == 0
+    assert desktop.execute("SELECT COUNT(*) FROM concepts").fetchone()[0] == 0
+
+    # Later local writes are exported back to the laptop
+    add_concepts(desktop, add_topic(desktop, "Physics"), ["F = ma"])
+    export_changes(desktop, tmp_path / "2.sync", get_device_id(laptop))
+    import_changes(laptop, tmp_path / "2.sync")
+    assert _concept_id(laptop, "F = ma")
+
+
+@pytest.mark.parametrize("laptop_first", [True, False])
+def test_conflicting_edits_converge(devices, tmp_path, laptop_first):
+    laptop, desktop = devices
+    laptop_id, desktop_id = get_device_id(laptop), get_device_id(desktop)
+    add_concepts(laptop, add_topic(laptop, "Chemistry"), ["Water", "Salt is NaCl"])
+    record_review(laptop, _concept_id(laptop, "Salt is NaCl"), "NaCl", 3, timestamp=START)
+    export_changes(laptop, tmp_path / "1.sync", desktop_id)
+    import_changes(desktop, tmp_path / "1.sync")
+
+    # The same concept renamed and the same session regraded on both devices
+    for conn, name, grade in ((laptop, "laptop", 1), (desktop, "desktop", 4)):
+        conn.execute("UPDATE concepts SET content = ? WHERE content = 'Water'", (f"Water ({name})",))
+        conn.execute("UPDATE recall_sessions SET ai_grade = ?", (grade,))
+        replay_reviews(conn, [_concept_id(conn, "Salt is NaCl")])
+    export_changes(laptop, tmp_path / "2.sync", desktop_id)
+    export_changes(desktop, tmp_path / "3.sync", laptop_id)
+    if laptop_first:
+        import_changes(laptop, tmp_path / "3.sync")
+        import_changes(desktop, tmp_path / "2.sync")
+    else:
+        import_changes(desktop, tmp_path / "2.sync")
+        import_changes(laptop, tmp_path / "3.sync")
+    for name in ("4", "5"):
+        export_changes(laptop, tmp_path / f"{name}l.sync", desktop_id)
+        import_changes(desktop, tmp_path / f"{name}l.sync")
+        export_changes(desktop, tmp_path / f"{name}d.sync", laptop_id)
+        import_changes(laptop, tmp_path / f"{name}d.sync")
+
+    # The device with the greater id wins both conflicts, on both sides
+    winner, grade = ("laptop", 1) if laptop_id > desktop_id else ("desktop", 4)
+    for conn in devices:
+        assert conn.execute("SELECT content FROM concepts ORDER BY content").fetchall() == \
+            [("Salt is NaCl",), (f"Water ({winner})",)]
+        assert conn.execute("SELECT ai_grade FROM recall_sessions").fetchall() == [(grade,)]
+        assert conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0] == 0
+    assert _state(laptop) == _state(desktop)
+
+
+def test_failing_import_leaves_nothing_behind(devices, tmp_path):
+    laptop, desktop = devices
+    concept_id = add_concepts(laptop, add_topic(laptop, "Chemistry"), ["Water is H2O"])[0]
+    record_review(laptop, concept_id, "H2O", 3, timestamp=START)
+    export_changes(laptop, tmp_path / "1.sync", get_device_id(desktop))
+    with gzip.open(tmp_path / "1.sync", "rt") as source:
+        good = source.read()
+    # A progress entry without its count fails after the concepts and
+    # sessions before it were merged
+    entry = {"table": "concept_learning_progress", "old": None,
+             "new": {"topic": "Chemistry", "concept": "Water is H2O", "digest": None,
+                     "technique": "Mnemonic", "last_applied_timestamp": None}}
+    with gzip.open(tmp_path / "bad.sync", "wt") as target:
+        target.write(good + json.dumps(entry) + "\n")
+    desktop.execute("INSERT INTO learning_techniques (name) VALUES ('Mnemonic') ON CONFLICT DO NOTHING")
+    desktop.commit()
+
+    with pytest.raises(KeyError):
+        import_changes(desktop, tmp_path / "bad.sync")
+    assert not desktop.in_transaction
+    for table in ("concepts", "recall_sessions", "learning_data", "sync_peers", "change_log"):
+        assert desktop.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0, table
+
+    # The intact file still merges in full
+    with gzip.open(tmp_path / "good.sync", "wt") as target:
+        target.write(good)
+    import_changes(desktop, tmp_path / "good.sync")
+    assert _state(desktop) == _state(laptop)
+
+
+def _logged(conn):
+    return conn.execute("SELECT table_name, op FROM change_log ORDER BY seq").fetchall()
+
+
+def test_changes_are_logged_once_a_peer_is_registered(devices, tmp_path):
+    laptop, desktop = devices
+    topic_id = add_topic(laptop, "Chemistry")
+    add_concepts(laptop, topic_id, ["Water is H2O"])
+    assert _logged(laptop) == []
+
+    # The first export carries every row; later ones only the logged changes
+    assert export_changes(laptop, tmp_path / "1.sync", get_device_id(desktop)) == 1
+    add_concepts(laptop, topic_id, ["Salt is NaCl"])
+    assert _logged(laptop) == [("concepts", "insert")]
+    assert export_changes(laptop, tmp_path / "2.sync", get_device_id(desktop)) == 1
+    import_changes(desktop, tmp_path / "1.sync")
+    import_changes(desktop, tmp_path / "2.sync")
+    assert desktop.execute("SELECT content FROM concepts ORDER BY content").fetchall() == \
+        [("Salt is NaCl",), ("Water is H2O",)]
+
+
+def test_archiving_responses_is_not_logged(devices, tmp_path):
+    laptop, desktop = devices
+    export_changes(laptop, tmp_path / "1.sync", get_device_id(desktop))
+    concept_id = add_concepts(laptop, add_topic(laptop, "Chemistry"), ["Water is H2O"])[0]
+    record_review(laptop, concept_id, "H2O", 3, timestamp=START)
+    logged = _logged(laptop)
+
+    assert archive_responses(laptop, older_than_days=30, now=START + datetime.timedelta(days=60)) == 1
+    assert _logged(laptop) == logged
+
+    # The archived response is still exported with its session
+    export_changes(laptop, tmp_path / "2.sync", get_device_id(desktop))
+    import_changes(desktop, tmp_path / "1.sync")
+    import_changes(desktop, tmp_path / "2.sync")
+    assert desktop.execute("SELECT user_response FROM recall_sessions").fetchall() == [("H2O",)]
+
+
+def test_payload_change_log_is_converted(devices, tmp_path):
+    laptop, desktop = devices
+    laptop.executescript("""
+        DROP TABLE change_log;
+        CREATE TABLE change_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL,
+                                 row_id INTEGER NOT NULL, old TEXT, new TEXT, origin TEXT);
+        INSERT INTO change_log (seq, table_name, row_id, old, new) VALUES
+            (41, 'concepts', 1, NULL, '{"topic":"Chemistry","concept":"Water","digest":null}'),
+            (42, 'concepts', 1, '{"topic":"Chemistry","concept":"Water","digest":null}',
+                                '{"topic":"Chemistry","concept":"Water is H2O","digest":null}'),
+            (43, 'learning_data', 1, '{"topic":"Chemistry","concept":"Water is H2O","digest":null,"stability":1.0}',
+                                     '{"topic":"Chemistry","concept":"Water is H2O","digest":null,"stability":2.0}');
+        INSERT INTO sync_peers (peer_id) VALUES ('desktop');
+    """)
+    create_sync_tables(laptop)
+    assert laptop.execute("SELECT seq, op, old_key FROM change_log ORDER BY seq").fetchall() == [
+        (41, "insert", None),
+        (42, "update", '{"topic":"Chemistry","concept":"Water","digest":null}'),
+        (43, "update", None),
+    ]
+    add_topic(laptop, "Physics")
+    add_concepts(laptop, 1, ["F = ma"])
+    assert laptop.execute("SELECT MAX(seq) FROM change_log").fetchone()[0] == 44
+
+    # Without peers nothing is kept, but sequence numbers go on
+    desktop.executescript("""
+        DROP TABLE change_log;
+        CREATE TABLE change_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL,
+                                 row_id INTEGER NOT NULL, old TEXT, new TEXT, origin TEXT);
+        INSERT INTO change_log (seq, table_name, row_id, old, new) VALUES (7, 'concepts', 1, NULL, '{}');
+    """)
+    create_sync_tables(desktop)
+    assert _logged(desktop) == []
+    assert desktop.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone() == (7,)
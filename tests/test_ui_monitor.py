@@ -0,0 +1,60 @@
+import json
+import time
+
+from ui_monitor import UIMonitor, percentile
+
+
+class FakeRoot:
+    """Records after() callbacks instead of running a Tk event loop."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, callback):
+        self.scheduled.append(callback)
+
+
+class Handlers:
+    def slow(self):
+        time.sleep(0.02)
+        return "done"
+
+    def fast(self):
+        return "done"
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_monitor_times_handlers_and_samples_stalls(tmp_path):
+    root = FakeRoot()
+    metrics_path = str(tmp_path / "metrics.json")
+    monitor = UIMonitor(root, metrics_path, heartbeat_ms=10, stall_ms=50)
+
+    handlers = Handlers()
+    monitor.instrument(handlers, ["slow", "fast"])
+    monitor.start()
+    assert handlers.slow() == "done" and handlers.fast() == "done"
+
+    # The heartbeat is not run while the main thread blocks: a stall
+    time.sleep(0.3)
+    root.scheduled[0]()
+    monitor.stop()
+
+    summary = monitor.summary()
+    assert summary["slow"]["count"] == 1 and summary["slow"]["p50"] >= 20
+    assert summary["fast"]["p99"] < summary["slow"]["p99"]
+    assert summary["event_loop_lag"]["max"] >= 250
+    assert "slowest slow" in monitor.status_text()
+
+    with open(metrics_path) as metrics_file:
+        metrics = json.load(metrics_file)
+    assert metrics["stall_count"] >= 1
+    # The stall sample shows where the main thread was stuck
+    assert any("time.sleep(0.3)" in line for line in metrics["stalls"][0]["stack"])
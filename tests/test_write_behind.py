@@ -0,0 +1,87 @@
+import os
+import datetime
+import pytest
+
+from database import add_topic, add_concept
+from review import record_review
+from write_behind import ReviewWriteBehind
+
+START = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def db_conn(make_db):
+    conn = make_db()
+    topic_id = add_topic(conn, "Topic")
+    add_concept(conn, topic_id, "Concept")
+    return conn
+
+
+def count_sessions(conn):
+    return conn.execute("SELECT COUNT(*) FROM recall_sessions").fetchone()[0]
+
+
+def test_submit_is_buffered_until_flush(db_conn, tmp_path):
+    buffer = ReviewWriteBehind(db_conn, str(tmp_path / "journal.jsonl"), fsync=False)
+    first = buffer.submit(1, "first", 3, technique="Recall", timestamp=START)
+    second = buffer.submit(1, "second", 3, technique="Recall", timestamp=START + datetime.timedelta(days=4))
+
+    assert count_sessions(db_conn) == 0
+    assert buffer.pending_concept_ids() == {1}
+    assert first[2] and not second[2]
+
+    assert buffer.flush() == 2
+    assert count_sessions(db_conn) == 2
+    assert buffer.pending_concept_ids() == set()
+    assert os.path.getsize(tmp_path / "journal.jsonl") == 0
+
+    # The buffered result matches writing the reviews directly
+    stability = db_conn.execute("SELECT stability FROM learning_data WHERE concept_id = 1").fetchone()[0]
+    assert stability == pytest.approx(second[1])
+    buffer.close()
+
+
+def test_journal_is_replayed_after_crash(db_conn, tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    buffer = ReviewWriteBehind(db_conn, journal_path, fsync=False)
+    buffer.submit(1, "first", 3, timestamp=START)
+    buffer.submit(1, "second", 4, timestamp=START + datetime.timedelta(days=2))
+    # Simulate a crash: the journal survives, the queue does not
+    buffer.journal.close()
+    with open(journal_path, "a") as journal:
+        journal.write('{"concept_id": 1, "user_resp')
+
+    reopened = ReviewWriteBehind(db_conn, journal_path, fsync=False)
+    assert count_sessions(db_conn) == 2
+    assert [row[0] for row in db_conn.execute("SELECT ai_grade FROM recall_sessions ORDER BY id")] == [3, 4]
+    reopened.close()
+
+
+def test_replay_skips_reviews_already_flushed(db_conn, tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    buffer = ReviewWriteBehind(db_conn, journal_path, fsync=False)
+    buffer.submit(1, "first", 3, timestamp=START)
+    # Crash after the flush committed but before the journal was truncated
+    record_review(db_conn, 1, "first", 3, timestamp=START)
+    buffer.journal.close()
+
+    ReviewWriteBehind(db_conn, journal_path, fsync=False).close()
+    assert count_sessions(db_conn) == 1
+
+
+def test_quick_reviews_are_flushed_together(db_conn, tmp_path):
+    commits = []
+    db_conn.set_trace_callback(lambda sql: sql.strip().upper() == "COMMIT" and commits.append(sql))
+    buffer = ReviewWriteBehind(db_conn, str(tmp_path / "journal.jsonl"), fsync=False, max_pending=5)
+
+    # Reviews in quick succession are not committed one by one
+    for day in range(4):
+        buffer.submit(1, "response", 3, timestamp=START + datetime.timedelta(days=day))
+        assert buffer.flush_if_full() == 0
+    assert commits == [] and count_sessions(db_conn) == 0
+
+    # The batch is written once it is full
+    buffer.submit(1, "response", 3, timestamp=START + datetime.timedelta(days=4))
+    assert buffer.flush_if_full() == 5
+    assert len(commits) == 1 and count_sessions(db_conn) == 5
+    buffer.close()